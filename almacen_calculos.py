@@ -0,0 +1,42 @@
+"""
+Almacén de los cálculos recientes. Permite generar los reportes en el
+servidor a partir del identificador devuelto por /calcular, sin que el cliente
+tenga que reenviar los resultados ni el HTML.
+"""
+import hashlib
+import json
+
+from estado import EstadoMemoria
+
+def identificador_calculo(data):
+    """Huella SHA-256 del JSON canónico de la petición: la misma entrada da el mismo id."""
+    canonico = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+def _codificar(resultados):
+    # El módulo json, no orjson: NaN e infinitos vuelven tal cual al leerlos
+    return json.dumps(resultados, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+class AlmacenCalculos:
+    """
+    Guarda los resultados de los últimos `max_entradas` cálculos (LRU) en el espacio
+    'calculos' del backend de estado (estado.py). Con el backend en memoria es local a
+    cada proceso: con varios workers, un id creado en otro proceso no se encuentra y el
+    cliente debe enviar los resultados completos. Con el backend en archivos lo
+    comparten todas las instancias del nodo.
+    """
+
+    def __init__(self, max_entradas=500, estado=None):
+        self.max_entradas = max_entradas
+        self._espacio = (estado or EstadoMemoria()).espacio(
+            'calculos', codificar=_codificar, decodificar=json.loads, max_entradas=max(max_entradas, 0),
+        )
+
+    def guardar(self, calculo_id, resultados):
+        self._espacio.guardar(calculo_id, resultados)
+
+    def obtener(self, calculo_id):
+        return self._espacio.obtener(calculo_id)
+
+    def __len__(self):
+        return self._espacio.estadisticas()['entradas']
@@ -0,0 +1,104 @@
+"""
+Configuración del sitio (patrones, textos del sitio y tablas de EMT) con recarga en
+caliente: los archivos se vuelven a leer cuando cambia su fecha de modificación, sin
+reiniciar el servidor.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from calculadora import IndiceEMT
+
+# Clave de la configuración -> archivo JSON en el directorio de configuración
+ARCHIVOS_CONFIGURACION = {
+    'especificaciones_patrones': 'patrones.json',
+    'site_config': 'site_config.json',
+    'emts_config': 'emts.json',
+}
+
+logger = logging.getLogger(__name__)
+
+class AlmacenConfiguracion:
+    """
+    Mantiene una instantánea inmutable de la configuración y el índice de EMT.
+
+    `actual()` devuelve la instantánea vigente; como mucho cada `intervalo_revision_s`
+    comprueba la fecha de modificación de los archivos y, si cambió, construye una
+    instantánea nueva y la publica de una sola asignación. Las peticiones en curso
+    conservan la instantánea que ya tenían, y si otro hilo está recargando se sigue
+    devolviendo la anterior en lugar de esperar.
+    """
+
+    def __init__(self, directorio, intervalo_revision_s=2.0, busqueda_emt='exacta'):
+        self.directorio = directorio
+        self.intervalo_revision_s = intervalo_revision_s
+        self.busqueda_emt = busqueda_emt
+        self.errores = {}
+        self._lock = threading.Lock()
+        self._firmas = {}
+        self._proxima_revision = 0.0
+        self._instantanea = self._construir({clave: {} for clave in ARCHIVOS_CONFIGURACION})
+        self.recargar()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, ARCHIVOS_CONFIGURACION[clave])
+
+    def _firma(self, clave):
+        try:
+            estado = os.stat(self._ruta(clave))
+        except OSError:
+            return None
+        return (estado.st_mtime_ns, estado.st_size)
+
+    def _construir(self, contenidos):
+        instantanea = dict(contenidos)
+        instantanea['indice_emt'] = IndiceEMT(contenidos['emts_config'])
+        instantanea['busqueda_emt'] = self.busqueda_emt
+        # Huella del contenido: un resultado guardado con otra revisión ya no vale, y
+        # las instancias que leen los mismos archivos comparten la revisión
+        canonico = json.dumps([contenidos, self.busqueda_emt], sort_keys=True, default=str)
+        instantanea['revision'] = hashlib.blake2b(canonico.encode('utf-8'), digest_size=8).hexdigest()
+        return instantanea
+
+    def recargar(self, forzar=False):
+        """
+        Vuelve a leer los archivos que cambiaron (o todos con `forzar`). Un archivo que
+        no se puede leer conserva su contenido anterior y queda registrado en `errores`.
+        Devuelve True si se publicó una instantánea nueva.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._proxima_revision = time.monotonic() + self.intervalo_revision_s
+            anterior = self._instantanea
+            contenidos = {clave: anterior[clave] for clave in ARCHIVOS_CONFIGURACION}
+            cambios = False
+            for clave in ARCHIVOS_CONFIGURACION:
+                firma = self._firma(clave)
+                if not forzar and clave in self._firmas and firma == self._firmas[clave]:
+                    continue
+                self._firmas[clave] = firma
+                try:
+                    with open(self._ruta(clave), 'r', encoding='utf-8') as f:
+                        contenidos[clave] = json.load(f)
+                    self.errores.pop(clave, None)
+                    cambios = True
+                except Exception as e:
+                    self.errores[clave] = str(e)
+                    if anterior[clave]:
+                        # En la carga inicial el error lo informa quien crea el almacén
+                        logger.error(f"No se pudo recargar {ARCHIVOS_CONFIGURACION[clave]}; se conserva la versión anterior: {e}")
+            if cambios:
+                self._instantanea = self._construir(contenidos)
+            return cambios
+        finally:
+            self._lock.release()
+
+    def actual(self):
+        """Instantánea vigente, revisando antes si algún archivo cambió."""
+        if time.monotonic() >= self._proxima_revision:
+            self.recargar()
+        return self._instantanea
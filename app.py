@@ -1,12 +1,36 @@
-from flask import Flask, request, jsonify, render_template, make_response
+from flask import Flask, g, request, jsonify, render_template, make_response, Response, stream_with_context, url_for, send_from_directory
 from flask_cors import CORS
-from weasyprint import HTML
+from werkzeug.utils import secure_filename
 import calculadora
+import cobertura
+import reportes
+import trabajos_pdf
+import cache_pdf
+import almacen_calculos
+import almacen_configuracion
+import ingesta
+import historial
+import sesiones
+import metricas
+import modelo
+import respuestas
+import estaticos
+import estado
+import copy
+import io
 import json
+import mimetypes
 import os
+import re
+import tempfile
+import time
+import zipfile
 from datetime import datetime
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from jinja2.exceptions import UndefinedError
 
 # --- CONFIGURACIÓN DE LOGGING ---
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -16,39 +40,300 @@ file_handler = RotatingFileHandler(log_file, maxBytes=1024 * 1024 * 5, backupCou
 file_handler.setFormatter(log_formatter)
 file_handler.setLevel(logging.INFO)
 
+# Los registros se encolan y un hilo de fondo los escribe en el archivo: una petición
+# ocupada o en modo depuración nunca espera al disco.
+cola_logs = queue.SimpleQueue()
+queue_handler = QueueHandler(cola_logs)
+oyente_logs = QueueListener(cola_logs, file_handler, respect_handler_level=True)
+_oyente_logs_activo = False
+
+def configurar_logging():
+    """Envía los logs de la app y del motor de cálculo al archivo a través de la cola."""
+    global _oyente_logs_activo
+    for logger in (app.logger, logging.getLogger('calculadora')):
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
+        logger.setLevel(logging.INFO)
+    if not _oyente_logs_activo:
+        oyente_logs.start()
+        atexit.register(oyente_logs.stop)
+        _oyente_logs_activo = True
+
 app = Flask(__name__)
+app.json = respuestas.ProveedorJSON(app)
 CORS(app)
 
-# Cargar las especificaciones de los patrones al iniciar la aplicación
-PATRONES_ESPECIFICACIONES = {}
-try:
-    with open(os.path.join(app.static_folder, 'config', 'patrones.json'), 'r', encoding='utf-8') as f:
-        PATRONES_ESPECIFICACIONES = json.load(f)
+# Límites del endpoint de lotes (configurables por variables de entorno)
+app.config['LOTE_MAX_CALCULOS'] = int(os.environ.get('CALCULADORA_LOTE_MAX', 1000))
+app.config['LOTE_WORKERS'] = int(os.environ.get('CALCULADORA_LOTE_WORKERS', 0)) or None
+
+# Estado compartido entre instancias (cálculos recientes, respuestas de /calcular y trabajos
+# de PDF): 'memoria' (por proceso), 'archivos' (en instance/estado) o 'archivos:/ruta'
+app.config['ESTADO'] = os.environ.get('CALCULADORA_ESTADO', 'memoria')
+
+estado_app = estado.crear_estado(app.config['ESTADO'], os.path.join(app.instance_path, 'estado'))
+
+# Cola de PDF asíncronos (/exportar-pdf?async=1)
+app.config['PDF_WORKERS'] = int(os.environ.get('CALCULADORA_PDF_WORKERS', 2))
+app.config['PDF_COLA_MAX'] = int(os.environ.get('CALCULADORA_PDF_COLA_MAX', 20))
+app.config['PDF_EXPIRACION_S'] = int(os.environ.get('CALCULADORA_PDF_EXPIRACION_S', 600))
+# PDF terminados que la cola conserva en memoria hasta que se descargan o expiran
+app.config['PDF_TRABAJOS_MB'] = int(os.environ.get('CALCULADORA_PDF_TRABAJOS_MB', 64))
+
+# Caché de PDF (memoria + disco); CALCULADORA_PDF_CACHE_DIR vacío desactiva el nivel en disco
+app.config['PDF_CACHE_MEMORIA_MB'] = int(os.environ.get('CALCULADORA_PDF_CACHE_MEMORIA_MB', 64))
+app.config['PDF_CACHE_DISCO_MB'] = int(os.environ.get('CALCULADORA_PDF_CACHE_DISCO_MB', 512))
+app.config['PDF_CACHE_DIR'] = os.environ.get('CALCULADORA_PDF_CACHE_DIR', os.path.join(app.instance_path, 'cache_pdf'))
+
+cache_reportes = cache_pdf.CachePDF(
+    max_bytes_memoria=app.config['PDF_CACHE_MEMORIA_MB'] * 1024 * 1024,
+    directorio=app.config['PDF_CACHE_DIR'] or None,
+    max_bytes_disco=app.config['PDF_CACHE_DISCO_MB'] * 1024 * 1024,
+)
+
+# Exportación masiva (/exportar-pdf/lote)
+app.config['PDF_LOTE_MAX_INSTRUMENTOS'] = int(os.environ.get('CALCULADORA_PDF_LOTE_MAX', 200))
+
+cola_pdf = trabajos_pdf.ColaTrabajosPDF(
+    max_workers=app.config['PDF_WORKERS'],
+    max_pendientes=app.config['PDF_COLA_MAX'],
+    expiracion_s=app.config['PDF_EXPIRACION_S'],
+    cache=cache_reportes,
+    estado=estado_app,
+    max_bytes=app.config['PDF_TRABAJOS_MB'] * 1024 * 1024,
+)
+
+metricas.REGISTRO.medidor(
+    'calculadora_pdf_cola', 'Trabajos de PDF asíncronos en cola o en proceso.', funcion=cola_pdf.pendientes
+)
+
+# Resultados recientes de /calcular, para generar reportes en el servidor por 'calculo_id'
+app.config['CALCULOS_RECIENTES_MAX'] = int(os.environ.get('CALCULADORA_CALCULOS_RECIENTES', 500))
+
+calculos_recientes = almacen_calculos.AlmacenCalculos(app.config['CALCULOS_RECIENTES_MAX'], estado_app)
+
+# Respuestas de /calcular ya codificadas, para servir sin recalcular el mismo payload (0 la desactiva)
+app.config['RESPUESTAS_CACHE_MB'] = int(os.environ.get('CALCULADORA_RESPUESTAS_CACHE_MB', 32))
+# Tamaño mínimo de una respuesta para comprimirla con gzip o brotli (0 desactiva la compresión)
+app.config['COMPRESION_MIN_BYTES'] = int(os.environ.get('CALCULADORA_COMPRESION_MIN_BYTES', 1024))
+
+cache_respuestas = respuestas.CacheRespuestas(app.config['RESPUESTAS_CACHE_MB'] * 1024 * 1024, estado_app)
+
+metricas.REGISTRO.medidor(
+    'calculadora_cache_respuestas_bytes', 'Bytes de las respuestas de /calcular en caché.',
+    funcion=cache_respuestas.bytes_ocupados,
+)
+
+# Sesiones de recálculo incremental (/sesiones), para la edición en vivo del formulario
+app.config['SESIONES_MAX'] = int(os.environ.get('CALCULADORA_SESIONES_MAX', 200))
+app.config['SESIONES_EXPIRACION_S'] = int(os.environ.get('CALCULADORA_SESIONES_EXPIRACION_S', 3600))
+
+sesiones_calculo = sesiones.AlmacenSesiones(app.config['SESIONES_MAX'], app.config['SESIONES_EXPIRACION_S'])
+
+# Historial persistente de calibraciones (SQLite); CALCULADORA_HISTORIAL_DB vacío lo desactiva
+app.config['HISTORIAL_DB'] = os.environ.get('CALCULADORA_HISTORIAL_DB', os.path.join(app.instance_path, 'historial.sqlite3'))
+
+historial_calculos = historial.HistorialCalculos(app.config['HISTORIAL_DB']) if app.config['HISTORIAL_DB'] else None
+if historial_calculos is not None:
+    # Lo encolado al terminar el proceso se guarda antes de salir
+    atexit.register(historial_calculos.vaciar, 10)
+    metricas.REGISTRO.medidor(
+        'calculadora_historial_pendientes', 'Registros del historial encolados y aún no guardados.',
+        funcion=historial_calculos.pendientes,
+    )
+
+# Recursos estáticos con huella y precomprimidos (python estaticos.py), servidos en /assets/
+app.config['ESTATICOS_DIST'] = os.path.join(app.static_folder, estaticos.NOMBRE_DIST)
+
+manifiesto_estaticos = estaticos.ManifiestoEstaticos(app.config['ESTATICOS_DIST'])
+
+# Configuración del sitio (patrones, textos y EMT), recargada cuando cambian los archivos.
+# Varias instancias comparten la configuración leyendo el mismo directorio
+app.config['CONFIG_DIR'] = os.environ.get('CALCULADORA_CONFIG_DIR', os.path.join(app.static_folder, 'config'))
+app.config['CONFIG_REVISION_S'] = float(os.environ.get('CALCULADORA_CONFIG_REVISION_S', 2))
+app.config['EMT_BUSQUEDA'] = os.environ.get('CALCULADORA_EMT_BUSQUEDA', 'exacta')
+if app.config['EMT_BUSQUEDA'] not in calculadora.MODOS_BUSQUEDA_EMT:
+    raise ValueError(f"CALCULADORA_EMT_BUSQUEDA debe ser uno de: {', '.join(calculadora.MODOS_BUSQUEDA_EMT)}.")
+
+almacen_config = almacen_configuracion.AlmacenConfiguracion(
+    app.config['CONFIG_DIR'],
+    intervalo_revision_s=app.config['CONFIG_REVISION_S'],
+    busqueda_emt=app.config['EMT_BUSQUEDA'],
+)
+for clave, error in almacen_config.errores.items():
     # No usamos app.logger aquí porque aún no está configurado
-except Exception as e:
-    print(f"ERROR CRÍTICO: No se pudo cargar el archivo de patrones: {e}")
+    print(f"ERROR CRÍTICO: No se pudo cargar el archivo de configuración {almacen_configuracion.ARCHIVOS_CONFIGURACION[clave]}: {error}")
 
-# Cargar configuración del sitio
-SITE_CONFIG = {}
-try:
-    with open(os.path.join(app.static_folder, 'config', 'site_config.json'), 'r', encoding='utf-8') as f:
-        SITE_CONFIG = json.load(f)
-except Exception as e:
-    print(f"ERROR CRÍTICO: No se pudo cargar el archivo de configuración del sitio: {e}")
+def verificar_configuracion(configuracion):
+    """Devuelve una respuesta de error si algún archivo de configuración no se cargó."""
+    if not configuracion['especificaciones_patrones']:
+        return jsonify({"error": "El archivo de configuración de patrones (patrones.json) no se pudo cargar o está vacío."}), 500
+    if not configuracion['site_config']:
+        return jsonify({"error": "El archivo de configuración del sitio (site_config.json) no se pudo cargar o está vacío."}), 500
+    if not configuracion['emts_config']:
+        return jsonify({"error": "El archivo de configuración de EMT (emts.json) no se pudo cargar o está vacío."}), 500
+    return None
 
-# Cargar configuración de EMT
-EMTS_CONFIG = {}
-try:
-    with open(os.path.join(app.static_folder, 'config', 'emts.json'), 'r', encoding='utf-8') as f:
-        EMTS_CONFIG = json.load(f)
-except Exception as e:
-    print(f"ERROR CRÍTICO: No se pudo cargar el archivo de configuración de EMT: {e}")
+def configuracion_calculo():
+    """
+    Configuración que el motor de cálculo recibe junto a cada payload: la instantánea
+    vigente del almacén, compartida sin copiarla en los datos de la petición.
+    """
+    return almacen_config.actual()
+
+def precalentar(renderizar_pdf=True):
+    """
+    Carga por adelantado las dependencias pesadas que de otro modo se importan en
+    la primera petición: scipy (factores k fuera de tabla) y WeasyPrint.
+    Con `renderizar_pdf` también genera un PDF mínimo para cargar las fuentes.
+    """
+    # Un grado de libertad fuera de la tabla obliga a importar scipy.stats
+    cobertura.factor_cobertura(cobertura.MAX_GRADOS_TABLA + 1)
+    precompilar_plantillas_reporte()
+    reportes.cargar_weasyprint()
+    if renderizar_pdf:
+        reportes.renderizar_pdf('<p>precalentamiento</p>')
+
+if os.environ.get('CALCULADORA_PRECALENTAR') == '1':
+    precalentar()
+
+# Pipeta de 20 µL con tres aforos de tres mediciones: recorre el mismo camino que un
+# cálculo real del formulario (validación, núcleo, textos y plantillas)
+PAYLOAD_PRECALENTAMIENTO = {
+    'constantes': {
+        'tanaka_a1': -3.983035, 'tanaka_a2': 301.797, 'tanaka_a3': 522528.9,
+        'tanaka_a4': 69.34881, 'tanaka_a5': 999.97495,
+        'rho_aire_o51': 0.34848, 'rho_aire_o52': 0.009, 'rho_aire_o53': 0.061,
+        'alpha_material_pp': 0.00024, 'rho_pesa_n74': 8000,
+        'corr_ta_y': {'a': 0.0005, 'b': 0.0025, 'c': 0.05},
+        'corr_tamb_y': {'a': 0.0109, 'b': -0.45, 'c': 4.6637},
+        'corr_hr_y': {'a': 0.0008, 'b': -0.1635, 'c': 5.7469},
+        'corr_patm_y': {'a': 0.0001, 'b': -0.1526, 'c': 60.12},
+    },
+    'entradas_generales': {
+        'descripcion_instrumento': "PIPETA DE PISTÓN", 'clase_instrumento': "N.A.",
+        'tipo_instrumento': "ANALOGICO", 'marca_instrumento': "GILSON", 'modelo_instrumento': "PIPETMAN",
+        'serie_instrumento': "PRECALENTAMIENTO", 'unidades': "µL", 'tipo_volumen': "VARIABLE",
+        'tipo_calibracion': "TD", 'id_instrumento': "S / ID", 'div_min_valor': 0.02,
+        'patron_seleccionado': "CAL-VO-002", 'auxiliar_ta': "CAL-VO-005", 'auxiliar_ca': "CAL-VO-051",
+        'ajuste_realizado': "N", 'mantenimientos': ["Limpieza externa"],
+        'intervalo_min_reporte': 2, 'intervalo_max_reporte': 20,
+        'condiciones_iniciales': {'promedio1': 2.01, 'promedio2': 9.98, 'promedio3': 20.03},
+    },
+    **{
+        f'aforo{i}': {
+            'valor_nominal': nominal,
+            'mediciones_masa': [round(nominal / 1000 * factor, 6) for factor in (0.998, 1.001, 1.003)],
+            'mediciones_ambientales': [
+                {'temp_agua': 20.1, 'temp_amb': 20.4, 'presion': 783.2, 'humedad': 52.3},
+                {'temp_agua': 20.1, 'temp_amb': 20.5, 'presion': 783.2, 'humedad': 52.4},
+                {'temp_agua': 20.2, 'temp_amb': 20.5, 'presion': 783.3, 'humedad': 52.4},
+            ],
+        }
+        for i, nominal in enumerate((2.0, 10.0, 20.0), start=1)
+    },
+}
+
+def precalentar_calculo(data=None, renderizar_pdf=True):
+    """
+    Hace un cálculo y genera los reportes de `data` (PAYLOAD_PRECALENTAMIENTO si no se
+    indica) en el proceso actual, sin guardarlos en los cálculos recientes ni en la caché
+    de PDF, para que la primera petición real no pague el arranque en frío. Devuelve
+    False si la configuración está incompleta.
+    """
+    if data is None:
+        data = copy.deepcopy(PAYLOAD_PRECALENTAMIENTO)
+    with app.app_context():
+        configuracion = configuracion_calculo()
+        if verificar_configuracion(configuracion):
+            return False
+        resultados = calculadora.procesar_todos_los_aforos(data, configuracion)
+        jsonify(resultados)  # También la serialización de la respuesta
+        for report_type in TIPOS_REPORTE:
+            content_html = renderizar_contenido_reporte(resultados, report_type)
+            rendered_html = renderizar_plantilla_reporte(content_html, None, report_type)
+            if renderizar_pdf:
+                reportes.renderizar_pdf(rendered_html)
+    return True
+
+def crear_app(configurar_logs=True, precalentar_dependencias=False):
+    """
+    Deja la aplicación lista para servir y la devuelve. La aplicación, sus cachés y la
+    configuración son únicas por proceso, así que todas las llamadas devuelven `app`.
+    Un servidor que crea los workers con fork (servidor.py) precalienta en el proceso
+    principal y configura los logs en cada worker: el hilo de la cola no sobrevive al fork.
+    """
+    if configurar_logs:
+        configurar_logging()
+    if precalentar_dependencias:
+        precalentar()
+    return app
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def registrar_peticion(response):
+    # En las respuestas transmitidas por trozos se mide hasta que empieza el envío
+    endpoint = request.endpoint or 'desconocido'
+    metricas.PETICIONES.incrementar(endpoint, request.method, response.status_code)
+    if 'inicio_peticion' in g:
+        metricas.DURACION_PETICION.observar(time.perf_counter() - g.inicio_peticion, endpoint)
+    return response
+
+@app.after_request
+def comprimir_respuesta(response):
+    # Se registra después de registrar_peticion para que corra antes y la compresión se mida
+    return respuestas.comprimir_respuesta(response, request.accept_encodings, app.config['COMPRESION_MIN_BYTES'])
+
+def registrar_error(e):
+    """Cuenta un error del endpoint actual por tipo de excepción."""
+    metricas.ERRORES.incrementar(request.endpoint or 'desconocido', type(e).__name__)
+
+def respuesta_error_validacion(e):
+    """400 con todos los errores de validación del payload, campo por campo."""
+    registrar_error(e)
+    app.logger.warning(f"Error de datos del cliente: {e}")
+    return jsonify({"error": f"Datos inválidos o malformados: {e}", "errores": e.errores}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metricas_ruta():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return Response(metricas.REGISTRO.exposicion(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/')
 def index():
     """Sirve la página principal de la aplicación."""
     return render_template('index.html')
 
+@app.template_global()
+def asset_url(ruta):
+    """
+    URL de un recurso de static/ para las plantillas: la versión con huella si se
+    construyó, o la de /static si no (desarrollo).
+    """
+    nombre = manifiesto_estaticos.obtener(ruta)
+    if nombre is None:
+        return url_for('static', filename=ruta)
+    return url_for('asset_ruta', nombre=nombre)
+
+@app.route('/assets/<path:nombre>', methods=['GET'])
+def asset_ruta(nombre):
+    """
+    Sirve un recurso con huella, precomprimido según Accept-Encoding. El nombre cambia
+    con el contenido, así que el navegador lo guarda un año sin volver a pedirlo.
+    """
+    archivo, codificacion = estaticos.elegir_variante(app.config['ESTATICOS_DIST'], nombre, request.accept_encodings)
+    # El tipo es el del recurso, no el de su versión comprimida (.br o .gz)
+    mimetype = mimetypes.guess_type(nombre)[0] or 'application/octet-stream'
+    response = send_from_directory(app.config['ESTATICOS_DIST'], archivo, mimetype=mimetype)
+    if codificacion:
+        response.headers['Content-Encoding'] = codificacion
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = estaticos.CACHE_INMUTABLE
+    return response
+
 @app.route('/calcular', methods=['POST'])
 def calcular_ruta():
     try:
@@ -57,86 +342,667 @@ def calcular_ruta():
             return jsonify({"error": "No se recibieron datos"}), 400
 
         # Validar que los archivos de configuración se hayan cargado
-        if not PATRONES_ESPECIFICACIONES:
-            return jsonify({"error": "El archivo de configuración de patrones (patrones.json) no se pudo cargar o está vacío."}), 500
-        if not SITE_CONFIG:
-            return jsonify({"error": "El archivo de configuración del sitio (site_config.json) no se pudo cargar o está vacío."}), 500
-        if not EMTS_CONFIG:
-            return jsonify({"error": "El archivo de configuración de EMT (emts.json) no se pudo cargar o está vacío."}), 500
-
-        # Inyectar las especificaciones de los patrones (ahora vacío, pero no importa por el hardcode)
-        data['especificaciones_patrones'] = PATRONES_ESPECIFICACIONES
-        data['site_config'] = SITE_CONFIG
-        data['emts_config'] = EMTS_CONFIG
-
-        # Validación de estructura más robusta
-        required_keys = ['constantes', 'entradas_generales', 'aforo1', 'aforo2', 'aforo3']
-        if not all(key in data for key in required_keys):
-             return jsonify({"error": "Estructura de datos incompleta. Faltan claves principales."}), 400
-
-        resultados_finales = calculadora.procesar_todos_los_aforos(data)
-        
-        return jsonify(resultados_finales)
+        configuracion = configuracion_calculo()
+        error_config = verificar_configuracion(configuracion)
+        if error_config:
+            return error_config
+
+        # El mismo payload con la misma configuración se sirve ya calculado y codificado
+        # (la huella cuesta mucho menos que el calculo_id, que se guarda con la respuesta)
+        clave = f"{respuestas.huella_json(data)}:{configuracion['revision']}"
+        respuesta = cache_respuestas.obtener(clave)
+        guardar = respuesta is None
+        if respuesta is None:
+            # Monte Carlo sin semilla da otro resultado en cada cálculo: se fija aquí para
+            # que el calculo_id y el historial correspondan a esta respuesta
+            datos_calculo = calculadora.fijar_semilla_montecarlo(data)
+            calculo_id = almacen_calculos.identificador_calculo(datos_calculo)
+            # La estructura y los valores se validan al convertir el payload (modelo.validar_peticion)
+            resultados_finales = calculadora.procesar_todos_los_aforos(datos_calculo, configuracion)
+            if historial_calculos is not None:
+                historial_calculos.registrar(calculo_id, datos_calculo, resultados_finales)
+            respuesta = respuestas.RespuestaCodificada({**resultados_finales, "calculo_id": calculo_id}, calculo_id)
+            reproducible = calculadora.resultado_reproducible(data)
+            calculos_recientes.guardar(calculo_id, resultados_finales)
+        else:
+            calculo_id = respuesta.datos
+            reproducible = True
+            # También en un acierto: los reportes se generan a partir del calculo_id. Si
+            # el cálculo ya salió del almacén, los resultados se recuperan del cuerpo
+            if calculos_recientes.obtener(calculo_id) is None:
+                resultados_finales = app.json.loads(respuesta.cuerpo)
+                resultados_finales.pop('calculo_id', None)
+                calculos_recientes.guardar(calculo_id, resultados_finales)
+
+        if request.if_none_match.contains_weak(respuesta.etag):
+            response = make_response('', 304)
+            response.set_etag(respuesta.etag, weak=True)
+            return response
+
+        codificacion = None
+        if len(respuesta.cuerpo) >= app.config['COMPRESION_MIN_BYTES'] > 0:
+            codificacion = respuestas.elegir_codificacion(request.accept_encodings)
+        tamano = respuesta.tamano()
+        response = Response(respuesta.version(codificacion), mimetype='application/json')
+        if reproducible and (guardar or respuesta.tamano() != tamano):
+            # Se guarda de nuevo en un acierto si se agregó una versión comprimida
+            cache_respuestas.guardar(clave, respuesta)
+        if codificacion:
+            response.headers['Content-Encoding'] = codificacion
+        response.vary.add('Accept-Encoding')
+        # Débil: el mismo ETag vale para el cuerpo sin comprimir y sus versiones comprimidas
+        response.set_etag(respuesta.etag, weak=True)
+        return response
+
+    except modelo.ErrorValidacion as e:
+        return respuesta_error_validacion(e)
 
     except (ValueError, TypeError) as e:
+        registrar_error(e)
         # Errores causados por datos malformados (ej. un string donde se espera un número)
         app.logger.warning(f"Error de datos del cliente: {e}")
         return jsonify({"error": f"Datos inválidos o malformados: {e}"}), 400
 
     except Exception as e:
+        registrar_error(e)
         # Log del error en la terminal del servidor usando el logger de Flask
         app.logger.error(f"Error interno no capturado: {e}", exc_info=True)
         return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
 
-@app.route('/exportar-pdf', methods=['POST'])
-def exportar_pdf_ruta():
+@app.route('/calcular-lote', methods=['POST'])
+def calcular_lote_ruta():
+    """
+    Procesa varios cálculos en una sola petición. Acepta una lista de payloads
+    (o {"calculos": [...]}) y devuelve un resultado o un error por elemento.
+    Con ?stream=1 o 'Accept: application/x-ndjson' responde en NDJSON a medida
+    que los cálculos terminan.
+    """
     try:
-        # Recibimos el HTML ya generado por el frontend
         data = request.get_json()
-        report_type = data.get('report_type', 'certificado') # 'servicio', 'certificado', 'medidas'
-        service_report_html = data.get('service_report_html')
-        certificate_html = data.get('certificate_html')
-        medidas_html = data.get('medidas_html')
-        base_url = data.get('base_url')
+        calculos = data.get('calculos') if isinstance(data, dict) else data
+        if not isinstance(calculos, list) or not calculos:
+            return jsonify({"error": "Se esperaba una lista no vacía de cálculos."}), 400
+        if len(calculos) > app.config['LOTE_MAX_CALCULOS']:
+            return jsonify({"error": f"El lote excede el máximo de {app.config['LOTE_MAX_CALCULOS']} cálculos."}), 413
 
-        if not service_report_html or not certificate_html or not medidas_html:
-            return jsonify({"error": "No se recibió el contenido HTML para generar el PDF."}), 400
+        configuracion = configuracion_calculo()
+        error_config = verificar_configuracion(configuracion)
+        if error_config:
+            return error_config
 
-        # Seleccionar el contenido y el nombre de archivo según el tipo de reporte
-        if report_type == 'medidas':
-            content_html = medidas_html
-            file_name = f"Medidas_{datetime.now().strftime('%d%m%Y%H%M%S')}.pdf"
-        elif report_type == 'servicio':
-            content_html = service_report_html
-            file_name = f"Reporte_de_servicio_{datetime.now().strftime('%d%m%Y%H%M%S')}.pdf"
-        else: # Por defecto, el certificado
-            content_html = certificate_html
-            file_name = f"Certificado_{datetime.now().strftime('%d%m%Y%H%M%S')}.pdf"
+        max_workers = app.config['LOTE_WORKERS']
 
-        # Renderizamos la plantilla principal del PDF con el contenido recibido
-        rendered_html = render_template(
+        streaming = (request.args.get('stream') == '1' or
+                     'application/x-ndjson' in request.headers.get('Accept', ''))
+        if streaming:
+            def generar():
+                for item in calculadora.procesar_lote_iter(calculos, configuracion, max_workers):
+                    yield json.dumps(item, ensure_ascii=False) + '\n'
+            return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
+
+        resultados = calculadora.procesar_lote(calculos, configuracion, max_workers)
+        errores = sum(1 for item in resultados if 'error' in item)
+        return jsonify({"resultados": resultados, "total": len(resultados), "errores": errores})
+
+    except Exception as e:
+        registrar_error(e)
+        app.logger.error(f"Error interno no capturado en lote: {e}", exc_info=True)
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+@app.route('/calcular-archivos', methods=['POST'])
+def calcular_archivos_ruta():
+    """
+    Calcula a partir de las exportaciones de balanzas y registradores (multipart/form-data).
+    'datos' lleva el JSON de /calcular sin las mediciones: constantes, entradas_generales
+    y el 'valor_nominal' de cada aforo. Los archivos (CSV o NDJSON) van en 'mediciones',
+    con una columna 'aforo', o en 'aforo1', 'aforo2', ... si cada uno es de un solo aforo.
+    Werkzeug guarda en disco los archivos grandes y aquí se leen fila a fila.
+    """
+    try:
+        try:
+            data = json.loads(request.form.get('datos', ''))
+        except json.JSONDecodeError:
+            return jsonify({"error": "El campo 'datos' debe contener el JSON del cálculo."}), 400
+        if not isinstance(data, dict) or not all(key in data for key in ('constantes', 'entradas_generales')):
+            return jsonify({"error": "Estructura de datos incompleta. Faltan claves principales."}), 400
+        num_aforos = len(modelo.claves_aforos(data))
+        if not num_aforos:
+            return jsonify({"error": "Los datos no declaran ningún aforo ('aforo1', 'aforo2', ...)."}), 400
+        if not request.files:
+            return jsonify({"error": "No se recibieron archivos de mediciones."}), 400
+
+        configuracion = configuracion_calculo()
+        error_config = verificar_configuracion(configuracion)
+        if error_config:
+            return error_config
+
+        acumulador = ingesta.Ingesta(num_aforos)
+        for campo, archivo in request.files.items(multi=True):
+            if campo == 'mediciones':
+                aforo = None
+            elif re.fullmatch(r'aforo[1-9]\d*', campo):
+                aforo = int(campo[len('aforo'):])
+            else:
+                return jsonify({"error": f"Campo de archivo desconocido: '{campo}'. Use 'mediciones' o 'aforoN'."}), 400
+            formato = request.form.get('formato') or ingesta.detectar_formato(archivo.filename, archivo.mimetype)
+            if formato is None:
+                return jsonify({"error": f"No se reconoce el formato de '{archivo.filename}'; indique 'formato' (csv o ndjson)."}), 400
+            acumulador.leer(archivo.stream, formato, archivo.filename, aforo)
+        masas, promedios = acumulador.arreglos()
+
+        data = calculadora.fijar_semilla_montecarlo(data)
+        calculo_id = almacen_calculos.identificador_calculo({'datos': data, 'masas': masas, 'promedios': promedios})
+        resultados_finales = calculadora.procesar_aforos_desde_promedios(data, masas, promedios, configuracion)
+        calculos_recientes.guardar(calculo_id, resultados_finales)
+        if historial_calculos is not None:
+            historial_calculos.registrar(calculo_id, {**data, 'ingesta': acumulador.resumen()}, resultados_finales)
+
+        return jsonify({**resultados_finales, "calculo_id": calculo_id, "ingesta": acumulador.resumen()})
+
+    except modelo.ErrorValidacion as e:
+        return respuesta_error_validacion(e)
+
+    except (ValueError, TypeError) as e:
+        registrar_error(e)
+        app.logger.warning(f"Error en los archivos de mediciones: {e}")
+        return jsonify({"error": f"Datos inválidos o malformados: {e}"}), 400
+
+    except Exception as e:
+        registrar_error(e)
+        app.logger.error(f"Error interno no capturado: {e}", exc_info=True)
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+@app.route('/sesiones', methods=['POST'])
+def crear_sesion_ruta():
+    """
+    Abre una sesión de edición con el payload completo de /calcular y devuelve sus
+    resultados junto con 'sesion_id'. Los cambios posteriores se envían con PATCH.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No se recibieron datos"}), 400
+
+        configuracion = configuracion_calculo()
+        error_config = verificar_configuracion(configuracion)
+        if error_config:
+            return error_config
+
+        sesion_id, sesion = sesiones_calculo.crear(data, configuracion)
+        return jsonify({**sesion.resultados(), "sesion_id": sesion_id, "version": sesion.version}), 201
+
+    except modelo.ErrorValidacion as e:
+        return respuesta_error_validacion(e)
+
+    except (ValueError, TypeError, KeyError) as e:
+        registrar_error(e)
+        app.logger.warning(f"Error de datos del cliente al abrir una sesión: {e}")
+        return jsonify({"error": f"Datos inválidos o malformados: {e}"}), 400
+
+    except Exception as e:
+        registrar_error(e)
+        app.logger.error(f"Error interno no capturado: {e}", exc_info=True)
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+@app.route('/sesiones/<sesion_id>', methods=['PATCH'])
+def actualizar_sesion_ruta(sesion_id):
+    """
+    Aplica uno o varios cambios ({"cambios": [...]} o un solo cambio) y devuelve sólo
+    los aforos, condiciones y textos que cambiaron. Cada cambio es, por ejemplo:
+      {"aforo": 2, "campo": "mediciones_masa", "indice": 3, "valor": 0.01002}
+      {"aforo": 2, "campo": "mediciones_ambientales", "indice": 3, "magnitud": "temp_agua", "valor": 20.1}
+      {"aforo": 3, "campo": "valor_nominal", "valor": 20}
+      {"campo": "entradas_generales", "clave": "div_min_valor", "valor": 0.01}
+    """
+    try:
+        sesion = sesiones_calculo.obtener(sesion_id)
+        if sesion is None:
+            return jsonify({"error": "La sesión no existe o ya expiró."}), 404
+        data = request.get_json()
+        cambios = data.get('cambios', [data]) if isinstance(data, dict) else None
+        if not isinstance(cambios, list) or not cambios:
+            return jsonify({"error": "Se esperaba un cambio o una lista no vacía en 'cambios'."}), 400
+
+        with sesion.lock:
+            return jsonify(sesion.aplicar(cambios, configuracion_calculo()))
+
+    except modelo.ErrorValidacion as e:
+        registrar_error(e)
+        app.logger.warning(f"Cambio inválido en la sesión {sesion_id}: {e}")
+        return jsonify({"error": f"Cambio inválido: {e}", "errores": e.errores}), 400
+
+    except (ValueError, TypeError) as e:
+        registrar_error(e)
+        app.logger.warning(f"Cambio inválido en la sesión {sesion_id}: {e}")
+        return jsonify({"error": f"Cambio inválido: {e}"}), 400
+
+    except Exception as e:
+        registrar_error(e)
+        app.logger.error(f"Error interno no capturado: {e}", exc_info=True)
+        return jsonify({"error": "Ocurrió un error interno en el servidor"}), 500
+
+@app.route('/sesiones/<sesion_id>', methods=['GET'])
+def consultar_sesion_ruta(sesion_id):
+    """
+    Resultados completos de la sesión, con la estructura de /calcular. El 'calculo_id'
+    devuelto sirve para generar los reportes en /exportar-pdf.
+    """
+    sesion = sesiones_calculo.obtener(sesion_id)
+    if sesion is None:
+        return jsonify({"error": "La sesión no existe o ya expiró."}), 404
+    with sesion.lock:
+        resultados = sesion.resultados()
+        calculo_id = almacen_calculos.identificador_calculo(sesion.data)
+        version = sesion.version
+        if historial_calculos is not None:
+            historial_calculos.registrar(calculo_id, copy.deepcopy(sesion.data), resultados)
+    calculos_recientes.guardar(calculo_id, resultados)
+    return jsonify({**resultados, "calculo_id": calculo_id, "sesion_id": sesion_id, "version": version})
+
+@app.route('/sesiones/<sesion_id>', methods=['DELETE'])
+def cerrar_sesion_ruta(sesion_id):
+    if not sesiones_calculo.eliminar(sesion_id):
+        return jsonify({"error": "La sesión no existe o ya expiró."}), 404
+    return '', 204
+
+# Tipo de reporte -> (campo con el HTML en la petición, prefijo del archivo)
+TIPOS_REPORTE = {
+    'servicio': ('service_report_html', 'Reporte_de_servicio'),
+    'certificado': ('certificate_html', 'Certificado'),
+    'medidas': ('medidas_html', 'Medidas'),
+}
+
+# Plantillas con las que el servidor genera el contenido de cada reporte a partir de los resultados
+PLANTILLAS_CONTENIDO = {
+    'servicio': 'reportes/servicio.html',
+    'certificado': 'reportes/certificado.html',
+    'medidas': 'reportes/medidas.html',
+}
+
+# Claves mínimas de los resultados de /calcular para poder generar un reporte
+CLAVES_RESULTADOS = ('aforos', 'textos_reporte', 'condiciones_finales')
+
+def precompilar_plantillas_reporte():
+    """Compila las plantillas de reporte una vez; Jinja las reutiliza desde su caché."""
+    for nombre in PLANTILLAS_CONTENIDO.values():
+        app.jinja_env.get_template(nombre)
+
+try:
+    precompilar_plantillas_reporte()
+except Exception as e:
+    print(f"ERROR CRÍTICO: No se pudieron compilar las plantillas de reporte: {e}")
+
+def resultados_para_reporte(data):
+    """
+    Obtiene los resultados con los que el servidor genera un reporte: los de un cálculo
+    reciente ('calculo_id') o los enviados en la petición ('resultados').
+    Devuelve (resultados, respuesta_de_error); ambos son None si la petición trae HTML.
+    """
+    if data.get('calculo_id'):
+        resultados = calculos_recientes.obtener(str(data['calculo_id']))
+        if resultados is None and historial_calculos is not None:
+            # Un cálculo antiguo se vuelve a emitir desde el historial
+            calculo = historial_calculos.obtener(str(data['calculo_id']))
+            if calculo is not None:
+                resultados = calculo['resultados']
+                calculos_recientes.guardar(str(data['calculo_id']), resultados)
+        if resultados is None:
+            return None, (jsonify({"error": "El cálculo no existe o ya expiró. Envíe los resultados completos en 'resultados'."}), 404)
+        return resultados, None
+    if 'resultados' in data:
+        resultados = data['resultados']
+        if (not isinstance(resultados, dict) or not all(clave in resultados for clave in CLAVES_RESULTADOS)
+                or not isinstance(resultados['aforos'], list) or not resultados['aforos']):
+            return None, (jsonify({"error": "Los resultados no tienen la estructura devuelta por /calcular."}), 400)
+        return resultados, None
+    return None, None
+
+def renderizar_contenido_reporte(resultados, report_type):
+    """
+    Genera en el servidor el HTML del contenido de un reporte. Sólo depende de los
+    resultados, así que los mismos resultados producen el mismo PDF (y la misma clave de caché).
+    """
+    with metricas.etapa('contenido_reporte'):
+        plantilla = app.jinja_env.get_template(PLANTILLAS_CONTENIDO[report_type])
+        return plantilla.render(resultados=resultados)
+
+def renderizar_plantilla_reporte(content_html, base_url, report_type):
+    """Envuelve el contenido de un reporte en la plantilla principal del PDF."""
+    with metricas.etapa('plantilla_reporte'):
+        return render_template(
             'report_template.html',
             content_html=content_html,
             base_url=base_url,
             report_type=report_type
         )
 
-        # Generamos el PDF con WeasyPrint
-        pdf = HTML(string=rendered_html).write_pdf()
+def obtener_pdf(rendered_html, clave):
+    """Devuelve el PDF desde la caché o lo genera con WeasyPrint (importado en el primer uso)."""
+    pdf = cache_reportes.obtener(clave)
+    if pdf is None:
+        pdf = reportes.renderizar_pdf(rendered_html)
+        cache_reportes.guardar(clave, pdf)
+    return pdf
+
+@app.route('/exportar-pdf', methods=['POST'])
+def exportar_pdf_ruta():
+    """
+    Genera el PDF de un reporte. El contenido se genera en el servidor si la petición
+    trae 'calculo_id' (devuelto por /calcular) o 'resultados'; si no, se usa el HTML
+    enviado por el frontend.
+    """
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({"error": "No se recibieron datos"}), 400
+        report_type = data.get('report_type', 'certificado') # 'servicio', 'certificado', 'medidas'
+        base_url = data.get('base_url')
+
+        # Seleccionar el contenido y el nombre de archivo según el tipo de reporte (por defecto, el certificado)
+        tipo_contenido = report_type if report_type in TIPOS_REPORTE else 'certificado'
+        campo_html, prefijo_archivo = TIPOS_REPORTE[tipo_contenido]
+
+        resultados, error = resultados_para_reporte(data)
+        if error:
+            return error
+        if resultados is not None:
+            try:
+                content_html = renderizar_contenido_reporte(resultados, tipo_contenido)
+            except (TypeError, ValueError, UndefinedError) as e:
+                registrar_error(e)
+                app.logger.warning(f"Resultados inválidos para el reporte: {e}")
+                return jsonify({"error": f"Resultados inválidos o malformados: {e}"}), 400
+        else:
+            # Recibimos el HTML ya generado por el frontend
+            service_report_html = data.get('service_report_html')
+            certificate_html = data.get('certificate_html')
+            medidas_html = data.get('medidas_html')
+
+            if not service_report_html or not certificate_html or not medidas_html:
+                return jsonify({"error": "No se recibió el contenido HTML para generar el PDF."}), 400
+            content_html = data.get(campo_html)
 
-        # Creamos la respuesta para que el navegador descargue el archivo
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
+        file_name = f"{prefijo_archivo}_{datetime.now().strftime('%d%m%Y%H%M%S')}.pdf"
+
+        # Renderizamos la plantilla principal del PDF con el contenido recibido
+        rendered_html = renderizar_plantilla_reporte(content_html, base_url, report_type)
+
+        # El mismo reporte produce siempre la misma clave, que se usa como ETag
+        clave = cache_pdf.CachePDF.clave(rendered_html, report_type, base_url)
+        if request.if_none_match.contains(clave):
+            return respuesta_no_modificada(clave)
+
+        # Modo trabajo: se encola el render y se responde de inmediato con el id
+        if request.args.get('async') == '1':
+            try:
+                id_trabajo = cola_pdf.enviar(rendered_html, file_name, clave)
+            except trabajos_pdf.ColaLlenaError as e:
+                registrar_error(e)
+                response = jsonify({"error": str(e)})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            return jsonify({
+                "id": id_trabajo,
+                "estado": cola_pdf.consultar(id_trabajo)['estado'],
+                "url": url_for('estado_pdf_ruta', id_trabajo=id_trabajo),
+            }), 202
+
+        pdf = obtener_pdf(rendered_html, clave)
+        if historial_calculos is not None and data.get('calculo_id'):
+            historial_calculos.registrar_pdf(str(data['calculo_id']), tipo_contenido, pdf)
+        return respuesta_pdf(pdf, file_name, clave)
+
+    except Exception as e:
+        registrar_error(e)
+        app.logger.error(f"Error al generar el PDF: {e}", exc_info=True)
+        return jsonify({"error": "Ocurrió un error interno al generar el PDF."}), 500
+
+# Tamaño de los trozos enviados al cliente en las exportaciones masivas
+TAMANO_TROZO = 64 * 1024
+
+class _SalidaEnTrozos(io.RawIOBase):
+    """Destino de escritura sin posicionamiento: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes.clear()
+        for inicio in range(0, len(datos), TAMANO_TROZO):
+            yield datos[inicio:inicio + TAMANO_TROZO]
+
+def _generar_zip_reportes(trabajos):
+    """
+    Genera el ZIP trozo a trozo: cada PDF se renderiza, se escribe y se envía antes
+    de pasar al siguiente, así la memoria no crece con el número de reportes.
+    """
+    salida = _SalidaEnTrozos()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_STORED) as archivo_zip:
+        for nombre_archivo, rendered_html, clave in trabajos:
+            # Los PDF ya van comprimidos internamente: se almacenan sin volver a comprimir
+            archivo_zip.writestr(nombre_archivo, obtener_pdf(rendered_html, clave))
+            yield from salida.vaciar()
+    yield from salida.vaciar()
+
+def _generar_pdf_combinado(trabajos):
+    """Genera el PDF combinado en un archivo temporal y lo envía trozo a trozo."""
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as temporal:
+        reportes.combinar_pdf([rendered_html for _, rendered_html, _ in trabajos], temporal)
+        temporal.seek(0)
+        while True:
+            trozo = temporal.read(TAMANO_TROZO)
+            if not trozo:
+                break
+            yield trozo
+
+@app.route('/exportar-pdf/lote', methods=['POST'])
+def exportar_pdf_lote_ruta():
+    """
+    Exporta varios reportes de uno o varios instrumentos en una sola petición.
+
+    Cuerpo: {"formato": "zip" | "pdf", "reportes": ["servicio", "certificado", "medidas"],
+             "instrumentos": [{"nombre": ..., "base_url": ..., "service_report_html": ..., ...}]}
+    Cada instrumento puede traer 'calculo_id' o 'resultados' en lugar del HTML; entonces
+    el contenido se genera en el servidor.
+    Sin "instrumentos", los campos del propio cuerpo se toman como un único instrumento.
+    La respuesta (ZIP o PDF combinado) se transmite por trozos.
+    """
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({"error": "No se recibieron datos"}), 400
+
+        formato = data.get('formato', 'zip')
+        if formato not in ('zip', 'pdf'):
+            return jsonify({"error": "El formato debe ser 'zip' o 'pdf'."}), 400
+
+        tipos = data.get('reportes') or list(TIPOS_REPORTE)
+        if not isinstance(tipos, list) or any(tipo not in TIPOS_REPORTE for tipo in tipos):
+            return jsonify({"error": f"Tipos de reporte válidos: {', '.join(TIPOS_REPORTE)}."}), 400
+
+        instrumentos = data.get('instrumentos', [data])
+        if not isinstance(instrumentos, list) or not instrumentos:
+            return jsonify({"error": "Se esperaba una lista no vacía de instrumentos."}), 400
+        if len(instrumentos) > app.config['PDF_LOTE_MAX_INSTRUMENTOS']:
+            return jsonify({"error": f"El lote excede el máximo de {app.config['PDF_LOTE_MAX_INSTRUMENTOS']} instrumentos."}), 413
+
+        # Validar y renderizar las plantillas antes de empezar a transmitir, para poder
+        # responder con un error si falta algún contenido.
+        trabajos = []
+        for indice, instrumento in enumerate(instrumentos, start=1):
+            if not isinstance(instrumento, dict):
+                return jsonify({"error": f"El instrumento {indice} no es un objeto JSON."}), 400
+            carpeta = ''
+            if len(instrumentos) > 1:
+                # El índice evita colisiones entre instrumentos con el mismo nombre
+                nombre = secure_filename(str(instrumento.get('nombre', ''))) or 'instrumento'
+                carpeta = f"{indice:03d}_{nombre}/"
+            base_url = instrumento.get('base_url')
+            resultados, error = resultados_para_reporte(instrumento)
+            if error:
+                return error
+            for tipo in tipos:
+                campo_html, prefijo_archivo = TIPOS_REPORTE[tipo]
+                if resultados is not None:
+                    try:
+                        content_html = renderizar_contenido_reporte(resultados, tipo)
+                    except (TypeError, ValueError, UndefinedError) as e:
+                        registrar_error(e)
+                        return jsonify({"error": f"Resultados inválidos en el instrumento {indice}: {e}"}), 400
+                else:
+                    content_html = instrumento.get(campo_html)
+                    if not content_html:
+                        return jsonify({"error": f"Falta '{campo_html}' en el instrumento {indice}."}), 400
+                rendered_html = renderizar_plantilla_reporte(content_html, base_url, tipo)
+                clave = cache_pdf.CachePDF.clave(rendered_html, tipo, base_url)
+                trabajos.append((f"{carpeta}{prefijo_archivo}.pdf", rendered_html, clave))
+
+        marca = datetime.now().strftime('%d%m%Y%H%M%S')
+        if formato == 'zip':
+            generador, mimetype, file_name = _generar_zip_reportes(trabajos), 'application/zip', f"Reportes_{marca}.zip"
+        else:
+            generador, mimetype, file_name = _generar_pdf_combinado(trabajos), 'application/pdf', f"Reportes_{marca}.pdf"
+
+        def transmitir():
+            try:
+                yield from generador
+            except Exception as e:
+                registrar_error(e)
+                # La respuesta ya empezó: sólo queda registrar el error y cortar el envío
+                app.logger.error(f"Error al generar la exportación masiva: {e}", exc_info=True)
+
+        response = Response(stream_with_context(transmitir()), mimetype=mimetype)
         response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
         return response
 
     except Exception as e:
+        registrar_error(e)
         app.logger.error(f"Error al generar el PDF: {e}", exc_info=True)
         return jsonify({"error": "Ocurrió un error interno al generar el PDF."}), 500
 
+@app.route('/exportar-pdf/<id_trabajo>', methods=['GET'])
+def estado_pdf_ruta(id_trabajo):
+    """Devuelve el estado de un PDF asíncrono o el archivo si ya terminó."""
+    trabajo = cola_pdf.consultar(id_trabajo)
+    if trabajo is None:
+        return jsonify({"error": "El trabajo no existe o ya expiró."}), 404
+    if trabajo['estado'] == 'terminado':
+        return respuesta_pdf(trabajo['pdf'], trabajo['file_name'], trabajo['clave'])
+    if trabajo['estado'] == 'error':
+        app.logger.error(f"Error al generar el PDF del trabajo {id_trabajo}: {trabajo['error']}")
+        # Un proceso de render caído no es un error del reporte: se informa para reintentar
+        mensaje = (trabajo['error'] if trabajo['error'] == trabajos_pdf.ERROR_PROCESO_CAIDO
+                   else "Ocurrió un error interno al generar el PDF.")
+        return jsonify({"id": id_trabajo, "estado": "error", "error": mensaje}), 500
+    return jsonify({"id": id_trabajo, "estado": trabajo['estado']}), 202
+
+@app.route('/exportar-pdf/cache/<clave>', methods=['GET'])
+def pdf_cache_ruta(clave):
+    """
+    Sirve un PDF ya generado por su clave. El navegador lo revalida con
+    If-None-Match y recibe 304 sin volver a descargarlo.
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', clave):
+        return jsonify({"error": "Clave de PDF inválida."}), 404
+    if request.if_none_match.contains(clave):
+        return respuesta_no_modificada(clave)
+    pdf = cache_reportes.obtener(clave)
+    if pdf is None:
+        return jsonify({"error": "El PDF no está en caché."}), 404
+    file_name = secure_filename(request.args.get('nombre', '')) or f"Reporte_{clave[:12]}.pdf"
+    return respuesta_pdf(pdf, file_name, clave)
+
+@app.route('/cache-pdf/estadisticas', methods=['GET'])
+def estadisticas_cache_pdf_ruta():
+    """Contadores de aciertos y fallos de la caché de PDF."""
+    return jsonify(cache_reportes.estadisticas())
+
+@app.route('/cache-respuestas/estadisticas', methods=['GET'])
+def estadisticas_cache_respuestas_ruta():
+    """Contadores de aciertos y fallos de la caché de respuestas de /calcular."""
+    return jsonify(cache_respuestas.estadisticas())
+
+def _historial_activo():
+    if historial_calculos is None:
+        return jsonify({"error": "El historial de calibraciones está desactivado (CALCULADORA_HISTORIAL_DB)."}), 404
+    return None
+
+@app.route('/historial', methods=['GET'])
+def historial_ruta():
+    """
+    Lista los cálculos guardados, del más reciente al más antiguo. Filtros opcionales:
+    serie, id_instrumento, patron, cliente, desde y hasta (fecha de calibración,
+    AAAA-MM-DD). Se pagina con 'limite' y con el 'cursor' devuelto en 'siguiente'.
+    """
+    error = _historial_activo()
+    if error:
+        return error
+    try:
+        filtros = {filtro: request.args.get(filtro) or None for filtro in historial.FILTROS}
+        calculos, siguiente = historial_calculos.buscar(
+            limite=request.args.get('limite', 50, type=int),
+            cursor=request.args.get('cursor') or None,
+            desde=request.args.get('desde') or None,
+            hasta=request.args.get('hasta') or None,
+            **filtros,
+        )
+    except ValueError as e:
+        registrar_error(e)
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"calculos": calculos, "siguiente": siguiente})
+
+@app.route('/historial/<calculo_id>', methods=['GET'])
+def historial_calculo_ruta(calculo_id):
+    """Entradas, resultados y reportes guardados de un cálculo."""
+    error = _historial_activo()
+    if error:
+        return error
+    calculo = historial_calculos.obtener(calculo_id)
+    if calculo is None:
+        return jsonify({"error": "El cálculo no está en el historial."}), 404
+    return jsonify(calculo)
+
+@app.route('/historial/<calculo_id>/pdf/<report_type>', methods=['GET'])
+def historial_pdf_ruta(calculo_id, report_type):
+    """El PDF emitido para un cálculo, tal como se entregó."""
+    error = _historial_activo()
+    if error:
+        return error
+    pdf = historial_calculos.obtener_pdf(calculo_id, report_type)
+    if pdf is None:
+        return jsonify({"error": "No hay un PDF guardado de ese tipo para el cálculo."}), 404
+    prefijo_archivo = TIPOS_REPORTE[report_type][1] if report_type in TIPOS_REPORTE else 'Reporte'
+    return respuesta_pdf(pdf, f"{prefijo_archivo}_{calculo_id[:12]}.pdf")
+
+def respuesta_pdf(pdf, file_name, clave=None):
+    """Crea la respuesta para que el navegador descargue el archivo."""
+    response = make_response(pdf)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    if clave:
+        response.set_etag(clave)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['Content-Location'] = url_for('pdf_cache_ruta', clave=clave)
+    return response
+
+def respuesta_no_modificada(clave):
+    """304 para un cliente que ya tiene el PDF con esa clave."""
+    response = make_response('', 304)
+    response.set_etag(clave)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 if __name__ == '__main__':
-    # Añadir el manejador de archivos al logger de la aplicación
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
+    # Servidor de desarrollo (recarga y depurador); en producción: python servidor.py
+    crear_app()
     app.logger.info('*** Servidor de Calculadora Iniciado ***')
     app.run(debug=True)
@@ -0,0 +1,81 @@
+"""
+Compara el factor de cobertura tabulado contra scipy.stats.t.ppf.
+
+Uso: python benchmarks/bench_cobertura.py [--repeticiones N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy.stats import t
+
+import calculadora
+import cobertura
+
+CONSTANTES = {
+    'tanaka_a1': -3.983035, 'tanaka_a2': 301.797, 'tanaka_a3': 522528.9,
+    'tanaka_a4': 69.34881, 'tanaka_a5': 999.97495,
+    'rho_aire_o51': 0.34848, 'rho_aire_o52': 0.009, 'rho_aire_o53': 0.061,
+    'alpha_material_pp': 0.00024, 'rho_pesa_n74': 8000,
+    'corr_ta_y': {'a': 0.0005, 'b': 0.0025, 'c': 0.05},
+    'corr_tamb_y': {'a': 0.0109, 'b': -0.45, 'c': 4.6637},
+    'corr_hr_y': {'a': 0.0008, 'b': -0.1635, 'c': 5.7469},
+    'corr_patm_y': {'a': 0.0001, 'b': -0.1526, 'c': 60.12},
+}
+
+def payload_pocos_grados(semilla=0, repeticiones=4):
+    """Payload con repetibilidad dominante para que v_eff < 100 en todos los aforos."""
+    rnd = random.Random(semilla)
+    data = {
+        'constantes': dict(CONSTANTES),
+        'entradas_generales': {'div_min_valor': 0.02, 'unidades': 'µL'},
+    }
+    for i, nominal in enumerate((2.0, 10.0, 20.0), start=1):
+        data[f'aforo{i}'] = {
+            'valor_nominal': nominal,
+            'mediciones_masa': [nominal / 1000 * (1 + rnd.uniform(-0.05, 0.05)) for _ in range(repeticiones)],
+            'mediciones_ambientales': [
+                {'temp_agua': 19.0, 'temp_amb': 19.2, 'presion': 783.2, 'humedad': 53.5}
+                for _ in range(repeticiones)
+            ],
+        }
+    return data
+
+def _k_scipy(grados_libertad):
+    """Camino anterior: una llamada a scipy por cálculo."""
+    return t.ppf(1 - 0.0455 / 2, df=grados_libertad)
+
+def medir(funcion, repeticiones):
+    """Tiempo medio por llamada en microsegundos (mejor de 5 series)."""
+    return min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeticiones', type=int, default=2000)
+    args = parser.parse_args()
+    n = args.repeticiones
+
+    grados = np.array([3.0, 5.0, 9.0])
+    print("Factor de cobertura (3 aforos con v_eff < 100):")
+    print(f"  scipy.stats.t.ppf : {medir(lambda: _k_scipy(grados), n):9.2f} µs")
+    print(f"  tabla precalculada: {medir(lambda: cobertura.factor_cobertura(grados), n):9.2f} µs")
+
+    data = payload_pocos_grados()
+    original = calculadora.factor_cobertura
+    try:
+        calculadora.factor_cobertura = _k_scipy
+        antes = medir(lambda: calculadora.procesar_todos_los_aforos(data), n // 4)
+    finally:
+        calculadora.factor_cobertura = original
+    despues = medir(lambda: calculadora.procesar_todos_los_aforos(data), n // 4)
+    print("procesar_todos_los_aforos:")
+    print(f"  con scipy          : {antes:9.2f} µs")
+    print(f"  con tabla          : {despues:9.2f} µs  (ahorro {antes - despues:.2f} µs por cálculo)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Latencia de render de PDF por tipo de reporte: HTML(string).write_pdf() en frío
+contra el RenderizadorPDF reutilizable del proceso.
+
+Requiere WeasyPrint con sus bibliotecas nativas (Pango).
+Uso: python benchmarks/bench_renderizador.py [--repeticiones N] [--base-url http://127.0.0.1:5000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacion
+import reportes
+
+def contenido_ejemplo(report_type, filas=10):
+    """Contenido representativo de cada reporte: encabezado, texto y tabla de mediciones."""
+    celdas = ''.join(
+        f"<tr><td>{i}</td><td>{2 + i * 0.001:.3f}</td><td>{10 + i * 0.002:.3f}</td><td>{20 + i * 0.003:.3f}</td></tr>"
+        for i in range(1, filas + 1)
+    )
+    return (
+        f"<h2>{report_type.capitalize()}</h2>"
+        "<p>Los resultados que a continuación se emiten corresponden al servicio de PIPETA DE PISTÓN.</p>"
+        f"<table><thead><tr><th>No.</th><th>2 µL</th><th>10 µL</th><th>20 µL</th></tr></thead><tbody>{celdas}</tbody></table>"
+    )
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos), max(tiempos)
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de render de PDF por tipo de reporte.")
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    args = parser.parse_args()
+
+    HTML = reportes.cargar_weasyprint()
+    renderizador = reportes.obtener_renderizador()
+
+    print(f"{'reporte':<12} {'antes mediana ms':>17} {'después mediana ms':>19} {'primer render ms':>17}")
+    with aplicacion.app.test_request_context():
+        for report_type in aplicacion.TIPOS_REPORTE:
+            rendered_html = aplicacion.renderizar_plantilla_reporte(
+                contenido_ejemplo(report_type), args.base_url, report_type
+            )
+            antes, _ = medir(lambda: HTML(string=rendered_html).write_pdf(), args.repeticiones)
+            # El primer render con el renderizador incluye cargar las fuentes y leer los recursos
+            primero, _ = medir(lambda: renderizador.renderizar(rendered_html), 1)
+            despues, _ = medir(lambda: renderizador.renderizar(rendered_html), args.repeticiones)
+            print(f"{report_type:<12} {antes:>17.1f} {despues:>19.1f} {primero:>17.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Prueba de carga con varias instancias del servidor detrás de un reparto round-robin.
+
+Levanta 1, 2, 4... instancias de servidor.py (un worker cada una, en puertos
+consecutivos) que comparten el estado en archivos (CALCULADORA_ESTADO=archivos) y la
+configuración (CALCULADORA_CONFIG_DIR), y les envía /calcular desde varios procesos
+cliente con conexiones persistentes, repartiendo las peticiones entre las instancias
+como lo haría un balanceador. Parte de los payloads se repite, de modo que una
+respuesta calculada en una instancia se sirve desde la caché compartida en otra.
+
+Por cada cantidad de instancias reporta peticiones/s, latencias p50/p99 y la
+escalabilidad respecto de la primera corrida, y comprueba que todas las instancias
+devuelven el mismo cuerpo y ETag para el mismo payload. La escalabilidad está acotada
+por los núcleos de la máquina (que también ejecutan los clientes).
+
+Uso:
+  python benchmarks/carga.py [--instancias 1,2,4] [--clientes 8] [--peticiones 2000]
+                             [--repetidos 0.5] [--config DIR] [--puerto 8100] [--json salida.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from generador_payloads import generar_lote
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def iniciar_instancias(cantidad, puerto, config, directorio):
+    """Lanza `cantidad` servidores con el estado en `directorio` y devuelve sus procesos."""
+    procesos = []
+    for i in range(cantidad):
+        entorno = dict(
+            os.environ,
+            CALCULADORA_BIND=f'127.0.0.1:{puerto + i}',
+            CALCULADORA_WORKERS='1',
+            CALCULADORA_ESTADO=f"archivos:{os.path.join(directorio, 'estado')}",
+            CALCULADORA_PDF_CACHE_DIR=os.path.join(directorio, 'cache_pdf'),
+            CALCULADORA_HISTORIAL_DB='',
+        )
+        if config:
+            entorno['CALCULADORA_CONFIG_DIR'] = os.path.abspath(config)
+        registro = open(os.path.join(directorio, f'instancia{i}.log'), 'wb')
+        procesos.append(subprocess.Popen(
+            [sys.executable, 'servidor.py'], cwd=RAIZ, env=entorno, stdout=registro, stderr=subprocess.STDOUT,
+        ))
+    return procesos
+
+def esperar_instancias(puertos, procesos, limite_s=60):
+    """Espera a que cada instancia responda; lanza RuntimeError si alguna termina o no arranca."""
+    fin = time.monotonic() + limite_s
+    for puerto, proceso in zip(puertos, procesos):
+        while True:
+            if proceso.poll() is not None:
+                raise RuntimeError(f"La instancia del puerto {puerto} terminó al arrancar (código {proceso.returncode})")
+            try:
+                conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=2)
+                conexion.request('GET', '/cache-respuestas/estadisticas')
+                if conexion.getresponse().status == 200:
+                    conexion.close()
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > fin:
+                raise RuntimeError(f"La instancia del puerto {puerto} no respondió en {limite_s} s")
+            time.sleep(0.2)
+
+def detener_instancias(procesos):
+    for proceso in procesos:
+        proceso.terminate()
+    for proceso in procesos:
+        try:
+            proceso.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+def _post(conexion, cuerpo, cabeceras=None):
+    conexion.request('POST', '/calcular', body=cuerpo,
+                     headers={'Content-Type': 'application/json', **(cabeceras or {})})
+    respuesta = conexion.getresponse()
+    return respuesta.status, respuesta.getheader('ETag'), respuesta.read()
+
+def cliente(puertos, cuerpos, desfase):
+    """
+    Envía `cuerpos` repartiéndolos en round-robin entre `puertos`, con una conexión
+    persistente por instancia. Devuelve (latencias en segundos, errores).
+    """
+    conexiones = [http.client.HTTPConnection('127.0.0.1', puerto, timeout=60) for puerto in puertos]
+    latencias = []
+    errores = 0
+    for i, cuerpo in enumerate(cuerpos):
+        conexion = conexiones[(desfase + i) % len(conexiones)]
+        inicio = time.perf_counter()
+        try:
+            estado, _, _ = _post(conexion, cuerpo, {'Accept-Encoding': 'br, gzip'})
+        except (OSError, http.client.HTTPException):
+            conexion.close()
+            estado = None
+        latencias.append(time.perf_counter() - inicio)
+        if estado != 200:
+            errores += 1
+    for conexion in conexiones:
+        conexion.close()
+    return latencias, errores
+
+def preparar_cuerpos(peticiones, repetidos, semilla):
+    """
+    `peticiones` payloads codificados: una fracción `repetidos` sale de un conjunto
+    pequeño de payloads (aciertos de caché) y el resto es distinto en cada petición.
+    """
+    comunes = [json.dumps(p).encode('utf-8') for p in generar_lote(20, semilla=semilla)]
+    unicos = iter(json.dumps(p).encode('utf-8')
+                  for p in generar_lote(peticiones, semilla=semilla + 1000))
+    aleatorio = random.Random(semilla)
+    return [aleatorio.choice(comunes) if aleatorio.random() < repetidos else next(unicos)
+            for _ in range(peticiones)]
+
+def comprobar_consistencia(puertos, semilla):
+    """
+    Calcula un payload nuevo en la primera instancia y lo pide a las demás: todas
+    deben devolver el mismo cuerpo y ETag (servido desde el estado compartido).
+    """
+    cuerpo = json.dumps(generar_lote(1, semilla=semilla)[0]).encode('utf-8')
+    vistos = set()
+    for puerto in puertos:
+        conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=60)
+        estado, etag, datos = _post(conexion, cuerpo)
+        conexion.close()
+        if estado != 200:
+            return False
+        vistos.add((etag, datos))
+    return len(vistos) == 1
+
+def aciertos_cache(puertos):
+    aciertos = 0
+    for puerto in puertos:
+        conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=10)
+        conexion.request('GET', '/cache-respuestas/estadisticas')
+        aciertos += json.loads(conexion.getresponse().read())['aciertos']
+        conexion.close()
+    return aciertos
+
+def correr(instancias, args):
+    directorio = tempfile.mkdtemp(prefix='calculadora-carga-')
+    puertos = [args.puerto + i for i in range(instancias)]
+    procesos = iniciar_instancias(instancias, args.puerto, args.config, directorio)
+    try:
+        esperar_instancias(puertos, procesos)
+        cuerpos = preparar_cuerpos(args.peticiones, args.repetidos, semilla=instancias * 100000)
+        partes = [cuerpos[i::args.clientes] for i in range(args.clientes)]
+        inicio = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.clientes) as pool:
+            resultados = list(pool.map(cliente, [puertos] * args.clientes, partes, range(args.clientes)))
+        duracion = time.perf_counter() - inicio
+        latencias = np.concatenate([latencias for latencias, _ in resultados]) * 1000
+        return {
+            'instancias': instancias,
+            'peticiones': len(latencias),
+            'errores': sum(errores for _, errores in resultados),
+            'peticiones_s': len(latencias) / duracion,
+            'p50_ms': float(np.percentile(latencias, 50)),
+            'p99_ms': float(np.percentile(latencias, 99)),
+            'aciertos_cache': aciertos_cache(puertos),
+            'consistente': comprobar_consistencia(puertos, semilla=instancias * 100000 + 50000),
+        }
+    finally:
+        detener_instancias(procesos)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con varias instancias del servidor.")
+    parser.add_argument('--instancias', default='1,2,4', help="Cantidades de instancias a probar")
+    parser.add_argument('--clientes', type=int, default=8, help="Procesos cliente concurrentes")
+    parser.add_argument('--peticiones', type=int, default=2000, help="Peticiones por corrida")
+    parser.add_argument('--repetidos', type=float, default=0.5, help="Fracción de payloads repetidos")
+    parser.add_argument('--config', default=None, help="Directorio con patrones.json, site_config.json y emts.json")
+    parser.add_argument('--puerto', type=int, default=8100, help="Puerto de la primera instancia")
+    parser.add_argument('--json', dest='salida_json', default=None, help="Guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} núcleos, {args.clientes} clientes, {args.peticiones} peticiones "
+          f"({args.repetidos:.0%} repetidas)")
+    print(f"{'instancias':>10} {'pet/s':>9} {'escala':>7} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'errores':>8} {'aciertos':>9} {'consistente':>12}")
+    resultados = []
+    for instancias in (int(n) for n in args.instancias.split(',')):
+        resultado = correr(instancias, args)
+        base = resultados[0]['peticiones_s'] if resultados else resultado['peticiones_s']
+        resultado['escala'] = resultado['peticiones_s'] / base
+        resultados.append(resultado)
+        print(f"{instancias:>10} {resultado['peticiones_s']:>9.1f} {resultado['escala']:>6.2f}x "
+              f"{resultado['p50_ms']:>8.2f} {resultado['p99_ms']:>8.2f} {resultado['errores']:>8} "
+              f"{resultado['aciertos_cache']:>9} {'sí' if resultado['consistente'] else 'NO':>12}")
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as f:
+            json.dump({'nucleos': os.cpu_count(), 'resultados': resultados}, f, indent=2)
+    return 0 if all(r['errores'] == 0 and r['consistente'] for r in resultados) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
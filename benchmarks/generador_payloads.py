@@ -0,0 +1,114 @@
+"""
+Generador de payloads realistas para /calcular.
+
+Toma como modelo los datos de prueba de `autocompleteWithTestData` (static/js/main.js):
+pipeta de 20 µL con aforos al 10 %, 50 % y 100 % del volumen nominal, masas con unos
+miligramos de dispersión y condiciones ambientales de laboratorio redondeadas a 0.1,
+como las captura el formulario. Se puede variar el número de aforos y de repeticiones.
+
+Uso como script: python benchmarks/generador_payloads.py [--cantidad 5] [--aforos 3] [--repeticiones 10] > lote.json
+"""
+import argparse
+import json
+import random
+import sys
+
+# Constantes completas que espera el motor (el frontend aún no envía las de Tanaka ni las de corrección)
+CONSTANTES = {
+    'tanaka_a1': -3.983035, 'tanaka_a2': 301.797, 'tanaka_a3': 522528.9,
+    'tanaka_a4': 69.34881, 'tanaka_a5': 999.97495,
+    'rho_aire_o51': 0.34848, 'rho_aire_o52': 0.009, 'rho_aire_o53': 0.061,
+    'alpha_material_pp': 0.00024, 'rho_pesa_n74': 8000,
+    'corr_ta_y': {'a': 0.0005, 'b': 0.0025, 'c': 0.05},
+    'corr_tamb_y': {'a': 0.0109, 'b': -0.45, 'c': 4.6637},
+    'corr_hr_y': {'a': 0.0008, 'b': -0.1635, 'c': 5.7469},
+    'corr_patm_y': {'a': 0.0001, 'b': -0.1526, 'c': 60.12},
+}
+
+# Encabezado de testData.header, con los campos que usa el cálculo
+ENCABEZADO = {
+    'descripcion_instrumento': "PIPETA DE PISTÓN",
+    'clase_instrumento': "N.A.",
+    'tipo_instrumento': "ANALOGICO",
+    'marca_instrumento': "GILSON",
+    'modelo_instrumento': "PIPETMAN",
+    'unidades': "µL",
+    'tipo_volumen': "VARIABLE",
+    'tipo_calibracion': "TD",
+    'id_instrumento': "S / ID",
+    'div_min_valor': 0.02,
+    'patron_seleccionado': "CAL-VO-002",
+    'auxiliar_ta': "CAL-VO-005",
+    'auxiliar_ca': "CAL-VO-051",
+    'ajuste_realizado': "N",
+    'mantenimientos': ["Limpieza externa", "Lubricación"],
+}
+
+# Fracciones del volumen nominal de cada aforo (las tres del formulario, y más si se piden)
+FRACCIONES_NOMINALES = (0.1, 0.5, 1.0, 0.2, 0.8, 0.3, 0.6, 0.9, 0.4, 0.7)
+
+def generar_payload(semilla=0, aforos=3, repeticiones=10, vol_nominal=20):
+    """Payload de /calcular con `aforos` aforos de `repeticiones` mediciones cada uno."""
+    if not 1 <= aforos <= len(FRACCIONES_NOMINALES):
+        raise ValueError(f"El número de aforos debe estar entre 1 y {len(FRACCIONES_NOMINALES)}.")
+    rnd = random.Random(semilla)
+    entradas = dict(ENCABEZADO)
+    entradas['serie_instrumento'] = f"B-{rnd.randint(10, 99)}-{rnd.randint(10000, 99999)}"
+    entradas['intervalo_min_reporte'] = vol_nominal / 10
+    entradas['intervalo_max_reporte'] = vol_nominal
+
+    nominales = sorted(vol_nominal * fraccion for fraccion in FRACCIONES_NOMINALES[:aforos])
+    entradas['condiciones_iniciales'] = {
+        f'promedio{i}': round(nominal * (1 + rnd.uniform(-0.005, 0.005)), 2)
+        for i, nominal in enumerate(nominales, start=1)
+    }
+    data = {'constantes': json.loads(json.dumps(CONSTANTES)), 'entradas_generales': entradas}
+
+    # Condiciones de partida; derivan lentamente durante el servicio
+    temp_agua = rnd.uniform(18.5, 21.5)
+    temp_amb = temp_agua + rnd.uniform(0, 0.5)
+    presion = rnd.uniform(780, 786)
+    humedad = rnd.uniform(45, 60)
+    for i, nominal in enumerate(nominales, start=1):
+        masa_nominal_g = nominal / 1000  # 1 µL de agua ≈ 1 mg
+        mediciones_masa = []
+        mediciones_ambientales = []
+        for _ in range(repeticiones):
+            # Masa = lleno - vacío; el vacío de testData es 0.0000 g
+            mediciones_masa.append(round(masa_nominal_g * (1 + rnd.gauss(0, 0.01)), 6))
+            temp_agua += rnd.choice((-0.05, 0, 0, 0.05))
+            temp_amb += rnd.choice((-0.1, 0, 0, 0.1))
+            presion += rnd.choice((-0.1, 0, 0.1))
+            humedad += rnd.choice((-0.1, 0, 0.1, 0.1))
+            mediciones_ambientales.append({
+                'temp_agua': round(temp_agua, 1),
+                'temp_amb': round(temp_amb, 1),
+                'presion': round(presion, 1),
+                'humedad': round(humedad, 1),
+            })
+        data[f'aforo{i}'] = {
+            'valor_nominal': nominal,
+            'mediciones_masa': mediciones_masa,
+            'mediciones_ambientales': mediciones_ambientales,
+        }
+    return data
+
+def generar_lote(cantidad, semilla=0, aforos=3, repeticiones=10, vol_nominal=20):
+    """Lista de `cantidad` payloads distintos y reproducibles."""
+    return [generar_payload(semilla + i, aforos, repeticiones, vol_nominal) for i in range(cantidad)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera payloads de /calcular en JSON.")
+    parser.add_argument('--cantidad', type=int, default=1)
+    parser.add_argument('--aforos', type=int, default=3)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--vol-nominal', type=float, default=20)
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    lote = generar_lote(args.cantidad, args.semilla, args.aforos, args.repeticiones, args.vol_nominal)
+    json.dump(lote[0] if args.cantidad == 1 else lote, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
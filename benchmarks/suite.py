@@ -0,0 +1,263 @@
+"""
+Suite de rendimiento: núcleo de cálculo, textos del reporte, endpoints de Flask y
+render de PDF por tipo de reporte. Reporta rendimiento (operaciones/s) y latencias
+p50/p99, guarda el resultado en JSON y puede compararlo con una corrida base.
+
+Uso:
+  python benchmarks/suite.py [--rapido] [--solo nucleo,endpoint,...] [--config DIR]
+                             [--json salida.json] [--comparar base.json] [--tolerancia 0.2]
+
+Los payloads salen de generador_payloads.py. Los escenarios de endpoint necesitan
+los archivos de configuración completos (static/config o --config DIR); los de PDF
+necesitan WeasyPrint con sus bibliotecas nativas y se omiten si no está disponible.
+Con --comparar termina con código 1 si algún p50 empeora más que la tolerancia.
+La aplicación corre sin historial, con el estado en memoria y la caché de PDF en un
+directorio temporal, para no escribir en instance/.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import calculadora
+from generador_payloads import generar_lote
+
+GRUPOS = ('nucleo', 'textos', 'endpoint', 'lote', 'pdf')
+
+# (aforos, repeticiones) del núcleo: el formulario actual es 3 x 10
+FORMAS_NUCLEO = ((3, 4), (3, 10), (3, 30), (6, 10))
+TAMANOS_LOTE = (10, 100)
+# Llamadas de calentamiento, con argumentos propios: repetir los medidos los dejaría en caché
+CALENTAMIENTO = 3
+
+def estadisticas(tiempos_s, operaciones_por_llamada=1):
+    """Resumen de una serie de tiempos (segundos por llamada)."""
+    tiempos_ms = np.asarray(tiempos_s) * 1000
+    total_s = float(np.sum(tiempos_s))
+    return {
+        'llamadas': len(tiempos_ms),
+        'p50_ms': float(np.percentile(tiempos_ms, 50)),
+        'p99_ms': float(np.percentile(tiempos_ms, 99)),
+        'media_ms': float(np.mean(tiempos_ms)),
+        'max_ms': float(np.max(tiempos_ms)),
+        'operaciones_s': len(tiempos_ms) * operaciones_por_llamada / total_s if total_s else float('inf'),
+    }
+
+def _dividir(argumentos, calentamiento=CALENTAMIENTO):
+    """Separa los primeros `calentamiento` argumentos (para calentar) de los que se miden."""
+    return argumentos[:calentamiento], argumentos[calentamiento:]
+
+def medir(funcion, argumentos, calentamiento=()):
+    """
+    Llama a `funcion` con cada elemento de `calentamiento` sin medir y luego con cada
+    elemento de `argumentos`; devuelve los tiempos de estos últimos.
+    """
+    for argumento in calentamiento:
+        funcion(argumento)
+    tiempos = []
+    for argumento in argumentos:
+        inicio = time.perf_counter()
+        funcion(argumento)
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+def escenarios_nucleo(llamadas, configuracion):
+    resultados = {}
+    for aforos, repeticiones in FORMAS_NUCLEO:
+        calentamiento, payloads = _dividir(
+            generar_lote(CALENTAMIENTO + llamadas, aforos=aforos, repeticiones=repeticiones)
+        )
+        tiempos = medir(lambda data: calculadora.procesar_todos_los_aforos(data, configuracion), payloads, calentamiento)
+        resultados[f'nucleo/{aforos}x{repeticiones}'] = estadisticas(tiempos)
+    return resultados
+
+def escenarios_textos(llamadas, configuracion):
+    payloads = generar_lote(CALENTAMIENTO + llamadas)
+    argumentos = [
+        (data['entradas_generales'], calculadora.procesar_todos_los_aforos(data, configuracion)['aforos'])
+        for data in payloads
+    ]
+    calentamiento, argumentos = _dividir(argumentos)
+    tiempos = medir(lambda args: calculadora.generar_textos_reporte(
+        args[0], args[1], configuracion.get('especificaciones_patrones', {}), configuracion.get('site_config', {})
+    ), argumentos, calentamiento)
+    return {'textos/generar_textos_reporte': estadisticas(tiempos)}
+
+def _cliente(aplicacion):
+    cliente = aplicacion.app.test_client()
+    error = aplicacion.verificar_configuracion(aplicacion.configuracion_calculo())
+    if error:
+        raise RuntimeError(f"Configuración incompleta para los endpoints: {error[0].get_json()['error']}")
+    return cliente
+
+def _post(cliente, ruta, cuerpo, **kwargs):
+    respuesta = cliente.post(ruta, json=cuerpo, **kwargs)
+    if respuesta.status_code != 200:
+        raise RuntimeError(f"{ruta} respondió {respuesta.status_code}: {respuesta.get_data(as_text=True)[:300]}")
+    return respuesta
+
+def escenarios_endpoint(llamadas, aplicacion):
+    cliente = _cliente(aplicacion)
+    calentamiento, payloads = _dividir(generar_lote(CALENTAMIENTO + llamadas))
+    tiempos = medir(lambda data: _post(cliente, '/calcular', data), payloads, calentamiento)
+    resultados = {'endpoint/calcular': estadisticas(tiempos)}
+
+    # El mismo payload una y otra vez (vista previa y exportación): sale de la caché de respuestas
+    tiempos = medir(lambda data: _post(cliente, '/calcular', data), [payloads[0]] * llamadas)
+    resultados['endpoint/calcular_repetido'] = estadisticas(tiempos)
+
+    # Un resultado grande, sin comprimir y comprimido (payloads distintos, para no medir la
+    # caché); se anota el tamaño medio de la respuesta
+    for i, (sufijo, codificacion) in enumerate((('', 'identity'), ('_gzip', 'gzip'), ('_br', 'br')), 1):
+        calentamiento, grandes = _dividir(generar_lote(
+            CALENTAMIENTO + llamadas, semilla=i * (CALENTAMIENTO + llamadas), aforos=FORMAS_NUCLEO[-1][0], repeticiones=30
+        ))
+        tamanos = []
+        tiempos = medir(lambda data: tamanos.append(len(_post(
+            cliente, '/calcular', data, headers={'Accept-Encoding': codificacion}
+        ).data)), grandes, calentamiento)
+        del tamanos[:len(calentamiento)]
+        resultados[f'endpoint/calcular_6x30{sufijo}'] = dict(
+            estadisticas(tiempos), bytes_respuesta=int(np.mean(tamanos))
+        )
+    return resultados
+
+def escenarios_lote(llamadas, aplicacion):
+    cliente = _cliente(aplicacion)
+    resultados = {}
+    for tamano in TAMANOS_LOTE:
+        repeticiones = max(3, llamadas // tamano)
+        calentamiento, lotes = _dividir([generar_lote(tamano, semilla=i * tamano) for i in range(1 + repeticiones)], 1)
+        tiempos = medir(lambda lote: _post(cliente, '/calcular-lote', lote), lotes, calentamiento)
+        # Rendimiento en cálculos por segundo, no en peticiones
+        resultados[f'lote/{tamano}'] = estadisticas(tiempos, operaciones_por_llamada=tamano)
+    return resultados
+
+def escenarios_pdf(llamadas, aplicacion):
+    import cache_pdf
+    import reportes
+    reportes.cargar_weasyprint()
+    cliente = _cliente(aplicacion)
+    # Sin caché: cada petición mide el render completo
+    aplicacion.cache_reportes = cache_pdf.CachePDF(max_bytes_memoria=0)
+    resultados_calculo = [
+        _post(cliente, '/calcular', data).get_json()
+        for data in generar_lote(1 + max(3, llamadas // 10))
+    ]
+    resultados = {}
+    for report_type in aplicacion.TIPOS_REPORTE:
+        cuerpos = [
+            {'report_type': report_type, 'base_url': 'http://127.0.0.1:5000', 'resultados': resultado}
+            for resultado in resultados_calculo
+        ]
+        calentamiento, cuerpos = _dividir(cuerpos, 1)
+        tiempos = medir(lambda cuerpo: _post(cliente, '/exportar-pdf', cuerpo), cuerpos, calentamiento)
+        resultados[f'pdf/{report_type}'] = estadisticas(tiempos)
+    return resultados
+
+def correr_grupos(grupos, llamadas, aplicacion):
+    configuracion = aplicacion.configuracion_calculo()
+    escenarios = {}
+    for grupo in grupos:
+        try:
+            if grupo == 'nucleo':
+                escenarios.update(escenarios_nucleo(llamadas, configuracion))
+            elif grupo == 'textos':
+                escenarios.update(escenarios_textos(llamadas, configuracion))
+            elif grupo == 'endpoint':
+                escenarios.update(escenarios_endpoint(llamadas, aplicacion))
+            elif grupo == 'lote':
+                escenarios.update(escenarios_lote(llamadas, aplicacion))
+            elif grupo == 'pdf':
+                escenarios.update(escenarios_pdf(llamadas, aplicacion))
+        except (ImportError, OSError, RuntimeError) as e:
+            # Los errores de WeasyPrint sin Pango ocupan varias líneas: basta la primera
+            motivo = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+            print(f"Se omite '{grupo}': {motivo}")
+    return escenarios
+
+def comparar(actual, base, tolerancia):
+    """Imprime la comparación de p50 contra la base y devuelve los escenarios que empeoraron."""
+    regresiones = []
+    print(f"\n{'escenario':<32} {'base p50 ms':>12} {'actual p50 ms':>14} {'cambio':>8}")
+    for nombre, stats in actual.items():
+        anterior = base.get(nombre)
+        if anterior is None:
+            print(f"{nombre:<32} {'-':>12} {stats['p50_ms']:>14.3f} {'nuevo':>8}")
+            continue
+        cambio = stats['p50_ms'] / anterior['p50_ms'] - 1 if anterior['p50_ms'] else 0.0
+        marca = '  REGRESIÓN' if cambio > tolerancia else ''
+        print(f"{nombre:<32} {anterior['p50_ms']:>12.3f} {stats['p50_ms']:>14.3f} {cambio:>+7.1%}{marca}")
+        if cambio > tolerancia:
+            regresiones.append(nombre)
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Suite de rendimiento de la calculadora.")
+    parser.add_argument('--llamadas', type=int, default=200, help="Llamadas medidas por escenario")
+    parser.add_argument('--rapido', action='store_true', help="Pocas llamadas, para comprobar que todo corre")
+    parser.add_argument('--solo', default=','.join(GRUPOS), help=f"Grupos a correr: {', '.join(GRUPOS)}")
+    parser.add_argument('--config', default=None, help="Directorio con patrones.json, site_config.json y emts.json")
+    parser.add_argument('--json', dest='salida_json', default=None, help="Guardar los resultados en JSON")
+    parser.add_argument('--comparar', default=None, help="JSON de una corrida base para comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="Empeoramiento de p50 tolerado (0.2 = 20 %%)")
+    args = parser.parse_args()
+
+    llamadas = 20 if args.rapido else args.llamadas
+    grupos = [grupo.strip() for grupo in args.solo.split(',') if grupo.strip()]
+    desconocidos = set(grupos) - set(GRUPOS)
+    if desconocidos:
+        parser.error(f"Grupos desconocidos: {', '.join(sorted(desconocidos))}")
+
+    # app lee su configuración del entorno al importarse
+    directorio = tempfile.mkdtemp(prefix='calculadora-suite-')
+    os.environ.update(
+        CALCULADORA_HISTORIAL_DB='',
+        CALCULADORA_ESTADO='memoria',
+        CALCULADORA_PDF_CACHE_DIR=os.path.join(directorio, 'cache_pdf'),
+    )
+    try:
+        import app as aplicacion
+        if args.config:
+            import almacen_configuracion
+            aplicacion.almacen_config = almacen_configuracion.AlmacenConfiguracion(args.config)
+        escenarios = correr_grupos(grupos, llamadas, aplicacion)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"{'escenario':<32} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'media ms':>9}")
+    for nombre, stats in escenarios.items():
+        print(f"{nombre:<32} {stats['operaciones_s']:>10.1f} {stats['p50_ms']:>9.3f} "
+              f"{stats['p99_ms']:>9.3f} {stats['media_ms']:>9.3f}")
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'cpus': os.cpu_count(),
+                'llamadas': llamadas,
+                'escenarios': escenarios,
+            }, f, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            base = json.load(f)['escenarios']
+        regresiones = comparar(escenarios, base, args.tolerancia)
+        if regresiones:
+            print(f"\nERROR: {len(regresiones)} escenario(s) empeoraron más de {args.tolerancia:.0%}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
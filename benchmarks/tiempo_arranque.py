@@ -0,0 +1,74 @@
+"""
+Reporte del tiempo de arranque: cuánto tarda en importarse cada módulo de la app.
+
+Ejecuta `python -X importtime -c "import app"` en un proceso limpio y resume el
+tiempo acumulado por módulo. Con --presupuesto-ms termina con código 1 si el
+arranque lo excede, para vigilarlo en CI.
+
+Uso: python benchmarks/tiempo_arranque.py [--modulo app] [--top 15] [--presupuesto-ms 800] [--json salida.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def medir_importacion(modulo):
+    """
+    Importa `modulo` en un intérprete nuevo y devuelve (tiempo total en ms, lista de
+    (módulo, propio_ms, acumulado_ms)) tal como la reporta -X importtime.
+    """
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=RAIZ, capture_output=True, text=True
+    )
+    total_ms = (time.perf_counter() - inicio) * 1000
+    if proceso.returncode != 0:
+        raise RuntimeError(f"No se pudo importar '{modulo}':\n{proceso.stderr[-2000:]}")
+
+    modulos = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, acumulado, nombre = linea[len('import time:'):].split('|', 2)
+        modulos.append((nombre.strip(), int(propio) / 1000, int(acumulado) / 1000))
+    return total_ms, modulos
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación por módulo.")
+    parser.add_argument('--modulo', default='app', help="Módulo a importar (por defecto: app)")
+    parser.add_argument('--top', type=int, default=15, help="Número de módulos a mostrar")
+    parser.add_argument('--presupuesto-ms', type=float, default=None,
+                        help="Falla si el arranque completo supera este tiempo")
+    parser.add_argument('--json', dest='salida_json', default=None, help="Guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    total_ms, modulos = medir_importacion(args.modulo)
+    # Sólo los módulos de primer nivel (los que importa directamente el código)
+    primer_nivel = [m for m in modulos if '.' not in m[0]]
+    primer_nivel.sort(key=lambda m: m[2], reverse=True)
+
+    print(f"Arranque de '{args.modulo}': {total_ms:.1f} ms (intérprete incluido)")
+    print(f"{'módulo':<30} {'acumulado ms':>13} {'propio ms':>10}")
+    for nombre, propio, acumulado in primer_nivel[:args.top]:
+        print(f"{nombre:<30} {acumulado:>13.1f} {propio:>10.1f}")
+
+    if args.salida_json:
+        with open(args.salida_json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'modulo': args.modulo,
+                'total_ms': total_ms,
+                'modulos': [{'modulo': n, 'propio_ms': p, 'acumulado_ms': a} for n, p, a in modulos],
+            }, f, indent=2)
+
+    if args.presupuesto_ms is not None and total_ms > args.presupuesto_ms:
+        print(f"ERROR: el arranque ({total_ms:.1f} ms) excede el presupuesto de {args.presupuesto_ms:.1f} ms")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
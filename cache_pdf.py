@@ -0,0 +1,193 @@
+"""
+Caché de PDF direccionada por contenido.
+
+La clave es un hash del HTML renderizado, el tipo de reporte y la base_url: el mismo
+reporte produce siempre la misma clave, que también sirve como ETag. Hay un nivel en
+memoria y otro en disco, ambos con desalojo LRU y un límite de bytes. Varios procesos
+pueden compartir el directorio: lo que escribe uno lo encuentra otro. Como cada proceso
+sólo conoce sus propias escrituras, cada `escrituras_por_limpieza` escrituras vuelve a
+medir el directorio (como estado._EspacioArchivos.limpiar) y desaloja hasta que el total
+cumple el límite.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class CachePDF:
+    """
+    - max_bytes_memoria: límite del nivel en memoria (0 lo desactiva).
+    - directorio / max_bytes_disco: nivel en disco; sin directorio no se usa.
+    - escrituras_por_limpieza: escrituras en disco entre dos mediciones del directorio.
+    """
+
+    def __init__(self, max_bytes_memoria=64 * 1024 * 1024, directorio=None, max_bytes_disco=512 * 1024 * 1024,
+                 escrituras_por_limpieza=20):
+        self.max_bytes_memoria = max_bytes_memoria
+        self.max_bytes_disco = max_bytes_disco if directorio else 0
+        self.directorio = directorio
+        self.escrituras_por_limpieza = escrituras_por_limpieza
+        self._escrituras_disco = 0
+
+        self._memoria = OrderedDict()  # clave -> bytes
+        self._bytes_memoria = 0
+        self._disco = OrderedDict()    # clave -> tamaño en bytes
+        self._bytes_disco = 0
+        self._lock = threading.Lock()
+        self._contadores = {'hits_memoria': 0, 'hits_disco': 0, 'misses': 0, 'escrituras': 0, 'desalojos': 0}
+
+        if self.max_bytes_disco:
+            os.makedirs(directorio, exist_ok=True)
+            self._indexar_disco()
+
+    @staticmethod
+    def clave(rendered_html, report_type, base_url):
+        """Hash SHA-256 del contenido que determina el PDF."""
+        h = hashlib.sha256()
+        for parte in (report_type or '', base_url or '', rendered_html):
+            h.update(parte.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    # --- Nivel en disco ---
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.pdf')
+
+    def _indexar_disco(self):
+        """
+        Reconstruye el índice LRU a partir de los archivos del directorio (por fecha de
+        uso), incluidos los que escribieron otros procesos, y desaloja lo que exceda.
+        """
+        archivos = []
+        ahora = time.time()
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                if entrada.name.endswith('.tmp'):
+                    # Un temporal viejo es de un proceso que murió a mitad de una escritura
+                    if ahora - info.st_mtime > 3600:
+                        try:
+                            os.remove(entrada.path)
+                        except OSError:
+                            pass
+                elif entrada.name.endswith('.pdf'):
+                    archivos.append((info.st_mtime, entrada.name[:-4], info.st_size))
+        archivos.sort()
+        with self._lock:
+            self._disco = OrderedDict((clave, tamano) for _, clave, tamano in archivos)
+            self._bytes_disco = sum(tamano for _, _, tamano in archivos)
+            self._desalojar_disco()
+
+    def _desalojar_disco(self):
+        while self._bytes_disco > self.max_bytes_disco and self._disco:
+            clave, tamano = self._disco.popitem(last=False)
+            self._bytes_disco -= tamano
+            self._contadores['desalojos'] += 1
+            try:
+                os.remove(self._ruta(clave))
+            except OSError:
+                pass
+
+    def _leer_disco(self, clave):
+        try:
+            with open(self._ruta(clave), 'rb') as f:
+                pdf = f.read()
+            os.utime(self._ruta(clave))  # Conservar el orden LRU entre reinicios
+            return pdf
+        except OSError:
+            return None
+
+    def _escribir_disco(self, clave, pdf):
+        # Escritura atómica: otro proceso nunca ve un PDF a medio escribir.
+        temporal = f'{self._ruta(clave)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(pdf)
+        os.replace(temporal, self._ruta(clave))
+
+    # --- Nivel en memoria ---
+
+    def _guardar_memoria(self, clave, pdf):
+        if len(pdf) > self.max_bytes_memoria:
+            return
+        anterior = self._memoria.pop(clave, None)
+        if anterior is not None:
+            self._bytes_memoria -= len(anterior)
+        self._memoria[clave] = pdf
+        self._bytes_memoria += len(pdf)
+        while self._bytes_memoria > self.max_bytes_memoria:
+            _, desalojado = self._memoria.popitem(last=False)
+            self._bytes_memoria -= len(desalojado)
+            self._contadores['desalojos'] += 1
+
+    # --- API pública ---
+
+    def obtener(self, clave):
+        """Devuelve los bytes del PDF o None. Un acierto en disco se promueve a memoria."""
+        with self._lock:
+            pdf = self._memoria.get(clave)
+            if pdf is not None:
+                self._memoria.move_to_end(clave)
+                self._contadores['hits_memoria'] += 1
+                return pdf
+            # Fuera del índice también se busca: puede haberlo escrito otro proceso
+            en_disco = self.max_bytes_disco > 0
+
+        if en_disco:
+            pdf = self._leer_disco(clave)
+            with self._lock:
+                if pdf is not None:
+                    if clave in self._disco:
+                        self._disco.move_to_end(clave)
+                    else:
+                        self._disco[clave] = len(pdf)
+                        self._bytes_disco += len(pdf)
+                        self._desalojar_disco()
+                    self._guardar_memoria(clave, pdf)
+                    self._contadores['hits_disco'] += 1
+                    return pdf
+                # El archivo desapareció (p. ej. lo borró otro proceso)
+                tamano = self._disco.pop(clave, None)
+                if tamano is not None:
+                    self._bytes_disco -= tamano
+
+        with self._lock:
+            self._contadores['misses'] += 1
+        return None
+
+    def guardar(self, clave, pdf):
+        """Guarda un PDF en ambos niveles, desalojando los menos usados si hace falta."""
+        with self._lock:
+            self._guardar_memoria(clave, pdf)
+            self._contadores['escrituras'] += 1
+            guardar_en_disco = 0 < len(pdf) <= self.max_bytes_disco and clave not in self._disco
+
+        if guardar_en_disco:
+            try:
+                self._escribir_disco(clave, pdf)
+            except OSError:
+                return
+            with self._lock:
+                if clave not in self._disco:
+                    self._disco[clave] = len(pdf)
+                    self._bytes_disco += len(pdf)
+                    self._desalojar_disco()
+                self._escrituras_disco += 1
+                medir = self._escrituras_disco % self.escrituras_por_limpieza == 0
+            if medir:
+                self._indexar_disco()
+
+    def estadisticas(self):
+        """Contadores de aciertos/fallos y ocupación de cada nivel."""
+        with self._lock:
+            return dict(
+                self._contadores,
+                entradas_memoria=len(self._memoria),
+                bytes_memoria=self._bytes_memoria,
+                entradas_disco=len(self._disco),
+                bytes_disco=self._bytes_disco,
+            )
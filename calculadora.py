@@ -1,95 +1,25 @@
+import bisect
+import functools
+import json
+import logging
 import math
-from scipy.stats import t
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from cobertura import factor_cobertura
+import metricas
+from modelo import CLAVES_CORRECCION, ErrorValidacion, validar_peticion
+from montecarlo import calcular_montecarlo
+
+logger = logging.getLogger(__name__)
 
 # --- LÓGICA CENTRAL REUTILIZABLE ---
 
-def calcular_un_volumen_corregido(masa_g, factores):
-    """
-    Aplica la fórmula principal para convertir una única medición de masa (en g)
-    a un volumen corregido (en µL).
-    """
-    masa_kg = masa_g / 1000.0
-    
-    # V_20 = m * (1/(ρ_w - ρ_a)) * (1 - α(t_w - 20))
-    # Se elimina el factor 'pesa' (Z2) de la fórmula principal, según el análisis del documento del cliente.
-    # La fórmula ahora es: V_20 = masa_kg * Z1 * Z3
-    volumen_m3 = masa_kg * factores['flotacion'] * factores['dilatacion']
-    # Convertir de m³ a µL (1 m³ = 1e9 µL) y redondear
-    # Se elimina el redondeo intermedio para mantener la máxima precisión.
-    return volumen_m3 * 1e9
-
-def calcular_factores_de_correccion(promedios_ambientales, constantes):
-    """
-    Calcula los factores de corrección (P65, P70, P78) para un aforo específico,
-    basado en sus condiciones ambientales promedio.
-    """
-    p_temp_agua = promedios_ambientales['temp_agua']
-    p_temp_aire = promedios_ambientales['temp_amb']
-    p_presion_hpa = promedios_ambientales['presion']
-    p_humedad_rel = promedios_ambientales['humedad']
-
-    c = constantes # constantes del frontend (contiene tanaka_a1, etc.)
-
-    # Densidad del Agua (ρ_A) - Ecuación de Tanaka según el documento
-    # PA = a5 * [1 - ((ta + a1)² * (ta + a2)) / (a3 * (ta + a4))]
-    numerador = (p_temp_agua + c['tanaka_a1'])**2 * (p_temp_agua + c['tanaka_a2'])
-    denominador = c['tanaka_a3'] * (p_temp_agua + c['tanaka_a4'])
-    rho_agua = c['tanaka_a5'] * (1 - (numerador / denominador))
-
-    # Densidad del Aire (ρ_a) - Fórmula CIPM-2007 (implementación del Excel)
-    # Esta fórmula usa las constantes del frontend que ya están cargadas
-    exp_term = math.exp(c['rho_aire_o53'] * p_temp_aire)
-    rho_aire = ((c['rho_aire_o51'] * p_presion_hpa) - (c['rho_aire_o52'] * p_humedad_rel * exp_term)) / (273.15 + p_temp_aire)
-    
-    factor_flotacion = 1 / (rho_agua - rho_aire) if (rho_agua - rho_aire) != 0 else 1
-    factor_pesa = 1 - (rho_aire / c['rho_pesa_n74'])
-    factor_dilatacion = 1 - (c['alpha_material_pp'] * (p_temp_agua - 20))
-    
-    return {
-        'flotacion': factor_flotacion,
-        'pesa': factor_pesa,
-        'dilatacion': factor_dilatacion,
-        'rho_agua': rho_agua,
-        'rho_aire': rho_aire
-    }
-
-def corregir_y_promediar_condiciones(mediciones_ambientales, constantes):
-    """
-    Toma las 10 mediciones ambientales de un aforo, aplica la fórmula de corrección
-    cuadrática a cada una y devuelve el promedio de cada magnitud.
-    """
-    if not mediciones_ambientales:
-        return {'temp_agua': 0, 'temp_amb': 0, 'presion': 0, 'humedad': 0}
-
-    num_mediciones = len(mediciones_ambientales)
-
-    # 1. Calcular el promedio de los valores brutos
-    promedio_temp_agua = sum(med['temp_agua'] for med in mediciones_ambientales) / num_mediciones
-    promedio_temp_amb = sum(med['temp_amb'] for med in mediciones_ambientales) / num_mediciones
-    promedio_presion = sum(med['presion'] for med in mediciones_ambientales) / num_mediciones
-    promedio_humedad = sum(med['humedad'] for med in mediciones_ambientales) / num_mediciones
-
-    # 2. Aplicar la corrección cuadrática al promedio (restando, según el documento)
-    # CORRECCIÓN: Se revierte a la suma para coincidir con el comportamiento del Excel validado.
-    corr_t_agua = (constantes['corr_ta_y']['a'] * promedio_temp_agua**2) + (constantes['corr_ta_y']['b'] * promedio_temp_agua) + constantes['corr_ta_y']['c']
-    temp_agua_final = promedio_temp_agua + corr_t_agua
-
-    corr_t_amb = (constantes['corr_tamb_y']['a'] * promedio_temp_amb**2) + (constantes['corr_tamb_y']['b'] * promedio_temp_amb) + constantes['corr_tamb_y']['c']
-    temp_amb_final = promedio_temp_amb + corr_t_amb
-
-    corr_presion = (constantes['corr_patm_y']['a'] * promedio_presion**2) + (constantes['corr_patm_y']['b'] * promedio_presion) + constantes['corr_patm_y']['c']
-    presion_final = promedio_presion + corr_presion
-
-    corr_humedad = (constantes['corr_hr_y']['a'] * promedio_humedad**2) + (constantes['corr_hr_y']['b'] * promedio_humedad) + constantes['corr_hr_y']['c']
-    humedad_final = promedio_humedad + corr_humedad
-
-    return {
-        'temp_agua': temp_agua_final,
-        'temp_amb': temp_amb_final,
-        'presion': presion_final,
-        'humedad': humedad_final,
-    }
-
 def generar_textos_reporte(entradas_generales, resultados_aforos, especificaciones_patrones, site_config):
     """
     Genera los textos dinámicos del reporte.
@@ -129,9 +59,8 @@ def generar_textos_reporte(entradas_generales, resultados_aforos, especificacion
     valores_nominales = [f"{a['valor_nominal']:.0f} {unidades}" for a in resultados_aforos]
     cond_iniciales = eg.get('condiciones_iniciales', {})
     resultados_iniciales = [
-        f"{cond_iniciales.get('promedio1', 0):.2f} {unidades}",
-        f"{cond_iniciales.get('promedio2', 0):.2f} {unidades}",
-        f"{cond_iniciales.get('promedio3', 0):.2f} {unidades}",
+        f"{cond_iniciales.get(f'promedio{i}', 0):.2f} {unidades}"
+        for i in range(1, len(resultados_aforos) + 1)
     ]
     
     palabra_clave = "ajuste" if eg.get('ajuste_realizado') == 'S' else "calibración"
@@ -195,143 +124,259 @@ def buscar_emt(valor_nominal_ul, emt_config, clase_instrumento):
     # Si no se encuentra una coincidencia exacta, devuelve 0 o un valor por defecto.
     return 0
 
-# --- FUNCIÓN PRINCIPAL ---
+# Modos de búsqueda del EMT para valores nominales que no aparecen en la tabla.
+MODOS_BUSQUEDA_EMT = ('exacta', 'cercana', 'intervalo')
 
-def procesar_todos_los_aforos(data):
+class IndiceEMT:
     """
-    Función principal que orquesta todo el proceso de cálculo.
+    Tablas de EMT indexadas por clase y alcance. La búsqueda exacta es un acceso a
+    diccionario (O(1)); 'cercana' e 'intervalo' usan bisección sobre los alcances ordenados:
+      - 'exacta': sólo coincidencias exactas, como `buscar_emt` (0 si no está).
+      - 'cercana': el EMT del alcance más próximo (en empate, el mayor).
+      - 'intervalo': el EMT del menor alcance que contiene al valor (0 si los supera todos).
     """
-    constantes = data['constantes']
-    entradas_generales = data['entradas_generales']
-    especificaciones_patrones = data.get('especificaciones_patrones', {})
-    debug_mode = entradas_generales.get('debug_mode', False)
-    emts_config = data.get('emts_config', {})
-    # Añadir la resolución del instrumento a las constantes para usarla en el cálculo de incertidumbre
-    tolerancia_instrumento = entradas_generales.get('tolerancia', 0)
-    constantes['div_min_valor'] = entradas_generales.get('div_min_valor', 0)
 
-    site_config = data.get('site_config', {})
-    resultados_por_aforo = []
+    def __init__(self, emt_config):
+        self._tablas = {}
+        for clase, tabla in emt_config.items():
+            exactos = {}
+            for limite in tabla:
+                # Como en el recorrido lineal, gana la primera fila con ese alcance.
+                exactos.setdefault(limite['alcance_ul'], limite['emt_ul'])
+            alcances = sorted(exactos)
+            self._tablas[clase] = (exactos, alcances, [exactos[alcance] for alcance in alcances])
+
+    def buscar(self, valor_nominal_ul, clase_instrumento, modo='exacta'):
+        tabla = self._tablas.get(clase_instrumento, self._tablas.get('default'))
+        if tabla is None:
+            return 0
+        exactos, alcances, emts = tabla
+
+        emt = exactos.get(valor_nominal_ul)
+        if emt is not None or modo == 'exacta' or not alcances:
+            return emt if emt is not None else 0
+
+        posicion = bisect.bisect_left(alcances, valor_nominal_ul)
+        if modo == 'intervalo':
+            return emts[posicion] if posicion < len(alcances) else 0
+        if modo == 'cercana':
+            if posicion == 0:
+                return emts[0]
+            if posicion == len(alcances):
+                return emts[-1]
+            menor, mayor = alcances[posicion - 1], alcances[posicion]
+            return emts[posicion] if mayor - valor_nominal_ul <= valor_nominal_ul - menor else emts[posicion - 1]
+        raise ValueError(f"Modo de búsqueda de EMT desconocido: {modo}")
+
+# --- MOTOR VECTORIZADO ---
+
+# Las constantes llegan al motor como modelo.Constantes; las magnitudes ambientales van
+# en el orden de CAMPOS_AMBIENTALES.
+
+# Constantes para la corrección interna (lógica PDF), en el orden de CAMPOS_AMBIENTALES.
+CONSTANTES_CORRECCION_PDF = {
+    'corr_ta_y': { 'a': 0.0005, 'b': 0.0025, 'c': 0.05 },
+    'corr_tamb_y': { 'a': 0.0109, 'b': -0.45, 'c': 4.6637 },
+    'corr_patm_y': { 'a': 0.0001, 'b': -0.1526, 'c': 60.12 },
+    'corr_hr_y': { 'a': 0.0008, 'b': -0.1635, 'c': 5.7469 },
+}
+
+def _suma_secuencial(matriz):
+    """
+    Suma las filas de `matriz` una a una, en el mismo orden que sum() de Python.
+    np.sum usa suma por pares y podría diferir en el último bit del cálculo original.
+    """
+    acumulado = np.array(matriz[0], dtype=float)
+    for fila in matriz[1:]:
+        acumulado += fila
+    return acumulado
 
-    promedios_ambientales_aforos = []
+def _cuadrado(arreglo):
+    """
+    `arreglo ** 2` como x * x, vectorizado. Puede diferir en el último bit del x ** 2 de
+    Python (ver _potencia), pero en las correcciones, la densidad del agua y las
+    desviaciones de las repeticiones esa diferencia no llega a los resultados.
+    """
+    arreglo = np.asarray(arreglo, dtype=float)
+    return np.multiply(arreglo, arreglo)
 
-    # --- CÁLCULO DE EMT COMÚN PARA TODOS LOS CANALES ---
-    # 1. Encontrar el valor nominal máximo de los tres aforos.
-    max_valor_nominal = max(data['aforo1']['valor_nominal'], data['aforo2']['valor_nominal'], data['aforo3']['valor_nominal'])
-    
-    # 2. Buscar el EMT una sola vez usando ese valor máximo.
-    clase_instrumento = entradas_generales.get('clase_instrumento', 'default').lower()
-    emt_comun = buscar_emt(max_valor_nominal, emts_config, clase_instrumento)
+def _potencia(arreglo, exponente):
+    """
+    `arreglo ** exponente` elemento a elemento con el pow() de C, como el operador ** de
+    los float de Python, que no siempre coincide con x * x en el último bit. Recorre los
+    elementos en Python: sólo para arreglos de N aforos cuyo último bit llega al
+    resultado (el presupuesto de incertidumbre).
+    """
+    arreglo = np.asarray(arreglo, dtype=float)
+    return np.array([x ** exponente for x in arreglo.ravel().tolist()]).reshape(arreglo.shape)
 
-    # Obtener el valor nominal del último aforo, que se usará como divisor para el error porcentual
-    valor_nominal_ref_porcentaje = data['aforo3']['valor_nominal']
-
-    # --- Lógica de dos cerebros: uno para la pantalla, otro para los cálculos ---
-    # 1. Constantes para la corrección interna (lógica PDF)
-    constantes_pdf = {
-        'corr_ta_y': { 'a': 0.0005, 'b': 0.0025, 'c': 0.05 },
-        'corr_tamb_y': { 'a': 0.0109, 'b': -0.45, 'c': 4.6637 },
-        'corr_hr_y': { 'a': 0.0008, 'b': -0.1635, 'c': 5.7469 },
-        'corr_patm_y': { 'a': 0.0001, 'b': -0.1526, 'c': 60.12 },
+def _coeficientes_correccion(constantes_correccion):
+    """Devuelve los coeficientes (a, b, c) de corrección como arreglos de 4 elementos."""
+    a = np.array([constantes_correccion[clave]['a'] for clave in CLAVES_CORRECCION])
+    b = np.array([constantes_correccion[clave]['b'] for clave in CLAVES_CORRECCION])
+    c = np.array([constantes_correccion[clave]['c'] for clave in CLAVES_CORRECCION])
+    return a, b, c
+
+_COEFICIENTES_CORRECCION_PDF = _coeficientes_correccion(CONSTANTES_CORRECCION_PDF)
+
+def promediar_condiciones_brutas(ambientales):
+    """
+    Promedia las mediciones ambientales sin corregir.
+    `ambientales` tiene forma (N aforos, K mediciones, 4); devuelve (N, 4).
+    """
+    with metricas.etapa('promedio_ambiental'):
+        ambientales = np.asarray(ambientales, dtype=float)
+        if ambientales.ndim != 3 or ambientales.shape[1] == 0:
+            raise ValueError("Cada aforo debe tener al menos una medición ambiental.")
+        # Mediciones como eje externo para sumarlas en orden.
+        return _suma_secuencial(ambientales.transpose(1, 0, 2)) / ambientales.shape[1]
+
+def calcular_factores_vectorizado(promedios_brutos, constantes):
+    """
+    Corrige las condiciones ambientales promedio de N aforos, `promedios_brutos` (N, 4)
+    en el orden de CAMPOS_AMBIENTALES, y calcula sus factores de corrección. Sólo
+    depende de los promedios y de las constantes (modelo.Constantes), así que el
+    resultado se puede reutilizar mientras no cambien.
+    """
+    promedios_brutos = np.asarray(promedios_brutos, dtype=float)
+
+    # 1. Corrección cuadrática de las condiciones (la de pantalla suma, la interna resta)
+    a, b, c = constantes.coeficientes_correccion
+    promedios_ambientales = promedios_brutos + ((a * _cuadrado(promedios_brutos)) + (b * promedios_brutos) + c)
+    a, b, c = _COEFICIENTES_CORRECCION_PDF
+    promedios_internos = promedios_brutos - ((a * _cuadrado(promedios_brutos)) + (b * promedios_brutos) + c)
+
+    # 2. Factores de corrección: densidad del agua (Tanaka), del aire (CIPM-2007) y
+    # factores de flotación, pesa y dilatación
+    p_temp_agua, p_temp_aire, p_presion_hpa, p_humedad_rel = promedios_internos.T
+    numerador = _cuadrado(p_temp_agua + constantes.tanaka_a1) * (p_temp_agua + constantes.tanaka_a2)
+    denominador = constantes.tanaka_a3 * (p_temp_agua + constantes.tanaka_a4)
+    rho_agua = constantes.tanaka_a5 * (1 - (numerador / denominador))
+
+    # math.exp y no np.exp: la implementación SIMD de numpy difiere de la de C en el
+    # último bit para algunos valores, y ese bit llega a la incertidumbre expandida
+    exp_term = np.array([math.exp(x) for x in (constantes.rho_aire_o53 * p_temp_aire).tolist()])
+    rho_aire = ((constantes.rho_aire_o51 * p_presion_hpa) - (constantes.rho_aire_o52 * p_humedad_rel * exp_term)) / (273.15 + p_temp_aire)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diferencia_densidades = rho_agua - rho_aire
+        factor_flotacion = np.where(diferencia_densidades != 0, 1 / diferencia_densidades, 1.0)
+        factor_pesa = 1 - (rho_aire / constantes.rho_pesa_n74)
+        factor_dilatacion = 1 - (constantes.alpha_material_pp * (p_temp_agua - 20))
+
+    return {
+        'promedios_ambientales': promedios_ambientales,
+        'promedios_internos': promedios_internos,
+        'rho_agua': rho_agua,
+        'rho_aire': rho_aire,
+        'flotacion': factor_flotacion,
+        'pesa': factor_pesa,
+        'dilatacion': factor_dilatacion,
     }
 
-    def corregir_para_pdf(promedios_brutos):
-        # Esta función aplica la lógica de corrección del PDF (restando)
-        temp_agua = promedios_brutos['temp_agua'] - ((constantes_pdf['corr_ta_y']['a'] * promedios_brutos['temp_agua']**2) + (constantes_pdf['corr_ta_y']['b'] * promedios_brutos['temp_agua']) + constantes_pdf['corr_ta_y']['c'])
-        temp_amb = promedios_brutos['temp_amb'] - ((constantes_pdf['corr_tamb_y']['a'] * promedios_brutos['temp_amb']**2) + (constantes_pdf['corr_tamb_y']['b'] * promedios_brutos['temp_amb']) + constantes_pdf['corr_tamb_y']['c'])
-        presion = promedios_brutos['presion'] - ((constantes_pdf['corr_patm_y']['a'] * promedios_brutos['presion']**2) + (constantes_pdf['corr_patm_y']['b'] * promedios_brutos['presion']) + constantes_pdf['corr_patm_y']['c'])
-        humedad = promedios_brutos['humedad'] - ((constantes_pdf['corr_hr_y']['a'] * promedios_brutos['humedad']**2) + (constantes_pdf['corr_hr_y']['b'] * promedios_brutos['humedad']) + constantes_pdf['corr_hr_y']['c'])
-        return {'temp_agua': temp_agua, 'temp_amb': temp_amb, 'presion': presion, 'humedad': humedad}
-    # --- Fin de la lógica de dos cerebros ---
-
-    for i in range(1, 4):
-        aforo_key = f'aforo{i}'
-        aforo_data = data[aforo_key]
-        
-        promedios_ambientales = corregir_y_promediar_condiciones(
-            aforo_data['mediciones_ambientales'],
-            constantes
-        )
-        promedios_ambientales_aforos.append(promedios_ambientales)
-        
-        # Calcular promedios brutos para la lógica interna
-        num_mediciones = len(aforo_data['mediciones_ambientales'])
-        promedios_brutos = {
-            'temp_agua': sum(med['temp_agua'] for med in aforo_data['mediciones_ambientales']) / num_mediciones,
-            'temp_amb': sum(med['temp_amb'] for med in aforo_data['mediciones_ambientales']) / num_mediciones,
-            'presion': sum(med['presion'] for med in aforo_data['mediciones_ambientales']) / num_mediciones,
-            'humedad': sum(med['humedad'] for med in aforo_data['mediciones_ambientales']) / num_mediciones,
-        }
-        promedios_internos_pdf = corregir_para_pdf(promedios_brutos)
-
-        factores = calcular_factores_de_correccion(
-            promedios_internos_pdf, # <-- Usamos los valores corregidos según el PDF
-            constantes
-        )
+MAX_FACTORES_MEMORIZADOS = 1024
+
+@functools.lru_cache(maxsize=MAX_FACTORES_MEMORIZADOS)
+def factores_memorizados(promedio_bruto, constantes):
+    """
+    calcular_factores_vectorizado para un solo aforo, memorizado por sus promedios
+    ambientales brutos (tupla de 4) y sus constantes (modelo.Constantes, que se comparan
+    por valor): al editar una masa, las condiciones del aforo no cambian y sus factores
+    se reutilizan. Los arreglos devueltos se comparten entre llamadas y son de sólo lectura.
+    """
+    factores = calcular_factores_vectorizado([promedio_bruto], constantes)
+    for arreglo in factores.values():
+        arreglo.flags.writeable = False
+    return factores
+
+def calcular_aforos_desde_promedios(masas_g, promedios_brutos, valores_nominales, constantes,
+                                    div_min_valor=0, valor_nominal_ref=None, factores=None):
+    """
+    Núcleo del cálculo para N aforos a la vez.
 
-        volumenes_corregidos_ul = [
-            calcular_un_volumen_corregido(masa_g, factores)
-            for masa_g in aforo_data['mediciones_masa']
-        ]
-        
-        # Asegurarnos de que espec_patron sea un diccionario, incluso si no se encuentra.
-        patron_key = entradas_generales.get('patron_seleccionado')
-        espec_patron = especificaciones_patrones.get(patron_key) if patron_key else {}
-        if espec_patron is None or not isinstance(espec_patron, dict):
-            espec_patron = {}
-        
-        # --- CÁLCULO DE INCERTIDUMBRE (Lógica corregida y unificada) ---
-        # PASO 6: INCERTIDUMBRES ESTÁNDAR u(x)
+    `masas_g` tiene forma (N aforos, M repeticiones) y `promedios_brutos` (N, 4) en el
+    orden de CAMPOS_AMBIENTALES. `factores` es el resultado de calcular_factores_vectorizado
+    para esos promedios, si ya se tiene. Devuelve un diccionario de arreglos con los
+    volúmenes corregidos, los errores y el presupuesto de incertidumbre de cada aforo.
+    """
+    inicio = time.perf_counter()
+    masas_g = np.asarray(masas_g, dtype=float)
+    if masas_g.ndim != 2 or masas_g.shape[1] == 0:
+        raise ValueError("Cada aforo debe tener al menos una medición de masa.")
+    num_repeticiones = masas_g.shape[1]
+    # Repeticiones como eje externo: (M, N)
+    masas_g = np.ascontiguousarray(masas_g.T)
+    valores_nominales = np.asarray(valores_nominales, dtype=float)
+    if valor_nominal_ref is None:
+        valor_nominal_ref = valores_nominales[-1]
+
+    if factores is None:
+        factores = calcular_factores_vectorizado(promedios_brutos, constantes)
+    promedios_ambientales = factores['promedios_ambientales']
+    rho_agua = factores['rho_agua']
+    rho_aire = factores['rho_aire']
+    factor_flotacion = factores['flotacion']
+    factor_dilatacion = factores['dilatacion']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diferencia_densidades = rho_agua - rho_aire
+
+        # 3. Volúmenes corregidos (µL): V_20 = masa_kg * Z1 * Z3
+        volumenes_ul = (masas_g / 1000.0) * factor_flotacion * factor_dilatacion * 1e9
+
+        inicio = metricas.fin_etapa('factores_correccion', inicio)
+
+        # 4. Incertidumbres estándar u(x) (iguales para todos los aforos)
         u_R_kg = 2.8867e-8
         u_C_kg = 7.5e-8
         u_E_kg = 2.31e-8
         u_M_kg = math.sqrt(u_R_kg**2 + u_C_kg**2 + u_E_kg**2)
-        
+
         u_tA_C = 0.0757
         d_rhoA_dtA = -0.2236
         u_CmPA_kg_m3 = 4.15e-4
         u_rho_A_kg_m3 = math.sqrt((d_rhoA_dtA * u_tA_C)**2 + u_CmPA_kg_m3**2)
-        
+
         u_rho_a_kg_m3_sq = 1.9688e-6
         u_rho_a_kg_m3 = math.sqrt(u_rho_a_kg_m3_sq)
-        
-        rho_B = constantes['rho_pesa_n74']
+
+        rho_B = constantes.rho_pesa_n74
         u_rho_B_kg_m3 = (rho_B * 0.03) / math.sqrt(12)
-        
-        gamma = constantes['alpha_material_pp']
+
+        gamma = constantes.alpha_material_pp
         u_gamma_C = (gamma * 0.2) / math.sqrt(12)
-        
-        tr = promedios_ambientales['temp_agua']
+
+        tr = promedios_ambientales[:, 0]
         u_tr_C = 0.0786
-        
-        volumenes_corregidos_m3 = [v / 1e9 for v in volumenes_corregidos_ul]
-        if len(volumenes_corregidos_m3) > 1:
-            media_vol = sum(volumenes_corregidos_m3) / len(volumenes_corregidos_m3)
-            desv_est_vol = math.sqrt(sum([(v - media_vol)**2 for v in volumenes_corregidos_m3]) / (len(volumenes_corregidos_m3) - 1))
-            u_Crep_m3 = desv_est_vol / math.sqrt(len(volumenes_corregidos_m3))
+
+        volumenes_m3 = volumenes_ul / 1e9
+        V20_prom_m3 = _suma_secuencial(volumenes_m3) / num_repeticiones
+        if num_repeticiones > 1:
+            desv_est_vol = np.sqrt(_suma_secuencial(_cuadrado(volumenes_m3 - V20_prom_m3)) / (num_repeticiones - 1))
+            u_Crep_m3 = desv_est_vol / math.sqrt(num_repeticiones)
         else:
-            u_Crep_m3 = 0
-            
-        u_Cres_m3 = (constantes.get('div_min_valor', 0) / 1e9) / math.sqrt(12)
+            u_Crep_m3 = np.zeros_like(V20_prom_m3)
+
+        u_Cres_m3 = (div_min_valor / 1e9) / math.sqrt(12)
         u_Crepro_m3 = 0.23 / 1e9
-        
-        # PASO 7: COEFICIENTES DE SENSIBILIDAD cᵢ
-        V20_prom_m3 = sum(volumenes_corregidos_m3) / len(volumenes_corregidos_m3) if volumenes_corregidos_m3 else 0
-        masas_kg = [m / 1000.0 for m in aforo_data['mediciones_masa']]
-        masa_aparente_prom_kg = sum(masas_kg) / len(masas_kg) if masas_kg else 0
-        
-        rho_A = factores['rho_agua']
-        rho_a = factores['rho_aire']
-        
-        c_Mo = -V20_prom_m3 / masa_aparente_prom_kg if masa_aparente_prom_kg != 0 else 0
-        c_Mi = V20_prom_m3 / masa_aparente_prom_kg if masa_aparente_prom_kg != 0 else 0
-        c_rho_A = -V20_prom_m3 / (rho_A - rho_a) if (rho_A - rho_a) != 0 else 0
-        c_rho_a = V20_prom_m3 * (1/(rho_A - rho_a) - 1/(rho_B - rho_a)) if (rho_A - rho_a) != 0 and (rho_B - rho_a) != 0 else 0
-        c_rho_B = V20_prom_m3 * rho_a / (rho_B * (rho_B - rho_a)) if rho_B != 0 and (rho_B - rho_a) != 0 else 0
-        c_gamma = -V20_prom_m3 * (tr - 20) / (1 - gamma * (tr - 20)) if (1 - gamma * (tr - 20)) != 0 else 0
-        c_tr = -V20_prom_m3 * gamma / (1 - gamma * (tr - 20)) if (1 - gamma * (tr - 20)) != 0 else 0
-        
-        # PASO 8: INCERTIDUMBRE COMBINADA u_c(V₂₀)
+
+        # 5. Coeficientes de sensibilidad cᵢ
+        masa_aparente_prom_kg = _suma_secuencial(masas_g / 1000.0) / num_repeticiones
+        rho_A = rho_agua
+        rho_a = rho_aire
+        denominador_dilatacion = 1 - gamma * (tr - 20)
+
+        c_Mo = np.where(masa_aparente_prom_kg != 0, -V20_prom_m3 / masa_aparente_prom_kg, 0.0)
+        c_Mi = np.where(masa_aparente_prom_kg != 0, V20_prom_m3 / masa_aparente_prom_kg, 0.0)
+        c_rho_A = np.where(diferencia_densidades != 0, -V20_prom_m3 / diferencia_densidades, 0.0)
+        c_rho_a = np.where((diferencia_densidades != 0) & ((rho_B - rho_a) != 0),
+                           V20_prom_m3 * (1/(rho_A - rho_a) - 1/(rho_B - rho_a)), 0.0)
+        c_rho_B = np.where((rho_B != 0) & ((rho_B - rho_a) != 0),
+                           V20_prom_m3 * rho_a / (rho_B * (rho_B - rho_a)), 0.0)
+        c_gamma = np.where(denominador_dilatacion != 0, -V20_prom_m3 * (tr - 20) / denominador_dilatacion, 0.0)
+        c_tr = np.where(denominador_dilatacion != 0, -V20_prom_m3 * gamma / denominador_dilatacion, 0.0)
+
+        # 6. Incertidumbre combinada u_c(V₂₀)
         u_y_Mo = c_Mo * u_M_kg
         u_y_Mi = c_Mi * u_M_kg
         u_y_rho_A = c_rho_A * u_rho_A_kg_m3
@@ -342,94 +387,429 @@ def procesar_todos_los_aforos(data):
         u_y_Crep = u_Crep_m3      # Coeficiente de sensibilidad es 1
         u_y_Cres = u_Cres_m3      # Coeficiente de sensibilidad es 1
         u_y_Crepro = u_Crepro_m3  # Coeficiente de sensibilidad es 1
-        
-        u_c_sq = (u_y_Mo**2 + u_y_Mi**2 + u_y_rho_A**2 + u_y_rho_a**2 + u_y_rho_B**2 +
-                  u_y_gamma**2 + u_y_tr**2 + u_y_Crep**2 + u_y_Cres**2 + u_y_Crepro**2)
-        u_c_m3 = math.sqrt(u_c_sq)
-        
-        # PASO 9: INCERTIDUMBRE EXPANDIDA U
-        v_rep = len(masas_kg) - 1 if len(masas_kg) > 1 else float('inf')
-        if u_c_m3 > 0 and v_rep != float('inf') and u_y_Crep != 0:
-            denominador_v_eff = (u_y_Crep**4) / v_rep
-            v_eff = (u_c_m3**4) / denominador_v_eff if denominador_v_eff > 0 else float('inf')
-        else:
-            v_eff = float('inf')
 
-        k = 2.0 if v_eff >= 100 else t.ppf(1 - 0.0455 / 2, df=max(1, round(v_eff))) # Usar k=2 para v_eff grandes
-        incertidumbre = (u_c_m3 * k) * 1e9
-        
-        if debug_mode:
-            print(f"\n\n=== DIAGNÓSTICO UNIFICADO CANAL {i} ===")
-            print("\n--- PASO 6: INCERTIDUMBRES ESTÁNDAR (u_i) ---")
-            print(f"  u(Masa): {u_M_kg:.6e} kg")
-            print(f"  u(Temp Agua): {u_tA_C:.6f} °C")
-            print(f"  u(Densidad Agua): {u_rho_A_kg_m3:.6f} kg/m³")
-            print(f"  u(Densidad Aire): {u_rho_a_kg_m3:.6f} kg/m³")
-            print(f"  u(Densidad Pesa): {u_rho_B_kg_m3:.6f} kg/m³")
-            print(f"  u(Gamma): {u_gamma_C:.6e} °C⁻¹")
-            print(f"  u(Temp Recipiente): {u_tr_C:.6f} °C")
-            print(f"  u(Repetibilidad): {u_Crep_m3:.6e} m³")
-            print(f"  u(Resolución): {u_Cres_m3:.6e} m³")
-            print(f"  u(Reproducibilidad): {u_Crepro_m3:.6e} m³")
-
-            print("\n--- VALORES INTERMEDIOS CLAVE ---")
-            print(f"  Densidad del Agua (ρ_A) calculada: {rho_A:.4f} kg/m³")
-            print(f"  Densidad del Aire (ρ_a) calculada: {rho_a:.4f} kg/m³")
-            print(f"  Factor Flotación (Z1) calculado: {factores['flotacion']:.6f}")
-            print(f"  Factor Dilatación (Z3) calculado: {factores['dilatacion']:.6f}")
-            
-            print("\n--- PASO 7: COEFICIENTES DE SENSIBILIDAD (c_i) ---")
-            print(f"  c(Masa): {c_Mi:.6f} m³/kg")
-            print(f"  c(Densidad Agua): {c_rho_A:.6e} m³/ (kg/m³)")
-            # ... (se pueden añadir más si es necesario)
-
-            print("\n--- PASO 8 y 9: RESULTADOS ---")
-            print(f"  Incertidumbre Combinada (u_c): {u_c_m3 * 1e9:.6f} µL")
-            print(f"  Grados de Libertad (v_eff): {v_eff:.2f}")
-            print(f"  Factor de Cobertura (k): {k:.4f}")
-            print(f"  Incertidumbre Expandida (U): {incertidumbre:.6f} µL")
-
-        if not volumenes_corregidos_ul:
-            promedio_volumen = 0
+        u_c_sq = (_potencia(u_y_Mo, 2) + _potencia(u_y_Mi, 2) + _potencia(u_y_rho_A, 2) +
+                  _potencia(u_y_rho_a, 2) + _potencia(u_y_rho_B, 2) + _potencia(u_y_gamma, 2) +
+                  _potencia(u_y_tr, 2) + _potencia(u_y_Crep, 2) + u_y_Cres**2 + u_y_Crepro**2)
+        u_c_m3 = np.sqrt(u_c_sq)
+
+        # 7. Incertidumbre expandida U (Welch-Satterthwaite sólo con la repetibilidad)
+        if num_repeticiones > 1:
+            denominador_v_eff = _potencia(u_y_Crep, 4) / (num_repeticiones - 1)
+            v_eff = np.where((u_c_m3 > 0) & (u_y_Crep != 0) & (denominador_v_eff > 0),
+                             _potencia(u_c_m3, 4) / denominador_v_eff, np.inf)
         else:
-            promedio_volumen = sum(volumenes_corregidos_ul) / len(volumenes_corregidos_ul)
-            
-        error_medida = promedio_volumen - aforo_data['valor_nominal']
-        
-        # Calcular el error de medida en porcentaje
-        # Se usa el valor nominal del Aforo 3 como divisor para todos, según la fórmula del Excel.
-        error_porcentaje = 0
-        if valor_nominal_ref_porcentaje != 0:
-            error_porcentaje = abs(error_medida / valor_nominal_ref_porcentaje) * 100
+            v_eff = np.full_like(u_c_m3, np.inf)
+
+    inicio = metricas.fin_etapa('presupuesto_incertidumbre', inicio)
+
+    k = np.full_like(v_eff, 2.0)  # Usar k=2 para v_eff grandes
+    pocos_grados = v_eff < 100
+    if pocos_grados.any():
+        # Tabla precalculada al 95.45 % en lugar de scipy.stats.t.ppf por aforo
+        k[pocos_grados] = factor_cobertura(np.maximum(1, np.rint(v_eff[pocos_grados])))
+    incertidumbre = (u_c_m3 * k) * 1e9
+    metricas.fin_etapa('factor_cobertura', inicio)
+
+    promedio_volumen = _suma_secuencial(volumenes_ul) / num_repeticiones
+    error_medida = promedio_volumen - valores_nominales
+    # Se usa el valor nominal del último aforo como divisor para todos, según la fórmula del Excel.
+    if valor_nominal_ref != 0:
+        error_porcentaje = np.abs(error_medida / valor_nominal_ref) * 100
+    else:
+        error_porcentaje = np.zeros_like(error_medida)
 
-        if debug_mode:
-            print(f"\n--- CÁLCULO ERROR % CANAL {i} ---")
-            print(f"  Error de Medida (µL) [J83]: {error_medida:.6f}")
-            print(f"  Valor Nominal Canal 3 (µL) [D85]: {valor_nominal_ref_porcentaje:.2f}")
-            print(f"  Fórmula: abs({error_medida:.6f} / {valor_nominal_ref_porcentaje:.2f}) * 100")
-            print(f"  Resultado Error %: {error_porcentaje:.4f}")
-
-        resultados_por_aforo.append({
-            "valor_nominal": aforo_data['valor_nominal'],
-            "promedio_volumen_ul": promedio_volumen,
-            "error_medida_ul": error_medida,
-            "mediciones_volumen_ul": volumenes_corregidos_ul,
-            "error_medida_porcentaje": error_porcentaje,
-            "incertidumbre_expandida": incertidumbre,
-            "emt": emt_comun
-        })
-
-    condiciones_finales = {
-        "temp_liquido": sum(p['temp_agua'] for p in promedios_ambientales_aforos) / 3,
-        "temp_ambiente": sum(p['temp_amb'] for p in promedios_ambientales_aforos) / 3,
-        "presion": sum(p['presion'] for p in promedios_ambientales_aforos) / 3,
-        "humedad": sum(p['humedad'] for p in promedios_ambientales_aforos) / 3,
+    return {
+        **factores,
+        'volumenes_ul': volumenes_ul.T,
+        'promedio_volumen_ul': promedio_volumen,
+        'error_medida_ul': error_medida,
+        'error_medida_porcentaje': error_porcentaje,
+        'incertidumbre_combinada_m3': u_c_m3,
+        'v_eff': v_eff,
+        'k': k,
+        'incertidumbre_expandida': incertidumbre,
+        'presupuesto': {
+            'u_M_kg': u_M_kg, 'u_tA_C': u_tA_C, 'u_rho_A_kg_m3': u_rho_A_kg_m3,
+            'u_rho_a_kg_m3': u_rho_a_kg_m3, 'u_rho_B_kg_m3': u_rho_B_kg_m3,
+            'u_gamma_C': u_gamma_C, 'u_tr_C': u_tr_C, 'u_Crep_m3': u_Crep_m3,
+            'u_Cres_m3': u_Cres_m3, 'u_Crepro_m3': u_Crepro_m3,
+            'c_Mi': c_Mi, 'c_rho_A': c_rho_A,
+            'masa_promedio_kg': masa_aparente_prom_kg,
+        },
     }
 
-    textos = generar_textos_reporte(entradas_generales, resultados_por_aforo, especificaciones_patrones, site_config)
+def calcular_aforos_vectorizado(masas_g, ambientales, valores_nominales, constantes,
+                                div_min_valor=0, valor_nominal_ref=None):
+    """
+    Calcula N aforos con M repeticiones a partir de arreglos.
+    `masas_g` (N, M) en gramos y `ambientales` (N, K, 4) en el orden de CAMPOS_AMBIENTALES.
+    """
+    promedios_brutos = promediar_condiciones_brutas(ambientales)
+    return calcular_aforos_desde_promedios(masas_g, promedios_brutos, valores_nominales, constantes,
+                                           div_min_valor, valor_nominal_ref)
+
+def buscar_emt_comun(valores_nominales, entradas_generales, configuracion):
+    """
+    EMT común para todos los canales: se busca una sola vez con el valor nominal
+    máximo de los aforos.
+    """
+    max_valor_nominal = max(valores_nominales)
+    clase_instrumento = entradas_generales.clase_instrumento
+    indice_emt = configuracion.get('indice_emt')
+    if indice_emt is not None:
+        return indice_emt.buscar(max_valor_nominal, clase_instrumento, configuracion.get('busqueda_emt', 'exacta'))
+    return buscar_emt(max_valor_nominal, configuracion.get('emts_config', {}), clase_instrumento)
+
+def leer_opciones_montecarlo(entradas_generales):
+    """
+    Opciones de la propagación por Monte Carlo de unas entradas generales validadas
+    (modelo.EntradasGenerales), con la semilla ya elegida. Devuelve None si no se pidió.
+    """
+    if entradas_generales.montecarlo is None:
+        return None
+    opciones_montecarlo = dict(entradas_generales.montecarlo)
+    # Una sola semilla para todos los grupos, para poder reproducir el cálculo completo
+    if opciones_montecarlo['semilla'] is None:
+        opciones_montecarlo['semilla'] = secrets.randbits(53)
+    return opciones_montecarlo
+
+def resultado_reproducible(data):
+    """
+    True si un payload ya validado da siempre el mismo resultado con la misma
+    configuración: Monte Carlo sin semilla da uno distinto en cada cálculo.
+    """
+    opciones = data['entradas_generales'].get('montecarlo')
+    return opciones is None or opciones is False or (isinstance(opciones, dict) and opciones.get('semilla') is not None)
 
+def fijar_semilla_montecarlo(data):
+    """
+    Si el payload pide Monte Carlo sin semilla, devuelve una copia con una semilla elegida
+    al azar; si no, el mismo payload. Con la semilla en el payload, su calculo_id
+    identifica un único resultado y el payload guardado lo reproduce. Los valores no
+    válidos se dejan como están para que los reporte la validación.
+    """
+    entradas_generales = data.get('entradas_generales')
+    opciones = entradas_generales.get('montecarlo') if isinstance(entradas_generales, dict) else None
+    if opciones is True:
+        opciones = {}
+    if not isinstance(opciones, dict) or opciones.get('semilla') is not None:
+        return data
+    montecarlo = {**opciones, 'semilla': secrets.randbits(53)}
+    return {**data, 'entradas_generales': {**entradas_generales, 'montecarlo': montecarlo}}
+
+def resultado_aforo(resultado, j, valor_nominal, emt):
+    """Resultado del aforo `j` de un cálculo vectorizado, tal como lo devuelve /calcular."""
+    salida = {
+        "valor_nominal": valor_nominal,
+        "promedio_volumen_ul": float(resultado['promedio_volumen_ul'][j]),
+        "error_medida_ul": float(resultado['error_medida_ul'][j]),
+        "mediciones_volumen_ul": resultado['volumenes_ul'][j].tolist(),
+        "error_medida_porcentaje": float(resultado['error_medida_porcentaje'][j]),
+        "incertidumbre_expandida": float(resultado['incertidumbre_expandida'][j]),
+        "emt": emt
+    }
+    if 'montecarlo' in resultado:
+        salida["montecarlo"] = _resumen_montecarlo(resultado['montecarlo'], j)
+    return salida
+
+def promediar_condiciones_finales(promedios_ambientales_aforos):
+    """Condiciones del reporte: promedio de las condiciones corregidas de los aforos."""
+    promedios_finales = _suma_secuencial(promedios_ambientales_aforos) / len(promedios_ambientales_aforos)
     return {
+        "temp_liquido": float(promedios_finales[0]),
+        "temp_ambiente": float(promedios_finales[1]),
+        "presion": float(promedios_finales[2]),
+        "humedad": float(promedios_finales[3]),
+    }
+
+# --- FUNCIÓN PRINCIPAL ---
+
+def procesar_todos_los_aforos(data, configuracion=None):
+    """
+    Función principal que orquesta todo el proceso de cálculo.
+    Valida el payload y lo convierte en arreglos (modelo.validar_peticion, que lanza
+    ErrorValidacion con todos los errores) y delega en el motor vectorizado.
+
+    `configuracion` contiene 'especificaciones_patrones', 'site_config', 'emts_config' y,
+    opcionalmente, 'indice_emt' (IndiceEMT) y 'busqueda_emt'. Sin ella se leen de `data`.
+    """
+    peticion = validar_peticion(data)
+
+    # Los arreglos 3-D requieren el mismo número de mediciones ambientales: se agrupan
+    # los aforos por ese número; lo habitual es un único grupo.
+    grupos = {}
+    for indice, ambientales in enumerate(peticion.ambientales):
+        grupos.setdefault(len(ambientales), []).append(indice)
+
+    promedios_brutos = [None] * len(peticion.ambientales)
+    for indices in grupos.values():
+        ambientales = [peticion.ambientales[i] for i in indices]
+        for i, promedio in zip(indices, promediar_condiciones_brutas(ambientales)):
+            promedios_brutos[i] = promedio
+
+    return procesar_peticion(peticion, promedios_brutos, data if configuracion is None else configuracion)
+
+def procesar_aforos_desde_promedios(data, masas_por_aforo, promedios_brutos, configuracion=None):
+    """
+    Igual que `procesar_todos_los_aforos`, pero con las condiciones ambientales ya
+    promediadas (sin corregir, en el orden de CAMPOS_AMBIENTALES): la usa la ingesta de
+    archivos, que no guarda las mediciones ambientales. De `data` sólo se leen las
+    constantes, las entradas generales y el 'valor_nominal' de cada aforo.
+    """
+    peticion = validar_peticion(data, con_mediciones=False, claves_requeridas=('constantes', 'entradas_generales'))
+    if len(masas_por_aforo) != len(peticion.valores_nominales):
+        raise ValueError(f"Se recibieron mediciones de {len(masas_por_aforo)} aforos y el cálculo declara {len(peticion.valores_nominales)}.")
+    peticion.masas = masas_por_aforo
+    return procesar_peticion(peticion, promedios_brutos, data if configuracion is None else configuracion)
+
+def procesar_peticion(peticion, promedios_brutos, configuracion):
+    """
+    Núcleo de `procesar_todos_los_aforos` para una petición ya validada
+    (modelo.PeticionCalculo) y las condiciones ambientales promedio de sus aforos.
+    """
+    constantes = peticion.constantes
+    entradas_generales = peticion.entradas_generales
+    especificaciones_patrones = configuracion.get('especificaciones_patrones', {})
+    site_config = configuracion.get('site_config', {})
+    debug_mode = entradas_generales.debug_mode
+    # Resolución del instrumento, para la incertidumbre por resolución
+    div_min_valor = entradas_generales.div_min_valor
+
+    masas_por_aforo = peticion.masas
+    valores_nominales = peticion.valores_nominales
+
+    emt_comun = buscar_emt_comun(valores_nominales, entradas_generales, configuracion)
+    opciones_montecarlo = leer_opciones_montecarlo(entradas_generales)
+
+    # Obtener el valor nominal del último aforo, que se usará como divisor para el error porcentual
+    valor_nominal_ref_porcentaje = valores_nominales[-1]
+
+    # Los arreglos 2-D requieren el mismo número de repeticiones: se agrupan los aforos
+    # por ese número; lo habitual es un único grupo.
+    grupos = {}
+    for indice, masas in enumerate(masas_por_aforo):
+        grupos.setdefault(len(masas), []).append(indice)
+
+    calculos = [None] * len(valores_nominales)
+    for indices in grupos.values():
+        resultado = calcular_aforos_desde_promedios(
+            [masas_por_aforo[i] for i in indices], [promedios_brutos[i] for i in indices],
+            [valores_nominales[i] for i in indices], constantes,
+            div_min_valor, valor_nominal_ref_porcentaje
+        )
+        if opciones_montecarlo:
+            with metricas.etapa('montecarlo'):
+                resultado['montecarlo'] = calcular_montecarlo(resultado, constantes, **opciones_montecarlo)
+        for posicion, i in enumerate(indices):
+            calculos[i] = (resultado, posicion)
+
+    resultados_por_aforo = []
+    promedios_ambientales_aforos = []
+    diagnostico = []
+    for i, (resultado, j) in enumerate(calculos, start=1):
+        promedios_ambientales_aforos.append(resultado['promedios_ambientales'][j])
+        if debug_mode:
+            diagnostico.append(_diagnostico_aforo(i, resultado, j, valor_nominal_ref_porcentaje))
+
+        resultados_por_aforo.append(resultado_aforo(resultado, j, valores_nominales[i - 1], emt_comun))
+
+    condiciones_finales = promediar_condiciones_finales(promedios_ambientales_aforos)
+
+    with metricas.etapa('textos_reporte'):
+        textos = generar_textos_reporte(entradas_generales.datos, resultados_por_aforo, especificaciones_patrones, site_config)
+
+    respuesta = {
         "aforos": resultados_por_aforo,
         "textos_reporte": textos,
         "condiciones_finales": condiciones_finales
     }
+    if debug_mode:
+        # El registro viaja en la respuesta y se escribe en el log (por la cola, sin bloquear)
+        respuesta["diagnostico"] = diagnostico
+        logger.info("Diagnóstico de incertidumbre: %s", json.dumps(diagnostico, ensure_ascii=False))
+    return respuesta
+
+def _resumen_montecarlo(montecarlo, j):
+    """Resultado de Monte Carlo de un aforo, listo para JSON, junto al resultado GUM."""
+    inferior = float(montecarlo['intervalo_inferior_ul'][j])
+    superior = float(montecarlo['intervalo_superior_ul'][j])
+    return {
+        "muestras": montecarlo['muestras'],
+        "semilla": montecarlo['semilla'],
+        "nivel_confianza": montecarlo['nivel_confianza'],
+        "promedio_volumen_ul": float(montecarlo['promedio_volumen_ul'][j]),
+        "incertidumbre_estandar_ul": float(montecarlo['incertidumbre_estandar_ul'][j]),
+        "intervalo_cobertura_ul": [inferior, superior],
+        "incertidumbre_expandida": (superior - inferior) / 2,
+        "tolerancia_ul": float(montecarlo['tolerancia_ul'][j]),
+        "validado_gum": bool(montecarlo['validado_gum'][j]),
+    }
+
+def _valor_json(valor):
+    """Convierte a float de Python; inf y nan pasan a None (JSON no los admite)."""
+    valor = float(valor)
+    return valor if math.isfinite(valor) else None
+
+def _diagnostico_aforo(i, resultado, j, valor_nominal_ref_porcentaje):
+    """
+    Registro estructurado del diagnóstico de incertidumbre de un aforo (modo depuración):
+    incertidumbres estándar u_i, valores intermedios, coeficientes de sensibilidad c_i,
+    v_eff, k, U y el cálculo del error porcentual.
+    """
+    p = resultado['presupuesto']
+    return {
+        "canal": i,
+        "incertidumbres_estandar": {
+            "u_M_kg": _valor_json(p['u_M_kg']),
+            "u_tA_C": _valor_json(p['u_tA_C']),
+            "u_rho_A_kg_m3": _valor_json(p['u_rho_A_kg_m3']),
+            "u_rho_a_kg_m3": _valor_json(p['u_rho_a_kg_m3']),
+            "u_rho_B_kg_m3": _valor_json(p['u_rho_B_kg_m3']),
+            "u_gamma_C": _valor_json(p['u_gamma_C']),
+            "u_tr_C": _valor_json(p['u_tr_C']),
+            "u_Crep_m3": _valor_json(p['u_Crep_m3'][j]),
+            "u_Cres_m3": _valor_json(p['u_Cres_m3']),
+            "u_Crepro_m3": _valor_json(p['u_Crepro_m3']),
+        },
+        "valores_intermedios": {
+            "rho_agua_kg_m3": _valor_json(resultado['rho_agua'][j]),
+            "rho_aire_kg_m3": _valor_json(resultado['rho_aire'][j]),
+            "factor_flotacion": _valor_json(resultado['flotacion'][j]),
+            "factor_dilatacion": _valor_json(resultado['dilatacion'][j]),
+        },
+        "coeficientes_sensibilidad": {
+            "c_masa_m3_kg": _valor_json(p['c_Mi'][j]),
+            "c_rho_agua_m3_por_kg_m3": _valor_json(p['c_rho_A'][j]),
+        },
+        "resultados": {
+            "incertidumbre_combinada_ul": _valor_json(resultado['incertidumbre_combinada_m3'][j] * 1e9),
+            "v_eff": _valor_json(resultado['v_eff'][j]),
+            "k": _valor_json(resultado['k'][j]),
+            "incertidumbre_expandida_ul": _valor_json(resultado['incertidumbre_expandida'][j]),
+        },
+        "error_porcentual": {
+            "error_medida_ul": _valor_json(resultado['error_medida_ul'][j]),
+            "valor_nominal_ref_ul": _valor_json(valor_nominal_ref_porcentaje),
+            "error_medida_porcentaje": _valor_json(resultado['error_medida_porcentaje'][j]),
+        },
+    }
+
+# --- PROCESAMIENTO POR LOTES ---
+
+_pool_lote = None
+_pool_lote_workers = None
+_pool_lote_lock = threading.Lock()
+
+def _procesar_item_lote(indice, payload, configuracion):
+    """
+    Procesa un elemento del lote y captura su error para no abortar el lote completo.
+    """
+    try:
+        # La configuración se comparte entre elementos sin copiarla en cada payload.
+        return {"indice": indice, "resultado": procesar_todos_los_aforos(payload, configuracion)}
+    except ErrorValidacion as e:
+        return {"indice": indice, "error": f"Datos inválidos o malformados: {e}", "errores": e.errores}
+    except (ValueError, TypeError, KeyError, ZeroDivisionError) as e:
+        return {"indice": indice, "error": f"Datos inválidos o malformados: {e}"}
+    except Exception as e:
+        return {"indice": indice, "error": f"Error interno al procesar el cálculo: {e}"}
+
+def _procesar_bloque_lote(bloque, configuracion):
+    """
+    Punto de entrada de los procesos del pool: la configuración viaja una sola vez por bloque.
+    """
+    return [_procesar_item_lote(indice, payload, configuracion) for indice, payload in bloque]
+
+def contexto_procesos():
+    """
+    Contexto de multiprocessing para los pools que se crean dentro de una petición.
+    Con fork, el hijo heredaría los locks que en ese momento tuvieran tomados otros
+    hilos (los de las peticiones, el escritor del historial) y podría bloquearse para
+    siempre; forkserver crea los procesos desde un servidor sin hilos. En Windows sólo
+    existe spawn.
+    """
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(metodo)
+
+def _obtener_pool_lote(max_workers):
+    """
+    Devuelve el pool de procesos compartido, creándolo (o recreándolo) si hace falta.
+    """
+    global _pool_lote, _pool_lote_workers
+    with _pool_lote_lock:
+        if _pool_lote is None or _pool_lote_workers != max_workers:
+            if _pool_lote is not None:
+                _pool_lote.shutdown(wait=False, cancel_futures=True)
+            _pool_lote = ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto_procesos())
+            _pool_lote_workers = max_workers
+        return _pool_lote
+
+def cerrar_pool_lote():
+    """Libera los procesos del pool de lotes (útil al apagar el servidor)."""
+    global _pool_lote, _pool_lote_workers
+    with _pool_lote_lock:
+        if _pool_lote is not None:
+            _pool_lote.shutdown(wait=True, cancel_futures=True)
+        _pool_lote = None
+        _pool_lote_workers = None
+
+def procesar_lote_iter(payloads, configuracion, max_workers=None, tamano_bloque=None):
+    """
+    Procesa una lista de cálculos repartiéndolos en un pool de procesos y genera
+    cada resultado en cuanto su bloque termina (el orden no está garantizado).
+
+    Cada elemento generado es {"indice": i, "resultado": {...}} o {"indice": i, "error": "..."}.
+    `configuracion` es la que recibe `procesar_todos_los_aforos`.
+    """
+    payloads = list(payloads)
+    if not payloads:
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    workers = min(workers, len(payloads))
+
+    # Para un solo proceso no compensa serializar los datos: se calcula en línea.
+    if workers == 1:
+        for indice, payload in enumerate(payloads):
+            yield _procesar_item_lote(indice, payload, configuracion)
+        return
+
+    # Bloques pequeños para que los resultados fluyan pronto, pero sin enviar
+    # la configuración con cada elemento.
+    if not tamano_bloque:
+        tamano_bloque = max(1, math.ceil(len(payloads) / (workers * 4)))
+    elementos = list(enumerate(payloads))
+    bloques = [elementos[i:i + tamano_bloque] for i in range(0, len(elementos), tamano_bloque)]
+
+    try:
+        pool = _obtener_pool_lote(workers)
+        futuros = {pool.submit(_procesar_bloque_lote, bloque, configuracion): bloque for bloque in bloques}
+    except BrokenProcessPool:
+        cerrar_pool_lote()
+        pool = _obtener_pool_lote(workers)
+        futuros = {pool.submit(_procesar_bloque_lote, bloque, configuracion): bloque for bloque in bloques}
+
+    try:
+        for futuro in as_completed(futuros):
+            try:
+                resultados_bloque = futuro.result()
+            except Exception as e:
+                # Un proceso caído invalida todo su bloque, pero no el resto del lote.
+                resultados_bloque = [
+                    {"indice": indice, "error": f"Error interno al procesar el cálculo: {e}"}
+                    for indice, _ in futuros[futuro]
+                ]
+            yield from resultados_bloque
+    finally:
+        # Si el cliente abandona el stream, no seguir calculando bloques pendientes.
+        for futuro in futuros:
+            futuro.cancel()
+
+def procesar_lote(payloads, configuracion, max_workers=None, tamano_bloque=None):
+    """
+    Versión no incremental de `procesar_lote_iter`: devuelve la lista ordenada por índice.
+    """
+    resultados = list(procesar_lote_iter(payloads, configuracion, max_workers, tamano_bloque))
+    resultados.sort(key=lambda item: item['indice'])
+    return resultados
@@ -0,0 +1,92 @@
+"""
+Factores de cobertura k de la distribución t de Student.
+
+El nivel de 95.45 % (k = 2 en la normal) se sirve desde una tabla precalculada para
+1 a 100 grados de libertad, de modo que el cálculo habitual no necesita scipy.
+Otros niveles se tabulan bajo demanda con scipy y se conservan en memoria.
+"""
+import threading
+import numpy as np
+
+# Probabilidad fuera del intervalo para el nivel de 95.45 % (la misma que usa el cálculo).
+ALFA_PREDETERMINADO = 0.0455
+
+# Grados de libertad cubiertos por las tablas (índice 0 sin uso).
+MAX_GRADOS_TABLA = 100
+
+# t.ppf(1 - 0.0455 / 2, df) para df = 1..100, generado con scipy.stats.t.
+_TABLA_K_9545 = np.array([
+    float('nan'),
+    13.96781148750255, 4.526550760081986, 3.306829920720108, 2.8693151696963826, 2.6486542542831177,  # 1-5
+    2.516528348121638, 2.428809082234239, 2.366419499743066, 2.3198094410224304, 2.28368161329964,  # 6-10
+    2.254866003713122, 2.231351317083423, 2.2118006973050437, 2.195291286976705, 2.1811656819040772,  # 11-15
+    2.1689429956774133, 2.1582634005973, 2.1488523236373953, 2.1404966299111416, 2.133028361890896,  # 16-20
+    2.126313380035578, 2.120243264644709, 2.1147294370825636, 2.109698822116719, 2.1050905999895573,  # 21-25
+    2.1008537418020614, 2.0969451164181194, 2.093328020084094, 2.0899710226337813, 2.086847053536651,  # 26-30
+    2.0839326715892583, 2.0812074766079105, 2.078653631930417, 2.076255474125009, 2.073999191878652,  # 31-35
+    2.0718725601729546, 2.069864718954372, 2.0679659878475833, 2.0661677102466354, 2.064462121490571,  # 36-40
+    2.0628422368927284, 2.061301756221308, 2.0598349818791735, 2.0584367485445894, 2.057102362442988,  # 41-45
+    2.0558275487462523, 2.054608405858361, 2.0534413655582053, 2.0523231581424732, 2.0512507818518815,  # 46-50
+    2.0502214759790904, 2.049232697151297, 2.0482820983587517, 2.0473675103653677, 2.0464869251916515,  # 51-55
+    2.045638481405368, 2.044820450993286, 2.0440312276192323, 2.0432693161006394, 2.0425333229585876,  # 56-60
+    2.0418219479157256, 2.0411339762329943, 2.0404682717901546, 2.0398237708272626, 2.039199476274577,  # 61-65
+    2.038594452607372, 2.038007821169809, 2.037438755918754, 2.036886479544167, 2.036350259927781,  # 66-70
+    2.0358294069061413, 2.0353232693079195, 2.0348312322387785, 2.0343527145899727, 2.0338871667494867,  # 71-75
+    2.03343406849674, 2.0329929270639293, 2.032563275348808, 2.032144670265285, 2.0317366912196024,  # 76-80
+    2.0313389387010767, 2.030951032977479, 2.0305726128861035, 2.0302033347124313, 2.02984287114908,  # 81-85
+    2.0294909103284033, 2.0291471549227436, 2.0288113213068697, 2.028483138777655, 2.028162348826474,  # 86-90
+    2.027848704460211, 2.027541969567143, 2.0272419183242536, 2.026948334642881, 2.0266610116498116,  # 91-95
+    2.0263797512012247, 2.026104363427077, 2.025834666303719, 2.025570485252746, 2.0253116527641972,  # 96-100
+])
+
+_tablas = {ALFA_PREDETERMINADO: _TABLA_K_9545}
+_tablas_lock = threading.Lock()
+
+def _alfa(nivel_confianza):
+    """Convierte un nivel de confianza (0.9545) en la probabilidad fuera del intervalo (0.0455)."""
+    if not 0 < nivel_confianza < 1:
+        raise ValueError(f"Nivel de confianza inválido: {nivel_confianza}")
+    # Redondeo para que 0.9545 produzca exactamente 0.0455 y reutilice la tabla precalculada.
+    return round(1 - nivel_confianza, 10)
+
+def _cuantil_t(alfa, grados_libertad):
+    """Recurre a scipy (importado bajo demanda) para lo que no cubren las tablas."""
+    from scipy.stats import t
+    return t.ppf(1 - alfa / 2, df=grados_libertad)
+
+def tabla_factores_k(nivel_confianza=1 - ALFA_PREDETERMINADO):
+    """
+    Devuelve la tabla de k indexada por grados de libertad para un nivel de confianza,
+    construyéndola con scipy la primera vez que se pide un nivel distinto del 95.45 %.
+    """
+    alfa = _alfa(nivel_confianza)
+    tabla = _tablas.get(alfa)
+    if tabla is None:
+        with _tablas_lock:
+            tabla = _tablas.get(alfa)
+            if tabla is None:
+                grados = np.arange(1, MAX_GRADOS_TABLA + 1, dtype=float)
+                tabla = np.concatenate(([np.nan], _cuantil_t(alfa, grados)))
+                _tablas[alfa] = tabla
+    return tabla
+
+def factor_cobertura(grados_libertad, nivel_confianza=1 - ALFA_PREDETERMINADO):
+    """
+    Factor de cobertura k para grados de libertad enteros (escalar o arreglo).
+    Los valores fuera de la tabla se calculan directamente con scipy.
+    """
+    tabla = tabla_factores_k(nivel_confianza)
+    grados = np.asarray(grados_libertad)
+    if grados.ndim == 0:
+        g = int(grados)
+        if 1 <= g <= MAX_GRADOS_TABLA:
+            return float(tabla[g])
+        return float(_cuantil_t(_alfa(nivel_confianza), g))
+
+    grados = grados.astype(int)
+    en_tabla = (grados >= 1) & (grados <= MAX_GRADOS_TABLA)
+    k = np.empty(grados.shape, dtype=float)
+    k[en_tabla] = tabla[grados[en_tabla]]
+    if not en_tabla.all():
+        k[~en_tabla] = _cuantil_t(_alfa(nivel_confianza), grados[~en_tabla])
+    return k
@@ -0,0 +1,238 @@
+"""
+Estado de la aplicación fuera de las variables del proceso: cálculos recientes,
+respuestas de /calcular y trabajos de PDF.
+
+Cada componente pide al backend un espacio con nombre (`estado.espacio(...)`), con sus
+límites y la forma de convertir sus valores a bytes, y sólo usa obtener/guardar/eliminar:
+
+- EstadoMemoria: el espacio es un LRU en la memoria del proceso, sin convertir nada.
+  Es lo que usa un solo proceso (y el servidor de desarrollo).
+- EstadoArchivos: el espacio es un directorio con un archivo por clave, compartido por
+  todas las instancias del nodo (varios workers o varios servidores detrás de un
+  balanceador). Un cálculo hecho en una instancia se puede exportar desde otra y el
+  estado de un PDF asíncrono se puede consultar en cualquiera.
+
+Con CALCULADORA_ESTADO se elige el backend: 'memoria' (predeterminado), 'archivos'
+(en instance/estado) o 'archivos:/ruta'.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+def _sin_tamano(valor):
+    return 0
+
+class _EspacioMemoria:
+    """LRU en memoria: `max_entradas` y `max_bytes` (según `tamano`) acotan el espacio."""
+
+    def __init__(self, nombre, max_entradas=None, max_bytes=None, expiracion_s=None, tamano=None):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.expiracion_s = expiracion_s
+        self._tamano = tamano or _sin_tamano
+        self._entradas = OrderedDict()  # clave -> (valor, tamaño, guardado)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._contadores = {'aciertos': 0, 'fallos': 0, 'desalojos': 0}
+
+    def _quitar(self, clave):
+        _, tamano, _ = self._entradas.pop(clave)
+        self._bytes -= tamano
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and self.expiracion_s is not None and time.time() - entrada[2] > self.expiracion_s:
+                self._quitar(clave)
+                entrada = None
+            if entrada is None:
+                self._contadores['fallos'] += 1
+                return None
+            if self.expiracion_s is None:
+                # Con expiración el orden es el de escritura: la entrada más antigua expira primero
+                self._entradas.move_to_end(clave)
+            self._contadores['aciertos'] += 1
+            return entrada[0]
+
+    def guardar(self, clave, valor):
+        tamano = self._tamano(valor)
+        if self.max_entradas == 0 or (self.max_bytes is not None and tamano > self.max_bytes):
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (valor, tamano, time.time())
+            self._bytes += tamano
+            ahora = time.time()
+            while self._entradas:
+                primera, (_, _, guardado) = next(iter(self._entradas.items()))
+                expirada = self.expiracion_s is not None and ahora - guardado > self.expiracion_s
+                excede = ((self.max_entradas is not None and len(self._entradas) > self.max_entradas)
+                          or (self.max_bytes is not None and self._bytes > self.max_bytes))
+                if not expirada and not excede:
+                    break
+                self._quitar(primera)
+                if not expirada:
+                    self._contadores['desalojos'] += 1
+
+    def eliminar(self, clave):
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._contadores, entradas=len(self._entradas), bytes=self._bytes)
+
+class EstadoMemoria:
+    """Backend en la memoria del proceso: nada se comparte con otras instancias."""
+
+    compartido = False
+
+    def espacio(self, nombre, codificar=None, decodificar=None, max_entradas=None, max_bytes=None,
+                expiracion_s=None, tamano=None):
+        # Los valores se guardan tal cual: no hace falta convertirlos a bytes
+        return _EspacioMemoria(nombre, max_entradas, max_bytes, expiracion_s, tamano)
+
+class _EspacioArchivos:
+    """
+    Un archivo por clave en `directorio`, escrito de forma atómica. La fecha de
+    modificación es la del último uso (LRU) o, con `expiracion_s`, la de escritura. Cada
+    proceso limpia el directorio cada `escrituras_por_limpieza` escrituras: borra lo
+    expirado y lo menos usado hasta cumplir `max_entradas` y `max_bytes`.
+    """
+
+    def __init__(self, nombre, directorio, codificar, decodificar, max_entradas=None, max_bytes=None,
+                 expiracion_s=None, escrituras_por_limpieza=200):
+        self.nombre = nombre
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.expiracion_s = expiracion_s
+        self.escrituras_por_limpieza = escrituras_por_limpieza
+        self._codificar = codificar
+        self._decodificar = decodificar
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self._contadores = {'aciertos': 0, 'fallos': 0, 'desalojos': 0}
+        self._ocupacion = {'entradas': 0, 'bytes': 0}
+        os.makedirs(directorio, exist_ok=True)
+        self.limpiar()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, hashlib.sha1(str(clave).encode('utf-8')).hexdigest())
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def obtener(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                modificado = os.fstat(f.fileno()).st_mtime
+                if self.expiracion_s is not None and time.time() - modificado > self.expiracion_s:
+                    contenido = None
+                else:
+                    contenido = f.read()
+            if contenido is not None and self.expiracion_s is None:
+                os.utime(ruta)
+        except OSError:
+            contenido = None
+        if contenido is None:
+            self._contar('fallos')
+            return None
+        self._contar('aciertos')
+        return self._decodificar(contenido)
+
+    def guardar(self, clave, valor):
+        contenido = self._codificar(valor)
+        if self.max_entradas == 0 or (self.max_bytes is not None and len(contenido) > self.max_bytes):
+            return
+        ruta = self._ruta(clave)
+        # El temporal lleva el proceso y el hilo: dos escrituras de la misma clave no se pisan
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._escrituras += 1
+            limpiar = self._escrituras % self.escrituras_por_limpieza == 0
+        if limpiar:
+            self.limpiar()
+
+    def eliminar(self, clave):
+        try:
+            os.remove(self._ruta(clave))
+        except OSError:
+            pass
+
+    def limpiar(self):
+        """Borra lo expirado y lo menos usado que exceda los límites del espacio."""
+        archivos = []
+        ahora = time.time()
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                if entrada.name.endswith('.tmp'):
+                    # Un temporal viejo es de un proceso que murió a mitad de una escritura
+                    if ahora - info.st_mtime > 3600:
+                        archivos.append((0, entrada.path, 0))
+                    continue
+                if self.expiracion_s is not None and ahora - info.st_mtime > self.expiracion_s:
+                    archivos.append((0, entrada.path, 0))
+                    continue
+                archivos.append((info.st_mtime, entrada.path, info.st_size))
+        archivos.sort()
+        entradas = sum(1 for modificado, _, _ in archivos if modificado)
+        total = sum(tamano for _, _, tamano in archivos)
+        desalojos = 0
+        for modificado, ruta, tamano in archivos:
+            excede = ((self.max_entradas is not None and entradas > self.max_entradas)
+                      or (self.max_bytes is not None and total > self.max_bytes))
+            if modificado and not excede:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+            if modificado:
+                entradas -= 1
+                total -= tamano
+                desalojos += 1
+        with self._lock:
+            self._contadores['desalojos'] += desalojos
+            self._ocupacion = {'entradas': entradas, 'bytes': total}
+
+    def estadisticas(self):
+        """Contadores de este proceso; la ocupación es la de la última limpieza."""
+        with self._lock:
+            return dict(self._contadores, **self._ocupacion)
+
+class EstadoArchivos:
+    """Backend en archivos bajo `directorio`, compartido por los procesos del nodo."""
+
+    compartido = True
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def espacio(self, nombre, codificar, decodificar, max_entradas=None, max_bytes=None,
+                expiracion_s=None, tamano=None):
+        return _EspacioArchivos(nombre, os.path.join(self.directorio, nombre), codificar, decodificar,
+                                max_entradas, max_bytes, expiracion_s)
+
+def crear_estado(especificacion, directorio_predeterminado):
+    """Backend según CALCULADORA_ESTADO: 'memoria', 'archivos' o 'archivos:/ruta'."""
+    tipo, _, ruta = especificacion.partition(':')
+    if tipo == 'memoria':
+        return EstadoMemoria()
+    if tipo == 'archivos':
+        return EstadoArchivos(ruta or directorio_predeterminado)
+    raise ValueError(f"CALCULADORA_ESTADO debe ser 'memoria', 'archivos' o 'archivos:/ruta': {especificacion!r}")
@@ -0,0 +1,172 @@
+"""
+Recursos estáticos con huella y precomprimidos.
+
+`python estaticos.py` (después de compilar el CSS de Tailwind) copia los recursos de
+static/ (JS, CSS, imágenes) a static/dist/ con el hash del contenido en el nombre
+(js/main.js -> js/main.1a2b3c4d5e.js), genera sus versiones .gz y .br con la
+compresión máxima y escribe manifest.json con la correspondencia. La aplicación sirve
+esos archivos en /assets/ con caché de un año (el nombre cambia si cambia el contenido)
+y elige la versión comprimida según Accept-Encoding sin comprimir nada al vuelo; las
+plantillas obtienen las URL con asset_url('js/main.js').
+
+La construcción conserva los archivos de la construcción anterior, para que una
+página que se cargó antes de desplegar siga encontrando sus recursos.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIRECTORIO_ESTATICOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+NOMBRE_DIST = 'dist'
+NOMBRE_MANIFIESTO = 'manifest.json'
+
+# Directorios de static/ que no son recursos del navegador, y fuentes que se compilan
+EXCLUIDOS = ('config', NOMBRE_DIST)
+FUENTES = frozenset({'css/input.css'})
+
+# Una versión comprimida se guarda sólo si ahorra al menos esta fracción (PNG, fuentes... no)
+AHORRO_MINIMO = 0.1
+
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+
+def _huella(contenido):
+    return hashlib.sha256(contenido).hexdigest()[:10]
+
+def _recursos(directorio):
+    """Rutas relativas (con '/') de los recursos de `directorio` que se publican."""
+    for raiz, subdirectorios, archivos in os.walk(directorio):
+        relativa = os.path.relpath(raiz, directorio)
+        if relativa == '.':
+            subdirectorios[:] = [d for d in subdirectorios if d not in EXCLUIDOS]
+        subdirectorios.sort()
+        for archivo in sorted(archivos):
+            ruta = os.path.normpath(os.path.join(relativa, archivo)).replace(os.sep, '/')
+            if ruta not in FUENTES and not archivo.startswith('.'):
+                yield ruta
+
+def _escribir(ruta, contenido):
+    """Escribe de forma atómica: un worker nunca sirve un archivo a medio escribir."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.tmp{os.getpid()}"
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+def leer_manifiesto(destino):
+    try:
+        with open(os.path.join(destino, NOMBRE_MANIFIESTO), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def construir(directorio=DIRECTORIO_ESTATICOS, destino=None):
+    """
+    Genera static/dist y su manifiesto ({ruta: ruta con huella}). Devuelve una lista
+    de (ruta con huella, bytes, bytes gzip o None, bytes brotli o None).
+    """
+    destino = destino or os.path.join(directorio, NOMBRE_DIST)
+    anterior = leer_manifiesto(destino)
+    manifiesto = {}
+    resumen = []
+    for ruta in _recursos(directorio):
+        with open(os.path.join(directorio, ruta), 'rb') as f:
+            contenido = f.read()
+        base, extension = os.path.splitext(ruta)
+        nombre = f"{base}.{_huella(contenido)}{extension}"
+        manifiesto[ruta] = nombre
+        salida = os.path.join(destino, nombre)
+        tamanos = []
+        for sufijo, comprimir in (('.gz', lambda c: gzip.compress(c, compresslevel=9, mtime=0)),
+                                  ('.br', lambda c: brotli.compress(c, quality=11) if brotli else None)):
+            comprimido = comprimir(contenido)
+            if comprimido is not None and len(comprimido) <= len(contenido) * (1 - AHORRO_MINIMO):
+                if not os.path.exists(salida + sufijo):
+                    _escribir(salida + sufijo, comprimido)
+                tamanos.append(len(comprimido))
+            else:
+                tamanos.append(None)
+        if not os.path.exists(salida):
+            _escribir(salida, contenido)
+        resumen.append((nombre, len(contenido), *tamanos))
+
+    # El manifiesto se escribe al final: hasta entonces se siguen sirviendo los nombres anteriores
+    _escribir(os.path.join(destino, NOMBRE_MANIFIESTO),
+              json.dumps(manifiesto, indent=2, sort_keys=True).encode('utf-8'))
+
+    # Se borra lo que no pertenece ni a esta construcción ni a la anterior
+    vigentes = {NOMBRE_MANIFIESTO}
+    for nombre in (*manifiesto.values(), *anterior.values()):
+        vigentes.update((nombre, nombre + '.gz', nombre + '.br'))
+    for ruta in list(_recursos(destino)):
+        if ruta not in vigentes:
+            os.remove(os.path.join(destino, ruta))
+    return resumen
+
+def elegir_variante(destino, nombre, accept_encodings):
+    """
+    (archivo a enviar, Content-Encoding o None) para el recurso `nombre` de `destino`:
+    la versión brotli o gzip si el cliente la acepta y se generó.
+    """
+    for codificacion, sufijo in (('br', '.br'), ('gzip', '.gz')):
+        if accept_encodings[codificacion] > 0 and os.path.isfile(os.path.join(destino, nombre + sufijo)):
+            return nombre + sufijo, codificacion
+    return nombre, None
+
+class ManifiestoEstaticos:
+    """
+    Manifiesto de static/dist, que se vuelve a leer cuando cambia el archivo: una
+    construcción nueva se publica sin reiniciar el servidor.
+    """
+
+    def __init__(self, destino):
+        self.destino = destino
+        self._ruta = os.path.join(destino, NOMBRE_MANIFIESTO)
+        self._firma = None
+        self._rutas = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, ruta):
+        """Ruta con huella de `ruta` (relativa a static/), o None si no se construyó."""
+        try:
+            estado = os.stat(self._ruta)
+            firma = (estado.st_mtime_ns, estado.st_size)
+        except OSError:
+            firma = None
+        if firma != self._firma:
+            with self._lock:
+                self._rutas = leer_manifiesto(self.destino) if firma else {}
+                self._firma = firma
+        return self._rutas.get(ruta)
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los recursos estáticos con huella y precomprimidos.")
+    parser.add_argument('--static', default=DIRECTORIO_ESTATICOS, help="Directorio static de la aplicación")
+    parser.add_argument('--limpiar', action='store_true', help="Borrar static/dist antes de construir")
+    args = parser.parse_args()
+
+    destino = os.path.join(args.static, NOMBRE_DIST)
+    if args.limpiar and os.path.isdir(destino):
+        shutil.rmtree(destino)
+    if brotli is None:
+        print("Aviso: sin el paquete brotli no se generan las versiones .br", file=sys.stderr)
+
+    def formato(tamano):
+        return f"{tamano:>9}" if tamano is not None else f"{'-':>9}"
+
+    print(f"{'recurso':<40} {'bytes':>9} {'gzip':>9} {'brotli':>9}")
+    for nombre, tamano, tamano_gzip, tamano_brotli in construir(args.static, destino):
+        print(f"{nombre:<40} {tamano:>9} {formato(tamano_gzip)} {formato(tamano_brotli)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Historial persistente de calibraciones en SQLite: entradas, resultados y PDF emitidos,
+para poder consultar y volver a emitir un certificado sin capturar otra vez las lecturas.
+
+Las escrituras no bloquean la petición: se encolan y un hilo las guarda en lotes,
+una transacción por lote con lo que se haya acumulado mientras se escribía el anterior.
+El JSON de entradas y resultados se guarda comprimido (zlib) al final de la fila, así
+que los listados sólo leen las columnas indexadas. Los listados van por fecha de
+calibración descendente y cada índice termina en (fecha, id), así que el índice del
+filtro ya da el orden y no hay que ordenar las filas que cumplen. Se paginan por cursor
+(fecha e id de la última fila) en lugar de OFFSET: la página mil cuesta lo mismo que la
+primera.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime
+
+logger = logging.getLogger('calculadora.historial')
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS calculos (
+    id INTEGER PRIMARY KEY,
+    calculo_id TEXT NOT NULL UNIQUE,
+    fecha TEXT NOT NULL,
+    registrado TEXT NOT NULL,
+    serie_instrumento TEXT,
+    id_instrumento TEXT,
+    patron_seleccionado TEXT,
+    cliente TEXT,
+    descripcion_instrumento TEXT,
+    entrada BLOB NOT NULL,
+    resultados BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calculos_fecha ON calculos (fecha, id);
+CREATE INDEX IF NOT EXISTS calculos_serie ON calculos (serie_instrumento, fecha, id);
+CREATE INDEX IF NOT EXISTS calculos_id_instrumento ON calculos (id_instrumento, fecha, id);
+CREATE INDEX IF NOT EXISTS calculos_patron ON calculos (patron_seleccionado, fecha, id);
+CREATE INDEX IF NOT EXISTS calculos_cliente ON calculos (cliente, fecha, id);
+CREATE TABLE IF NOT EXISTS reportes (
+    calculo_id TEXT NOT NULL,
+    report_type TEXT NOT NULL,
+    registrado TEXT NOT NULL,
+    pdf BLOB NOT NULL,
+    PRIMARY KEY (calculo_id, report_type)
+);
+"""
+
+# Filtros de `buscar` -> columna indexada
+FILTROS = {
+    'serie': 'serie_instrumento',
+    'id_instrumento': 'id_instrumento',
+    'patron': 'patron_seleccionado',
+    'cliente': 'cliente',
+}
+
+COLUMNAS_RESUMEN = ('id', 'calculo_id', 'fecha', 'registrado', 'serie_instrumento', 'id_instrumento',
+                    'patron_seleccionado', 'cliente', 'descripcion_instrumento')
+
+MAX_LIMITE = 200
+
+_PATRON_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_PATRON_CURSOR = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d+)$')
+
+def _comprimir(valor):
+    return zlib.compress(json.dumps(valor, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 1)
+
+def _descomprimir(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def _texto(valor):
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    return texto or None
+
+def validar_fecha(valor):
+    """Fecha 'AAAA-MM-DD' válida, o ValueError."""
+    if not isinstance(valor, str) or not _PATRON_FECHA.match(valor):
+        raise ValueError(f"Fecha inválida (se espera AAAA-MM-DD): {valor!r}")
+    date.fromisoformat(valor)
+    return valor
+
+class HistorialCalculos:
+    """
+    Almacén de calibraciones en el archivo SQLite `ruta`. Cada hilo lee con su propia
+    conexión; sólo el hilo escritor escribe, con hasta `tamano_lote` registros por
+    transacción. Varios procesos pueden compartir el archivo (modo WAL).
+    """
+
+    def __init__(self, ruta, tamano_lote=500):
+        self.ruta = ruta
+        self.tamano_lote = tamano_lote
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+        conexion = self._conectar()
+        try:
+            conexion.executescript(ESQUEMA)
+        finally:
+            conexion.close()
+        self._cola = queue.SimpleQueue()
+        self._local = threading.local()
+        self._escritor = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._vacio = threading.Condition(self._lock)
+
+    def _conectar(self):
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute('PRAGMA synchronous=NORMAL')
+        return conexion
+
+    def _lectura(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = self._local.conexion = self._conectar()
+        return conexion
+
+    # --- Escritura ---
+
+    def _encolar(self, operacion):
+        with self._lock:
+            self._pendientes += 1
+            # El hilo se crea con la primera escritura: no existe en el proceso principal
+            # de un servidor que precarga la aplicación antes de crear los workers.
+            if self._escritor is None or not self._escritor.is_alive():
+                self._escritor = threading.Thread(target=self._escribir_lotes, name='historial', daemon=True)
+                self._escritor.start()
+        self._cola.put(operacion)
+
+    def registrar(self, calculo_id, entrada, resultados):
+        """Encola el guardado de un cálculo; el mismo calculo_id se guarda una sola vez."""
+        self._encolar(('calculo', calculo_id, entrada, resultados, datetime.now().isoformat(timespec='seconds')))
+
+    def registrar_pdf(self, calculo_id, report_type, pdf):
+        """Encola el guardado del PDF emitido para un cálculo (reemplaza el anterior del mismo tipo)."""
+        self._encolar(('pdf', calculo_id, report_type, pdf, datetime.now().isoformat(timespec='seconds')))
+
+    def pendientes(self):
+        """Escrituras encoladas que aún no se guardan."""
+        with self._lock:
+            return self._pendientes
+
+    def vaciar(self, timeout=None):
+        """Espera a que se guarden las escrituras encoladas. Devuelve False si se agotó el tiempo."""
+        with self._vacio:
+            return self._vacio.wait_for(lambda: self._pendientes == 0, timeout)
+
+    def _escribir_lotes(self):
+        conexion = self._conectar()
+        while True:
+            lote = [self._cola.get()]
+            while len(lote) < self.tamano_lote:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._escribir(conexion, lote)
+            except Exception as e:
+                logger.error("No se pudieron guardar %d registros del historial: %s", len(lote), e, exc_info=True)
+            with self._vacio:
+                self._pendientes -= len(lote)
+                self._vacio.notify_all()
+
+    def _escribir(self, conexion, lote):
+        calculos = []
+        reportes = []
+        for operacion in lote:
+            if operacion[0] == 'calculo':
+                _, calculo_id, entrada, resultados, registrado = operacion
+                entradas_generales = entrada.get('entradas_generales', {}) if isinstance(entrada, dict) else {}
+                fecha = entradas_generales.get('fecha_calibracion')
+                try:
+                    fecha = validar_fecha(fecha)
+                except ValueError:
+                    fecha = registrado[:10]
+                calculos.append((
+                    calculo_id, fecha, registrado,
+                    _texto(entradas_generales.get('serie_instrumento')),
+                    _texto(entradas_generales.get('id_instrumento')),
+                    _texto(entradas_generales.get('patron_seleccionado')),
+                    _texto(entradas_generales.get('nombre_cliente') or entradas_generales.get('cliente')),
+                    _texto(entradas_generales.get('descripcion_instrumento')),
+                    _comprimir(entrada), _comprimir(resultados),
+                ))
+            else:
+                _, calculo_id, report_type, pdf, registrado = operacion
+                reportes.append((calculo_id, report_type, registrado, pdf))
+        with conexion:
+            if calculos:
+                conexion.executemany(
+                    "INSERT INTO calculos (calculo_id, fecha, registrado, serie_instrumento, id_instrumento, "
+                    "patron_seleccionado, cliente, descripcion_instrumento, entrada, resultados) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (calculo_id) DO NOTHING",
+                    calculos,
+                )
+            if reportes:
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO reportes (calculo_id, report_type, registrado, pdf) VALUES (?, ?, ?, ?)",
+                    reportes,
+                )
+
+    # --- Consulta ---
+
+    def buscar(self, limite=50, cursor=None, desde=None, hasta=None, **filtros):
+        """
+        Resúmenes de los cálculos que cumplen los filtros (igualdad en 'serie',
+        'id_instrumento', 'patron' y 'cliente'; fechas de calibración entre `desde` y
+        `hasta`, inclusive), de la fecha de calibración más reciente a la más antigua.
+        Devuelve (resúmenes, cursor de la página siguiente o None).
+        """
+        condiciones = []
+        parametros = []
+        for filtro, valor in filtros.items():
+            if filtro not in FILTROS:
+                raise ValueError(f"Filtro desconocido: {filtro}")
+            if valor is not None:
+                condiciones.append(f"{FILTROS[filtro]} = ?")
+                parametros.append(valor)
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            parametros.append(validar_fecha(desde))
+        if hasta is not None:
+            condiciones.append("fecha <= ?")
+            parametros.append(validar_fecha(hasta))
+        if cursor is not None:
+            coincidencia = _PATRON_CURSOR.match(str(cursor))
+            if not coincidencia:
+                raise ValueError(f"Cursor inválido: {cursor!r}")
+            condiciones.append("(fecha, id) < (?, ?)")
+            parametros.extend([coincidencia.group(1), int(coincidencia.group(2))])
+        limite = max(1, min(int(limite), MAX_LIMITE))
+
+        consulta = f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM calculos"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        # Una fila de más indica si hay otra página
+        consulta += " ORDER BY fecha DESC, id DESC LIMIT ?"
+        filas = self._lectura().execute(consulta, parametros + [limite + 1]).fetchall()
+
+        resumenes = [dict(zip(COLUMNAS_RESUMEN, fila)) for fila in filas[:limite]]
+        siguiente = f"{resumenes[-1]['fecha']}_{resumenes[-1]['id']}" if len(filas) > limite else None
+        return resumenes, siguiente
+
+    def obtener(self, calculo_id):
+        """Cálculo completo (resumen, entrada, resultados y reportes guardados) o None."""
+        conexion = self._lectura()
+        fila = conexion.execute(
+            f"SELECT {', '.join(COLUMNAS_RESUMEN)}, entrada, resultados FROM calculos WHERE calculo_id = ?",
+            (calculo_id,),
+        ).fetchone()
+        if fila is None:
+            return None
+        calculo = dict(zip(COLUMNAS_RESUMEN, fila))
+        calculo['entrada'] = _descomprimir(fila[-2])
+        calculo['resultados'] = _descomprimir(fila[-1])
+        calculo['reportes'] = [
+            {'report_type': report_type, 'registrado': registrado}
+            for report_type, registrado in conexion.execute(
+                "SELECT report_type, registrado FROM reportes WHERE calculo_id = ? ORDER BY report_type",
+                (calculo_id,),
+            )
+        ]
+        return calculo
+
+    def obtener_pdf(self, calculo_id, report_type):
+        fila = self._lectura().execute(
+            "SELECT pdf FROM reportes WHERE calculo_id = ? AND report_type = ?", (calculo_id, report_type)
+        ).fetchone()
+        return fila[0] if fila else None
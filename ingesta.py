@@ -0,0 +1,315 @@
+"""
+Ingesta de las exportaciones de balanzas y registradores de datos (CSV o NDJSON).
+
+Los archivos se leen fila a fila sin cargarlos completos: de cada aforo se guardan
+las masas (una por repetición, pocas) y de las condiciones ambientales sólo sumas y
+acumuladores de Welford, así que un registrador con miles de muestras cuesta lo mismo
+en memoria que uno con diez. Al terminar, el motor recibe los promedios ya calculados
+(`calculadora.procesar_aforos_desde_promedios`).
+
+Columnas reconocidas (sin distinguir mayúsculas): 'aforo' (1, 2, ...), 'masa' (g) y
+las de CAMPOS_AMBIENTALES. Una fila puede traer una masa, una muestra ambiental
+completa o ambas; las demás columnas (fecha, hora, ...) se ignoran. Si el archivo
+corresponde a un solo aforo, la columna 'aforo' puede omitirse.
+"""
+import csv
+import io
+import itertools
+import json
+import math
+from array import array
+
+import numpy as np
+
+from modelo import CAMPOS_AMBIENTALES
+
+FORMATOS = ('csv', 'ndjson')
+
+CAMPO_AFORO = 'aforo'
+CAMPO_MASA = 'masa'
+
+# Separadores de CSV que se prueban en la primera línea, por orden de preferencia
+SEPARADORES_CSV = (';', '\t', ',')
+
+# Muestras ambientales que se juntan antes de sumarlas a las estadísticas con numpy
+TAMANO_BLOQUE = 4096
+
+class ErrorIngesta(ValueError):
+    """Archivo con una fila o un valor que no se puede interpretar."""
+
+    def __init__(self, mensaje, archivo=None, linea=None):
+        self.mensaje = mensaje
+        ubicacion = ', '.join(parte for parte in (archivo, f"línea {linea}" if linea else None) if parte)
+        super().__init__(f"{ubicacion}: {mensaje}" if ubicacion else mensaje)
+        self.archivo = archivo
+        self.linea = linea
+
+class EstadisticaEnLinea:
+    """
+    Media y desviación estándar por columnas, agregando bloques de muestras: la media
+    y la suma de cuadrados de cada bloque se combinan con las acumuladas (Welford, en
+    la forma por bloques de Chan et al.), sin restar cuadrados grandes.
+
+    La media que se entrega al motor es la suma dividida entre n, sumada en el orden
+    de llegada como en `promediar_condiciones_brutas` (np.cumsum suma en orden), para
+    obtener los mismos números que el formulario con las mismas mediciones.
+    """
+    __slots__ = ('n', 'suma', 'media', 'm2')
+
+    def __init__(self, dimension):
+        self.n = 0
+        self.suma = np.zeros(dimension)
+        self.media = np.zeros(dimension)
+        self.m2 = np.zeros(dimension)
+
+    def agregar_bloque(self, bloque):
+        bloque = np.asarray(bloque, dtype=float)
+        n_bloque = len(bloque)
+        if not n_bloque:
+            return
+        media_bloque = bloque.mean(axis=0)
+        m2_bloque = ((bloque - media_bloque)**2).sum(axis=0)
+        total = self.n + n_bloque
+        delta = media_bloque - self.media
+        self.media += delta * (n_bloque / total)
+        self.m2 += m2_bloque + delta**2 * (self.n * n_bloque / total)
+        self.suma = np.cumsum(np.vstack([self.suma, bloque]), axis=0)[-1]
+        self.n = total
+
+    def promedios(self):
+        return (self.suma / self.n).tolist()
+
+    def desviaciones(self):
+        if self.n < 2:
+            return [0.0] * len(self.m2)
+        return np.sqrt(self.m2 / (self.n - 1)).tolist()
+
+class AcumuladorAforo:
+    """Masas y estadísticas ambientales de un aforo."""
+    __slots__ = ('masas', 'ambiental', '_pendientes')
+
+    def __init__(self):
+        self.masas = array('d')
+        self.ambiental = EstadisticaEnLinea(len(CAMPOS_AMBIENTALES))
+        self._pendientes = []
+
+    def agregar_ambiental(self, valores):
+        self._pendientes.append(valores)
+        if len(self._pendientes) >= TAMANO_BLOQUE:
+            self.vaciar()
+
+    def vaciar(self):
+        self.ambiental.agregar_bloque(self._pendientes)
+        self._pendientes = []
+
+    def resumen(self):
+        self.vaciar()
+        resumen = {
+            'mediciones_masa': len(self.masas),
+            'mediciones_ambientales': self.ambiental.n,
+        }
+        if self.masas:
+            resumen['masa_promedio_g'] = float(np.mean(self.masas))
+            resumen['masa_desviacion_g'] = float(np.std(self.masas, ddof=1)) if len(self.masas) > 1 else 0.0
+        if self.ambiental.n:
+            resumen['promedios_ambientales'] = dict(zip(CAMPOS_AMBIENTALES, self.ambiental.promedios()))
+            resumen['desviaciones_ambientales'] = dict(zip(CAMPOS_AMBIENTALES, self.ambiental.desviaciones()))
+        return resumen
+
+def detectar_formato(nombre_archivo, tipo_contenido=None):
+    """'csv' o 'ndjson' según la extensión o el tipo MIME; None si no se reconoce."""
+    nombre = (nombre_archivo or '').lower()
+    tipo = (tipo_contenido or '').lower()
+    if nombre.endswith(('.ndjson', '.jsonl')) or 'ndjson' in tipo or 'jsonl' in tipo:
+        return 'ndjson'
+    if nombre.endswith(('.csv', '.txt', '.tsv')) or 'csv' in tipo or tipo.startswith('text/plain'):
+        return 'csv'
+    return None
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, str) and not valor.strip())
+
+def _numero(valor, coma_decimal=False):
+    if isinstance(valor, str):
+        texto = valor.replace(',', '.') if coma_decimal else valor
+    elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        texto = valor
+    else:
+        raise ValueError(f"valor numérico inválido: {valor!r}")
+    try:
+        numero = float(texto)
+    except (ValueError, OverflowError):
+        raise ValueError(f"valor numérico inválido: {valor!r}") from None
+    if not math.isfinite(numero):
+        raise ValueError(f"valor no finito: {valor}")
+    return numero
+
+def _muestra_completa(valores, coma_decimal):
+    """Los valores convertidos, o None si alguno falta o no es válido (se revisa uno a uno)."""
+    try:
+        if coma_decimal:
+            numeros = [float(valor.replace(',', '.')) for valor in valores]
+        else:
+            numeros = [float(valor) for valor in valores]
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return numeros if all(map(math.isfinite, numeros)) else None
+
+def _filas_csv(texto):
+    """
+    Genera (línea, aforo, masa, ambientales, coma_decimal) de un CSV con encabezado;
+    los valores son los textos de las celdas (None si el archivo no tiene la columna).
+    """
+    primera = texto.readline()
+    if not primera.strip():
+        return
+    separador = max(SEPARADORES_CSV, key=primera.count)
+    if primera.count(separador) == 0:
+        separador = ','
+    # Con ';' o tabulador como separador, las balanzas suelen exportar con coma decimal
+    coma_decimal = separador != ','
+    lector = csv.reader(itertools.chain([primera], texto), delimiter=separador)
+    encabezado = [columna.strip().lower() for columna in next(lector)]
+    posicion = {columna: i for i, columna in reversed(list(enumerate(encabezado)))}
+
+    faltantes = [campo for campo in CAMPOS_AMBIENTALES if campo not in posicion]
+    if len(faltantes) not in (0, len(CAMPOS_AMBIENTALES)):
+        raise ErrorIngesta(f"faltan las columnas ambientales: {', '.join(faltantes)}", linea=1)
+    if CAMPO_MASA not in posicion and faltantes:
+        raise ErrorIngesta("el encabezado no tiene la columna 'masa' ni las columnas ambientales", linea=1)
+    i_aforo = posicion.get(CAMPO_AFORO)
+    i_masa = posicion.get(CAMPO_MASA)
+    i_ambientales = None if faltantes else [posicion[campo] for campo in CAMPOS_AMBIENTALES]
+    ancho = len(encabezado)
+
+    for linea, fila in enumerate(lector, start=2):
+        if len(fila) < ancho:
+            if not any(celda.strip() for celda in fila):
+                continue
+            raise ErrorIngesta(f"la fila tiene {len(fila)} columnas y el encabezado {ancho}", linea=linea)
+        yield (
+            linea,
+            fila[i_aforo] if i_aforo is not None else None,
+            fila[i_masa] if i_masa is not None else None,
+            [fila[i] for i in i_ambientales] if i_ambientales is not None else None,
+            coma_decimal,
+        )
+
+def _filas_ndjson(texto):
+    """Genera (línea, aforo, masa, ambientales, False) de un archivo con un objeto JSON por línea."""
+    for linea, contenido in enumerate(texto, start=1):
+        if not contenido.strip():
+            continue
+        try:
+            objeto = json.loads(contenido)
+        except json.JSONDecodeError as e:
+            raise ErrorIngesta(f"JSON inválido: {e.msg}", linea=linea) from None
+        if not isinstance(objeto, dict):
+            raise ErrorIngesta("la línea no es un objeto JSON", linea=linea)
+        objeto = {str(clave).strip().lower(): valor for clave, valor in objeto.items()}
+        yield (
+            linea,
+            objeto.get(CAMPO_AFORO),
+            objeto.get(CAMPO_MASA),
+            [objeto.get(campo) for campo in CAMPOS_AMBIENTALES],
+            False,
+        )
+
+class Ingesta:
+    """
+    Acumula las mediciones de uno o varios archivos para los aforos 1..`num_aforos`.
+
+        ingesta = Ingesta(3)
+        ingesta.leer(flujo_balanza, 'csv', nombre_archivo='balanza.csv')
+        ingesta.leer(flujo_registrador, 'csv', nombre_archivo='registrador.csv')
+        masas, promedios = ingesta.arreglos()
+    """
+
+    def __init__(self, num_aforos):
+        self.aforos = [AcumuladorAforo() for _ in range(num_aforos)]
+        self.filas = 0
+        # Texto de la columna 'aforo' -> número, para no convertirlo en cada fila
+        self._numeros_aforo = {}
+
+    def leer(self, flujo, formato, nombre_archivo=None, aforo=None):
+        """
+        Lee un archivo binario (p. ej. el de una carga multipart) fila a fila.
+        Con `aforo` (1, 2, ...) todas las filas sin columna 'aforo' van a ese aforo.
+        """
+        if formato not in FORMATOS:
+            raise ErrorIngesta(f"formato no soportado; use uno de: {', '.join(FORMATOS)}", nombre_archivo)
+        texto = io.TextIOWrapper(flujo, encoding='utf-8-sig', newline='')
+        filas = _filas_csv(texto) if formato == 'csv' else _filas_ndjson(texto)
+        linea = None
+        try:
+            for linea, valor_aforo, masa, ambientales, coma_decimal in filas:
+                self._agregar_fila(valor_aforo, masa, ambientales, coma_decimal, aforo)
+                self.filas += 1
+        except ErrorIngesta as e:
+            raise ErrorIngesta(e.mensaje, nombre_archivo, e.linea) from None
+        except UnicodeDecodeError:
+            raise ErrorIngesta("el archivo no está codificado en UTF-8", nombre_archivo) from None
+        except (ValueError, csv.Error) as e:
+            raise ErrorIngesta(str(e), nombre_archivo, linea) from None
+        finally:
+            # El flujo pertenece a quien lo abrió: el envoltorio no debe cerrarlo
+            texto.detach()
+        return self
+
+    def _agregar_fila(self, valor_aforo, masa, ambientales, coma_decimal, aforo):
+        if not _vacio(valor_aforo):
+            aforo = self._numeros_aforo.get(valor_aforo) if isinstance(valor_aforo, str) else None
+            if aforo is None:
+                aforo = self._numero_aforo(valor_aforo, coma_decimal)
+        if aforo is None:
+            if len(self.aforos) != 1:
+                raise ValueError("falta la columna 'aforo'")
+            aforo = 1
+        if not 1 <= aforo <= len(self.aforos):
+            raise ValueError(f"el aforo {aforo} no está en los datos del cálculo (1 a {len(self.aforos)})")
+        acumulador = self.aforos[aforo - 1]
+
+        if not _vacio(masa):
+            acumulador.masas.append(_numero(masa, coma_decimal))
+
+        if ambientales is not None:
+            # Camino rápido para la fila típica del registrador, con las cuatro celdas
+            valores = _muestra_completa(ambientales, coma_decimal)
+            if valores is not None:
+                acumulador.agregar_ambiental(valores)
+                return
+            presentes = [not _vacio(valor) for valor in ambientales]
+            if all(presentes):
+                acumulador.agregar_ambiental([_numero(valor, coma_decimal) for valor in ambientales])
+            elif any(presentes):
+                faltantes = [campo for campo, presente in zip(CAMPOS_AMBIENTALES, presentes) if not presente]
+                raise ValueError(f"muestra ambiental incompleta, falta: {', '.join(faltantes)}")
+
+    def _numero_aforo(self, valor_aforo, coma_decimal):
+        numero = _numero(valor_aforo, coma_decimal)
+        if not numero.is_integer():
+            raise ValueError(f"número de aforo inválido: {valor_aforo}")
+        if isinstance(valor_aforo, str) and len(self._numeros_aforo) < 1000:
+            self._numeros_aforo[valor_aforo] = int(numero)
+        return int(numero)
+
+    def arreglos(self):
+        """
+        Masas (lista por aforo) y promedios ambientales brutos (lista de 4 por aforo)
+        listos para `procesar_aforos_desde_promedios`.
+        """
+        for numero, acumulador in enumerate(self.aforos, start=1):
+            acumulador.vaciar()
+            if not acumulador.masas:
+                raise ErrorIngesta(f"El aforo {numero} no tiene mediciones de masa.")
+            if not acumulador.ambiental.n:
+                raise ErrorIngesta(f"El aforo {numero} no tiene mediciones ambientales.")
+        masas = [acumulador.masas.tolist() for acumulador in self.aforos]
+        promedios = [acumulador.ambiental.promedios() for acumulador in self.aforos]
+        return masas, promedios
+
+    def resumen(self):
+        return {
+            'filas': self.filas,
+            'aforos': [acumulador.resumen() for acumulador in self.aforos],
+        }
@@ -0,0 +1,209 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Los temporizadores de etapa cuestan un par de llamadas a perf_counter y un incremento
+bajo lock, así que quedan activos en producción. Las métricas son del proceso: los
+cálculos de /calcular-lote y los PDF asíncronos corren en pools de procesos y sus
+etapas internas no se suman aquí (sí la duración de las peticiones que los atienden).
+"""
+import bisect
+import threading
+import time
+
+# Límites de los histogramas en segundos: de 0.1 ms (etapas del cálculo) a 10 s (PDF)
+LIMITES_PREDETERMINADOS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                           0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatear_etiquetas(nombres, valores, extra=''):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+def _formatear_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, valores):
+        if len(valores) != len(self.etiquetas):
+            raise ValueError(f"{self.nombre} espera las etiquetas {self.etiquetas}")
+        return tuple(str(valor) for valor in valores)
+
+    def encabezado(self):
+        return [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, *valores, cantidad=1):
+        clave = self._clave(valores)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + cantidad
+
+    def exposicion(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return self.encabezado() + [
+            f'{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}'
+            for clave, valor in series
+        ]
+
+class Medidor(_Metrica):
+    """Valor instantáneo. Con `funcion`, se lee al exponer las métricas."""
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+        if not self.etiquetas:
+            self._series[()] = 0
+
+    def sumar(self, *valores, cantidad=1):
+        clave = self._clave(valores)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + cantidad
+
+    def restar(self, *valores, cantidad=1):
+        self.sumar(*valores, cantidad=-cantidad)
+
+    def exposicion(self):
+        if self.funcion is not None:
+            series = [((), self.funcion())]
+        else:
+            with self._lock:
+                series = sorted(self._series.items())
+        return self.encabezado() + [
+            f'{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}'
+            for clave, valor in series
+        ]
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_PREDETERMINADOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(sorted(limites))
+
+    def observar(self, valor, *valores):
+        clave = self._clave(valores)
+        # Conteos por intervalo (no acumulados); se acumulan al exponer
+        posicion = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exposicion(self):
+        with self._lock:
+            series = sorted((clave, (list(conteos), suma, total)) for clave, (conteos, suma, total) in self._series.items())
+        lineas = self.encabezado()
+        for clave, (conteos, suma, total) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.limites + (float('inf'),), conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, f'le="{_formatear_numero(float(limite))}"')
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {total}')
+        return lineas
+
+class Registro:
+    """Conjunto de métricas que se exponen juntas en /metrics."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            if metrica.nombre in self._metricas:
+                raise ValueError(f"La métrica {metrica.nombre} ya está registrada.")
+            self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, etiquetas=(), funcion=None):
+        return self._registrar(Medidor(nombre, ayuda, etiquetas, funcion))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_PREDETERMINADOS):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+    def exposicion(self):
+        """Texto para /metrics (formato de exposición 0.0.4)."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            lineas.extend(metrica.exposicion())
+        return '\n'.join(lineas) + '\n'
+
+REGISTRO = Registro()
+
+DURACION_ETAPA = REGISTRO.histograma(
+    'calculadora_etapa_segundos', 'Duración de cada etapa del cálculo y de la generación de reportes.', ('etapa',)
+)
+
+def fin_etapa(nombre, inicio):
+    """
+    Registra la etapa que empezó en `inicio` (perf_counter) y devuelve el instante
+    actual, para encadenar etapas consecutivas sin anidar bloques `with`.
+    """
+    ahora = time.perf_counter()
+    DURACION_ETAPA.observar(ahora - inicio, nombre)
+    return ahora
+
+class etapa:
+    """
+    Mide un bloque y lo registra en el histograma de etapas:
+
+        with metricas.etapa('factores_correccion'):
+            ...
+    """
+    __slots__ = ('nombre', '_inicio')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        DURACION_ETAPA.observar(time.perf_counter() - self._inicio, self.nombre)
+        return False
+
+# --- Métricas de la aplicación web ---
+
+PETICIONES = REGISTRO.contador(
+    'calculadora_peticiones_total', 'Peticiones atendidas por endpoint, método y código de estado.',
+    ('endpoint', 'metodo', 'estado')
+)
+DURACION_PETICION = REGISTRO.histograma(
+    'calculadora_peticion_segundos', 'Duración de las peticiones por endpoint (sin el cuerpo transmitido).', ('endpoint',)
+)
+ERRORES = REGISTRO.contador(
+    'calculadora_errores_total', 'Errores por endpoint y tipo de excepción.', ('endpoint', 'tipo')
+)
+PDF_EN_CURSO = REGISTRO.medidor(
+    'calculadora_pdf_en_curso', 'Renders de PDF síncronos en curso en este proceso.'
+)
@@ -0,0 +1,321 @@
+"""
+Modelo tipado de una petición de cálculo.
+
+El JSON de /calcular se recorre una sola vez: cada campo se valida y se convierte a
+estructuras compactas que el motor usa directamente, sin volver a buscar claves en
+diccionarios. Las constantes y las entradas generales pasan a clases con __slots__ y
+las lecturas a arreglos de numpy. La validación reúne todos los errores de la petición
+en una sola ErrorValidacion, en lugar de fallar con el primero a mitad del cálculo.
+"""
+import functools
+import itertools
+import math
+import operator
+import sys
+
+import numpy as np
+
+from montecarlo import MAX_MUESTRAS, MAX_VALORES, MUESTRAS_PREDETERMINADAS
+
+# Orden de las magnitudes ambientales en los arreglos del motor.
+CAMPOS_AMBIENTALES = ('temp_agua', 'temp_amb', 'presion', 'humedad')
+
+# Claves de corrección de las constantes del frontend, en el orden de CAMPOS_AMBIENTALES.
+CLAVES_CORRECCION = ('corr_ta_y', 'corr_tamb_y', 'corr_patm_y', 'corr_hr_y')
+
+# Constantes numéricas que usa el cálculo.
+CLAVES_CONSTANTES = ('tanaka_a1', 'tanaka_a2', 'tanaka_a3', 'tanaka_a4', 'tanaka_a5',
+                     'rho_aire_o51', 'rho_aire_o52', 'rho_aire_o53',
+                     'rho_pesa_n74', 'alpha_material_pp')
+
+# Claves mínimas que debe contener cada cálculo (petición individual o elemento de un lote).
+CLAVES_REQUERIDAS = ['constantes', 'entradas_generales', 'aforo1', 'aforo2', 'aforo3']
+
+# Entradas generales de texto que el reporte compara o transforma (deben ser cadenas)
+CAMPOS_TEXTO = ('marca_instrumento', 'modelo_instrumento', 'serie_instrumento', 'id_instrumento',
+                'tipo_calibracion', 'clase_instrumento')
+
+# type() y no isinstance(): bool es subclase de int y no es un número válido aquí
+_TIPOS_NUMERICOS = frozenset((int, float))
+
+_leer_ambientales = operator.itemgetter(*CAMPOS_AMBIENTALES)
+_leer_constantes = operator.itemgetter(*CLAVES_CONSTANTES)
+_leer_coeficientes = operator.itemgetter('a', 'b', 'c')
+
+MAX_CONSTANTES_MEMORIZADAS = 64
+
+class ErrorValidacion(ValueError):
+    """Errores de una petición, todos juntos: lista de {"campo": ..., "mensaje": ...}."""
+
+    def __init__(self, errores):
+        self.errores = errores
+        detalle = '; '.join(
+            f"{error['campo']}: {error['mensaje']}" if error['campo'] else error['mensaje'] for error in errores[:10]
+        )
+        if len(errores) > 10:
+            detalle += f"; y {len(errores) - 10} más"
+        super().__init__(detalle)
+
+def es_numero(valor):
+    """int o float finito que cabe en un float (el JSON de Python acepta NaN, Infinity y enteros enormes)."""
+    tipo = type(valor)
+    if tipo is float:
+        return math.isfinite(valor)
+    return tipo is int and -sys.float_info.max <= valor <= sys.float_info.max
+
+def _son_numeros(valores):
+    """
+    Comprobación rápida de una secuencia de valores: todos int o float y finitos (una
+    suma no finita delata NaN o infinito). Si falla, el camino lento ubica cada error.
+    """
+    try:
+        return set(map(type, valores)) <= _TIPOS_NUMERICOS and math.isfinite(sum(valores))
+    except OverflowError:
+        # Un entero que no cabe en un float
+        return False
+
+def _numero(contenedor, clave, ruta, errores, predeterminado=None):
+    """Número finito en contenedor[clave]; sin la clave devuelve `predeterminado` (o error si es None)."""
+    valor = contenedor.get(clave)
+    if valor is None:
+        if predeterminado is None:
+            errores.append({'campo': ruta, 'mensaje': "falta el valor"})
+        return predeterminado
+    if not es_numero(valor):
+        errores.append({'campo': ruta, 'mensaje': f"debe ser un número: {valor!r}"})
+        return None
+    return valor
+
+def _arreglo(valores, ruta, errores):
+    """Lista de números finitos como arreglo 1-D; los errores se reportan por índice."""
+    if not isinstance(valores, list) or not valores:
+        errores.append({'campo': ruta, 'mensaje': "debe ser una lista de números no vacía"})
+        return None
+    if not _son_numeros(valores):
+        total = len(errores)
+        for indice, valor in enumerate(valores):
+            if not es_numero(valor):
+                errores.append({'campo': f"{ruta}[{indice}]", 'mensaje': f"debe ser un número: {valor!r}"})
+        if len(errores) != total:
+            return None
+    return np.array(valores, dtype=float)
+
+def _arreglo_ambiental(mediciones, ruta, errores):
+    """Mediciones ambientales como arreglo (K, 4) en el orden de CAMPOS_AMBIENTALES."""
+    if not isinstance(mediciones, list) or not mediciones:
+        errores.append({'campo': ruta, 'mensaje': "debe ser una lista de mediciones no vacía"})
+        return None
+    try:
+        filas = [_leer_ambientales(medicion) for medicion in mediciones]
+    except (KeyError, TypeError):
+        filas = None
+    valores = None if filas is None else list(itertools.chain.from_iterable(filas))
+    if valores is None or not _son_numeros(valores):
+        total = len(errores)
+        for indice, medicion in enumerate(mediciones):
+            if not isinstance(medicion, dict):
+                errores.append({'campo': f"{ruta}[{indice}]", 'mensaje': "debe ser un objeto"})
+                continue
+            for campo in CAMPOS_AMBIENTALES:
+                _numero(medicion, campo, f"{ruta}[{indice}].{campo}", errores)
+        if len(errores) != total:
+            return None
+    # Convertir la lista plana es más rápido que la anidada
+    return np.array(valores, dtype=float).reshape(len(filas), len(CAMPOS_AMBIENTALES))
+
+class Constantes:
+    """
+    Constantes del cálculo. Las de corrección son tuplas (a, b, c) y además se guardan
+    como arreglos de 4 elementos en `coeficientes_correccion`. Dos instancias con los
+    mismos valores son iguales y tienen el mismo hash: sirven de clave de memorización.
+    """
+    __slots__ = CLAVES_CONSTANTES + CLAVES_CORRECCION + ('coeficientes_correccion', '_clave')
+
+    def __init__(self, **valores):
+        for clave in CLAVES_CONSTANTES:
+            setattr(self, clave, valores[clave])
+        for clave in CLAVES_CORRECCION:
+            setattr(self, clave, tuple(valores[clave]))
+        coeficientes = []
+        for k in range(3):
+            arreglo = np.array([getattr(self, clave)[k] for clave in CLAVES_CORRECCION])
+            arreglo.flags.writeable = False
+            coeficientes.append(arreglo)
+        self.coeficientes_correccion = tuple(coeficientes)
+        self._clave = tuple(getattr(self, clave) for clave in CLAVES_CONSTANTES + CLAVES_CORRECCION)
+
+    def __eq__(self, otra):
+        return isinstance(otra, Constantes) and self._clave == otra._clave
+
+    def __hash__(self):
+        return hash(self._clave)
+
+    @classmethod
+    def desde_json(cls, datos, errores, ruta='constantes'):
+        """
+        Constantes de un payload, o None si alguna falta o no es válida (los errores se
+        agregan). Casi todas las peticiones traen las mismas constantes: se memorizan
+        por valor y no se vuelven a construir.
+        """
+        if not isinstance(datos, dict):
+            errores.append({'campo': ruta, 'mensaje': "debe ser un objeto"})
+            return None
+        try:
+            escalares = _leer_constantes(datos)
+            correcciones = tuple(_leer_coeficientes(datos[clave]) for clave in CLAVES_CORRECCION)
+        except (KeyError, TypeError):
+            escalares = None
+        if escalares is not None and _son_numeros(escalares + sum(correcciones, ())):
+            return _constantes_memorizadas(escalares, correcciones)
+
+        total = len(errores)
+        valores = {clave: _numero(datos, clave, f"{ruta}.{clave}", errores) for clave in CLAVES_CONSTANTES}
+        for clave in CLAVES_CORRECCION:
+            correccion = datos.get(clave)
+            if not isinstance(correccion, dict):
+                errores.append({'campo': f"{ruta}.{clave}", 'mensaje': "debe ser un objeto con 'a', 'b' y 'c'"})
+                continue
+            valores[clave] = tuple(_numero(correccion, coef, f"{ruta}.{clave}.{coef}", errores) for coef in 'abc')
+        return cls(**valores) if len(errores) == total else None
+
+@functools.lru_cache(maxsize=MAX_CONSTANTES_MEMORIZADAS)
+def _constantes_memorizadas(escalares, correcciones):
+    return Constantes(**dict(zip(CLAVES_CONSTANTES, escalares)), **dict(zip(CLAVES_CORRECCION, correcciones)))
+
+class EntradasGenerales:
+    """
+    Entradas generales que usa el cálculo, ya validadas. `datos` es el diccionario
+    original, del que el reporte toma los textos.
+    """
+    __slots__ = ('div_min_valor', 'clase_instrumento', 'debug_mode', 'montecarlo', 'datos')
+
+    def __init__(self, datos, div_min_valor=0, clase_instrumento='default', debug_mode=False, montecarlo=None):
+        self.datos = datos
+        self.div_min_valor = div_min_valor
+        self.clase_instrumento = clase_instrumento
+        self.debug_mode = debug_mode
+        # None, o {'num_muestras': n, 'semilla': s}; sin semilla se elige una en cada cálculo
+        self.montecarlo = montecarlo
+
+    @classmethod
+    def desde_json(cls, datos, errores, ruta='entradas_generales'):
+        """Entradas generales de un payload, o None si alguna no es válida (los errores se agregan)."""
+        if not isinstance(datos, dict):
+            errores.append({'campo': ruta, 'mensaje': "debe ser un objeto"})
+            return None
+        total = len(errores)
+        div_min_valor = _numero(datos, 'div_min_valor', f"{ruta}.div_min_valor", errores, predeterminado=0)
+        for campo in CAMPOS_TEXTO:
+            if datos.get(campo) is not None and not isinstance(datos[campo], str):
+                errores.append({'campo': f"{ruta}.{campo}", 'mensaje': f"debe ser texto: {datos[campo]!r}"})
+
+        condiciones = datos.get('condiciones_iniciales', {})
+        if not isinstance(condiciones, dict):
+            errores.append({'campo': f"{ruta}.condiciones_iniciales", 'mensaje': "debe ser un objeto"})
+        else:
+            for clave in condiciones:
+                _numero(condiciones, clave, f"{ruta}.condiciones_iniciales.{clave}", errores)
+        if not isinstance(datos.get('mantenimientos', []), list):
+            errores.append({'campo': f"{ruta}.mantenimientos", 'mensaje': "debe ser una lista"})
+
+        montecarlo = cls._leer_montecarlo(datos.get('montecarlo'), f"{ruta}.montecarlo", errores)
+        if len(errores) != total:
+            return None
+        return cls(
+            datos,
+            div_min_valor=div_min_valor,
+            clase_instrumento=(datos.get('clase_instrumento') if datos.get('clase_instrumento') is not None else 'default').lower(),
+            debug_mode=bool(datos.get('debug_mode', False)),
+            montecarlo=montecarlo,
+        )
+
+    @staticmethod
+    def _leer_montecarlo(opciones, ruta, errores):
+        """'montecarlo' es true o {"muestras": ..., "semilla": ...}; None si no se pidió."""
+        if opciones is None or opciones is False:
+            return None
+        if opciones is True:
+            opciones = {}
+        elif not isinstance(opciones, dict):
+            errores.append({'campo': ruta, 'mensaje': f"debe ser true, false o un objeto: {opciones!r}"})
+            return None
+        muestras = opciones.get('muestras', MUESTRAS_PREDETERMINADAS)
+        if type(muestras) is float and muestras.is_integer():
+            muestras = int(muestras)
+        if type(muestras) is not int or not 0 < muestras <= MAX_MUESTRAS:
+            errores.append({'campo': f"{ruta}.muestras", 'mensaje': f"debe ser un entero entre 1 y {MAX_MUESTRAS}: {muestras!r}"})
+        semilla = opciones.get('semilla')
+        if semilla is not None and (type(semilla) is not int or semilla < 0):
+            errores.append({'campo': f"{ruta}.semilla", 'mensaje': f"debe ser un entero no negativo: {semilla!r}"})
+        return {'num_muestras': muestras, 'semilla': semilla}
+
+class PeticionCalculo:
+    """
+    Una petición de cálculo validada. `valores_nominales` conserva los números del JSON;
+    `masas` es una lista de arreglos de repeticiones (uno por aforo) y `ambientales`,
+    de arreglos (K, 4) de mediciones ambientales, o None si las condiciones llegan ya
+    promediadas (ingesta de archivos).
+    """
+    __slots__ = ('constantes', 'entradas_generales', 'valores_nominales', 'masas', 'ambientales')
+
+    def __init__(self, constantes, entradas_generales, valores_nominales, masas=None, ambientales=None):
+        self.constantes = constantes
+        self.entradas_generales = entradas_generales
+        self.valores_nominales = valores_nominales
+        self.masas = masas
+        self.ambientales = ambientales
+
+def claves_aforos(data):
+    """Devuelve las claves 'aforo1', 'aforo2', ... presentes en el payload, en orden."""
+    claves = []
+    while f'aforo{len(claves) + 1}' in data:
+        claves.append(f'aforo{len(claves) + 1}')
+    return claves
+
+def validar_montecarlo(entradas_generales, num_aforos, errores, ruta='entradas_generales'):
+    """Agrega un error si las muestras de Monte Carlo por los `num_aforos` superan MAX_VALORES."""
+    opciones = entradas_generales.montecarlo if entradas_generales is not None else None
+    if opciones and type(opciones['num_muestras']) is int and opciones['num_muestras'] * num_aforos > MAX_VALORES:
+        errores.append({'campo': f"{ruta}.montecarlo.muestras",
+                        'mensaje': f"muestras × aforos no puede superar {MAX_VALORES}: "
+                                   f"{opciones['num_muestras']} × {num_aforos}"})
+
+def validar_peticion(data, con_mediciones=True, claves_requeridas=CLAVES_REQUERIDAS):
+    """
+    Valida un payload de /calcular en un solo recorrido y lo convierte en PeticionCalculo.
+    Con `con_mediciones=False` no se leen las mediciones de los aforos (sólo su
+    'valor_nominal'). Lanza ErrorValidacion con todos los errores encontrados.
+    """
+    if not isinstance(data, dict):
+        raise ErrorValidacion([{'campo': '', 'mensaje': "el cálculo debe ser un objeto JSON"}])
+    errores = [
+        {'campo': clave, 'mensaje': "falta la clave principal"}
+        for clave in claves_requeridas if clave not in data
+    ]
+    constantes = Constantes.desde_json(data.get('constantes'), errores) if 'constantes' in data else None
+    entradas_generales = (EntradasGenerales.desde_json(data.get('entradas_generales'), errores)
+                          if 'entradas_generales' in data else None)
+
+    claves = claves_aforos(data)
+    if not claves and 'aforo1' not in claves_requeridas:
+        errores.append({'campo': 'aforo1', 'mensaje': "el cálculo no contiene aforos"})
+    valores_nominales = []
+    masas = []
+    ambientales = []
+    for clave in claves:
+        aforo = data[clave]
+        if not isinstance(aforo, dict):
+            errores.append({'campo': clave, 'mensaje': "debe ser un objeto"})
+            continue
+        valores_nominales.append(_numero(aforo, 'valor_nominal', f"{clave}.valor_nominal", errores))
+        if con_mediciones:
+            masas.append(_arreglo(aforo.get('mediciones_masa'), f"{clave}.mediciones_masa", errores))
+            ambientales.append(_arreglo_ambiental(aforo.get('mediciones_ambientales'),
+                                                  f"{clave}.mediciones_ambientales", errores))
+    validar_montecarlo(entradas_generales, len(claves), errores)
+
+    if errores:
+        raise ErrorValidacion(errores)
+    if not con_mediciones:
+        return PeticionCalculo(constantes, entradas_generales, valores_nominales)
+    return PeticionCalculo(constantes, entradas_generales, valores_nominales, masas, ambientales)
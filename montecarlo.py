@@ -0,0 +1,159 @@
+"""
+Propagación de incertidumbre por Monte Carlo (GUM Suplemento 1) como verificación
+del presupuesto lineal del motor.
+
+Las magnitudes de entrada se muestrean con las mismas incertidumbres estándar del
+presupuesto GUM y cada muestra pasa por el modelo del motor
+(calculadora.calcular_aforos_desde_promedios) en forma de arreglos. Las muestras se
+generan en bloques con semillas derivadas de una SeedSequence, así el resultado sólo
+depende de la semilla y no del número de núcleos; los bloques se reparten entre hilos
+(numpy libera el GIL en las operaciones sobre arreglos).
+"""
+import math
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cobertura import ALFA_PREDETERMINADO
+
+MUESTRAS_PREDETERMINADAS = 10**6
+MAX_MUESTRAS = 10**7
+# Tope de muestras × aforos de una petición: el costo crece con ambos (unos 0,9 s
+# por cada 10**7 con un núcleo)
+MAX_VALORES = 10**7
+
+# Número fijo de bloques: con la misma semilla se obtienen las mismas muestras
+# sin importar cuántos hilos las procesen.
+NUM_BLOQUES = 8
+
+def _columna(valores):
+    return np.reshape(valores, (-1, 1))
+
+def _muestrear_bloque(semilla, num_muestras, entradas):
+    """
+    Genera `num_muestras` valores del volumen (m³) para los N aforos de `entradas`;
+    devuelve un arreglo (N, num_muestras). Las entradas estandarizadas se comparten
+    entre aforos: cada fila es una muestra válida de la distribución de su aforo.
+    """
+    rng = np.random.Generator(np.random.PCG64(semilla))
+    forma = (1, num_muestras)
+
+    # Masa: diferencia de dos pesadas (vacío y lleno) con la misma incertidumbre,
+    # equivalente a una sola normal con u·√2
+    masa_kg = _columna(entradas['masa_kg']) + (entradas['u_M_kg'] * math.sqrt(2)) * rng.standard_normal(forma)
+    rho_agua = _columna(entradas['rho_agua']) + entradas['u_rho_A'] * rng.standard_normal(forma)
+    rho_aire = _columna(entradas['rho_aire']) + entradas['u_rho_a'] * rng.standard_normal(forma)
+    # Densidad de las pesas y coeficiente de dilatación: distribuciones rectangulares
+    rho_pesa = entradas['rho_pesa'] * (1 + 0.015 * rng.uniform(-1, 1, forma))
+    gamma = entradas['gamma'] * (1 + 0.1 * rng.uniform(-1, 1, forma))
+    temp_agua = _columna(entradas['temp_agua'] - 20) + entradas['u_tr'] * rng.standard_normal(forma)
+
+    # Mismo modelo que calculadora.calcular_aforos_desde_promedios:
+    # V = m · 1/(ρ_A - ρ_a) · (1 - γ(t - 20)). El volumen reportado no incluye el factor
+    # de las pesas, pero el presupuesto GUM propaga ρ_B: se aplica relativo a su valor
+    # nominal para no desplazar el resultado.
+    factor_pesa = 1 - rho_aire / rho_pesa
+    factor_pesa /= _columna(entradas['factor_pesa'])
+    rho_agua -= rho_aire
+    volumen_m3 = masa_kg
+    volumen_m3 /= rho_agua
+    temp_agua *= gamma
+    np.subtract(1, temp_agua, out=temp_agua)
+    volumen_m3 *= temp_agua
+    volumen_m3 *= factor_pesa
+
+    # Repetibilidad (tipo A): t de Student escalada, como indica el Suplemento 1
+    grados = entradas['num_repeticiones'] - 1
+    if grados > 0:
+        volumen_m3 += _columna(entradas['u_Crep']) * rng.standard_t(grados, forma)
+    volumen_m3 += entradas['u_Cres'] * math.sqrt(3) * rng.uniform(-1, 1, forma)
+    volumen_m3 += entradas['u_Crepro'] * rng.standard_normal(forma)
+    return volumen_m3
+
+def _tolerancia_numerica(incertidumbre):
+    """Tolerancia δ del Suplemento 1 (§7.9) para u(y) expresada con dos cifras significativas."""
+    if not incertidumbre > 0:
+        return 0.0
+    exponente = math.floor(math.log10(incertidumbre)) - 1
+    return 0.5 * 10**exponente
+
+def calcular_montecarlo(resultado, constantes, num_muestras=MUESTRAS_PREDETERMINADAS, semilla=None,
+                        nivel_confianza=1 - ALFA_PREDETERMINADO, max_workers=None):
+    """
+    Propaga las incertidumbres de un resultado de `calcular_aforos_desde_promedios`
+    con sus constantes (modelo.Constantes).
+
+    Devuelve, por aforo (arreglos de N), el volumen medio, la incertidumbre estándar,
+    el intervalo de cobertura probabilísticamente simétrico al `nivel_confianza`
+    y si el resultado GUM queda validado según el §8 del Suplemento 1. `semilla`
+    reproduce exactamente las mismas muestras; sin ella se genera una y se devuelve.
+    """
+    num_muestras = int(num_muestras)
+    if not 0 < num_muestras <= MAX_MUESTRAS:
+        raise ValueError(f"El número de muestras debe estar entre 1 y {MAX_MUESTRAS}.")
+    num_aforos = len(resultado['promedio_volumen_ul'])
+    if num_muestras * num_aforos > MAX_VALORES:
+        raise ValueError(f"Muestras × aforos no puede superar {MAX_VALORES}: {num_muestras} × {num_aforos}.")
+
+    presupuesto = resultado['presupuesto']
+    entradas = {
+        'masa_kg': presupuesto['masa_promedio_kg'],
+        'u_M_kg': presupuesto['u_M_kg'],
+        'rho_agua': resultado['rho_agua'],
+        'u_rho_A': presupuesto['u_rho_A_kg_m3'],
+        'rho_aire': resultado['rho_aire'],
+        'u_rho_a': presupuesto['u_rho_a_kg_m3'],
+        'rho_pesa': constantes.rho_pesa_n74,
+        'factor_pesa': resultado['pesa'],
+        'gamma': constantes.alpha_material_pp,
+        'temp_agua': resultado['promedios_internos'][:, 0],
+        'u_tr': presupuesto['u_tr_C'],
+        'num_repeticiones': resultado['volumenes_ul'].shape[1],
+        'u_Crep': presupuesto['u_Crep_m3'],
+        'u_Cres': presupuesto['u_Cres_m3'],
+        'u_Crepro': presupuesto['u_Crepro_m3'],
+    }
+
+    if semilla is None:
+        # 53 bits: el número se conserva exacto al pasar por JSON en el navegador
+        semilla = secrets.randbits(53)
+    num_bloques = min(NUM_BLOQUES, num_muestras)
+    base, resto = divmod(num_muestras, num_bloques)
+    tamanos = [base + (1 if i < resto else 0) for i in range(num_bloques)]
+    hijos = np.random.SeedSequence(semilla).spawn(num_bloques)
+
+    workers = min(max_workers or os.cpu_count() or 1, num_bloques)
+    if workers == 1:
+        bloques = [_muestrear_bloque(hijo, tamano, entradas) for hijo, tamano in zip(hijos, tamanos)]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            bloques = list(pool.map(_muestrear_bloque, hijos, tamanos, [entradas] * num_bloques))
+    volumenes_ul = np.concatenate(bloques, axis=1)
+    volumenes_ul *= 1e9
+
+    alfa = 1 - nivel_confianza
+    promedio = volumenes_ul.mean(axis=1)
+    incertidumbre = volumenes_ul.std(axis=1, ddof=1)
+    inferior, superior = np.quantile(volumenes_ul, [alfa / 2, 1 - alfa / 2], axis=1)
+
+    # Validación del resultado GUM (§8): los extremos de y ± U deben coincidir con el
+    # intervalo de Monte Carlo dentro de la tolerancia numérica.
+    volumen_gum = resultado['promedio_volumen_ul']
+    incertidumbre_gum = resultado['incertidumbre_expandida']
+    tolerancias = np.array([_tolerancia_numerica(u) for u in resultado['incertidumbre_combinada_m3'] * 1e9])
+    validado = ((np.abs(volumen_gum - incertidumbre_gum - inferior) <= tolerancias) &
+                (np.abs(volumen_gum + incertidumbre_gum - superior) <= tolerancias))
+
+    return {
+        'muestras': num_muestras,
+        'semilla': semilla,
+        'nivel_confianza': nivel_confianza,
+        'promedio_volumen_ul': promedio,
+        'incertidumbre_estandar_ul': incertidumbre,
+        'intervalo_inferior_ul': inferior,
+        'intervalo_superior_ul': superior,
+        'tolerancia_ul': tolerancias,
+        'validado_gum': validado,
+    }
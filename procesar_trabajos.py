@@ -0,0 +1,318 @@
+"""
+Reprocesamiento masivo fuera del servidor: calcula (y genera los reportes de) cada
+trabajo guardado en un directorio, repartiendo los trabajos entre los núcleos.
+
+Cada trabajo es un archivo .json con el payload de /calcular. Para ENTRADA/a/b.json se
+escriben SALIDA/a/b/resultados.json (la respuesta de /calcular) y un PDF por tipo de
+reporte. SALIDA/manifiesto.ndjson registra una línea por trabajo terminado (correcto o
+con error); al volver a correr sobre la misma salida se omiten los trabajos ya
+correctos cuyo archivo no cambió, así que una corrida interrumpida continúa donde se
+quedó. Los trabajos con error se vuelven a intentar con --reintentar-errores.
+
+Uso:
+  python procesar_trabajos.py ENTRADA SALIDA [--workers N] [--reportes servicio,certificado]
+                              [--sin-pdf] [--config DIR] [--base-url URL] [--reintentar-errores]
+
+Termina con código 1 si algún trabajo falló, en esta corrida o en una anterior sin
+reintentarlo después.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import almacen_calculos
+import almacen_configuracion
+import calculadora
+import reportes
+import respuestas
+from modelo import ErrorValidacion
+
+DIRECTORIO_CONFIGURACION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'config')
+NOMBRE_MANIFIESTO = 'manifiesto.ndjson'
+NOMBRE_RESULTADOS = 'resultados.json'
+# Los de app.TIPOS_REPORTE, sin importar la aplicación para validar los argumentos
+TIPOS_REPORTE = ('servicio', 'certificado', 'medidas')
+
+# Trabajos enviados al pool por proceso: mantiene ocupados los workers sin cargar en
+# memoria miles de trabajos pendientes
+TRABAJOS_POR_WORKER = 4
+
+# Estado de cada proceso del pool, fijado por _iniciar_proceso
+_proceso = {}
+
+def _escribir(ruta, contenido):
+    """Escribe de forma atómica: una corrida interrumpida no deja archivos a medias."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.tmp{os.getpid()}"
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+def cargar_aplicacion():
+    """
+    Importa app.py para generar los reportes con sus plantillas, sin el historial ni
+    la caché de PDF del servidor: cada reporte se genera una vez y se escribe en la salida.
+    """
+    os.environ['CALCULADORA_HISTORIAL_DB'] = ''
+    os.environ['CALCULADORA_PDF_CACHE_MEMORIA_MB'] = '0'
+    os.environ['CALCULADORA_PDF_CACHE_DIR'] = ''
+    import app as aplicacion
+    return aplicacion
+
+def cargar_configuracion(directorio):
+    """Instantánea de la configuración de `directorio`; ValueError si falta algún archivo."""
+    almacen = almacen_configuracion.AlmacenConfiguracion(directorio, intervalo_revision_s=math.inf)
+    configuracion = almacen.actual()
+    for clave, archivo in almacen_configuracion.ARCHIVOS_CONFIGURACION.items():
+        if clave in almacen.errores or not configuracion[clave]:
+            raise ValueError(f"No se pudo cargar {archivo} de {directorio}: {almacen.errores.get(clave, 'vacío')}")
+    return configuracion
+
+def _iniciar_proceso(directorio_configuracion, tipos, base_url):
+    _proceso['configuracion'] = cargar_configuracion(directorio_configuracion)
+    _proceso['tipos'] = tipos
+    _proceso['base_url'] = base_url
+    # Con fork, la aplicación ya viene cargada del proceso principal
+    _proceso['aplicacion'] = cargar_aplicacion() if tipos else None
+
+def _renderizar_pdf(resultados, tipo):
+    aplicacion = _proceso['aplicacion']
+    base_url = _proceso['base_url']
+    with aplicacion.app.test_request_context(base_url=base_url):
+        content_html = aplicacion.renderizar_contenido_reporte(resultados, tipo)
+        rendered_html = aplicacion.renderizar_plantilla_reporte(content_html, base_url, tipo)
+    return reportes.renderizar_pdf(rendered_html)
+
+def procesar_trabajo(ruta, relativa, directorio_salida):
+    """
+    Calcula un trabajo y escribe sus resultados y reportes. Devuelve el registro del
+    manifiesto; los errores quedan en el registro en lugar de interrumpir la corrida.
+    """
+    inicio = time.perf_counter()
+    registro = {'trabajo': relativa, 'huella': None, 'estado': 'error'}
+    try:
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+        registro['huella'] = hashlib.sha256(contenido).hexdigest()
+        data = json.loads(contenido)
+        if not isinstance(data, dict):
+            raise ValueError("El trabajo no es un objeto JSON.")
+
+        data = calculadora.fijar_semilla_montecarlo(data)
+        resultados = calculadora.procesar_todos_los_aforos(data, _proceso['configuracion'])
+        calculo_id = almacen_calculos.identificador_calculo(data)
+        carpeta = os.path.join(directorio_salida, os.path.splitext(relativa)[0])
+        _escribir(os.path.join(carpeta, NOMBRE_RESULTADOS),
+                  respuestas.codificar_json({**resultados, 'calculo_id': calculo_id}))
+        archivos = [NOMBRE_RESULTADOS]
+        for tipo in _proceso['tipos']:
+            _escribir(os.path.join(carpeta, f"{tipo}.pdf"), _renderizar_pdf(resultados, tipo))
+            archivos.append(f"{tipo}.pdf")
+        registro.update(estado='ok', calculo_id=calculo_id, reportes=list(_proceso['tipos']), archivos=archivos)
+    except ErrorValidacion as e:
+        registro.update(error=f"Datos inválidos o malformados: {e}", errores=e.errores)
+    except (ValueError, TypeError, KeyError, ZeroDivisionError) as e:
+        registro['error'] = f"Datos inválidos o malformados: {e}"
+    except Exception as e:
+        registro['error'] = f"Error interno al procesar el trabajo: {type(e).__name__}: {e}"
+    registro['segundos'] = round(time.perf_counter() - inicio, 4)
+    return registro
+
+def buscar_trabajos(directorio_entrada, directorio_salida):
+    """(ruta, ruta relativa con '/') de los .json de la entrada, en orden; excluye la salida."""
+    salida = os.path.realpath(directorio_salida)
+    for raiz, subdirectorios, archivos in os.walk(directorio_entrada):
+        subdirectorios[:] = sorted(
+            d for d in subdirectorios if os.path.realpath(os.path.join(raiz, d)) != salida
+        )
+        for archivo in sorted(archivos):
+            if archivo.endswith('.json'):
+                ruta = os.path.join(raiz, archivo)
+                yield ruta, os.path.relpath(ruta, directorio_entrada).replace(os.sep, '/')
+
+def leer_manifiesto(ruta):
+    """Último registro de cada trabajo. Una línea cortada por una interrupción se ignora."""
+    registros = {}
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(registro, dict) and 'trabajo' in registro:
+                    registros[registro['trabajo']] = registro
+    except FileNotFoundError:
+        pass
+    return registros
+
+def _huella_archivo(ruta):
+    with open(ruta, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def trabajo_terminado(registro, ruta, tipos, reintentar_errores):
+    """True si el registro anterior cubre el trabajo tal como está ahora."""
+    if registro is None:
+        return False
+    if registro['estado'] != 'ok':
+        return not reintentar_errores and registro.get('huella') == _huella_archivo(ruta)
+    return set(tipos) <= set(registro.get('reportes', ())) and registro.get('huella') == _huella_archivo(ruta)
+
+def ejecutar(directorio_entrada, directorio_salida, tipos=TIPOS_REPORTE, workers=None,
+             directorio_configuracion=DIRECTORIO_CONFIGURACION, base_url='http://localhost',
+             reintentar_errores=False, al_terminar=None):
+    """
+    Procesa los trabajos pendientes y devuelve el resumen de la corrida
+    (pendientes, correctos, errores, omitidos, segundos, registros con error y
+    registros con error de corridas anteriores que no se reintentaron).
+    `al_terminar(registro)` se llama con cada trabajo terminado.
+    """
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta_manifiesto = os.path.join(directorio_salida, NOMBRE_MANIFIESTO)
+    anteriores = leer_manifiesto(ruta_manifiesto)
+    pendientes = []
+    omitidos = 0
+    fallidos_antes = []
+    for ruta, relativa in buscar_trabajos(directorio_entrada, directorio_salida):
+        registro = anteriores.get(relativa)
+        if not trabajo_terminado(registro, ruta, tipos, reintentar_errores):
+            pendientes.append((ruta, relativa))
+        elif registro['estado'] == 'ok':
+            omitidos += 1
+        else:
+            # Sigue con error: se informa en el resumen aunque no se reintente
+            fallidos_antes.append(registro)
+
+    resumen = {'pendientes': len(pendientes), 'correctos': 0, 'errores': 0, 'omitidos': omitidos,
+               'segundos': 0.0, 'fallidos': [], 'fallidos_antes': fallidos_antes}
+    if not pendientes:
+        return resumen
+
+    workers = min(workers or os.cpu_count() or 1, len(pendientes))
+    argumentos_proceso = (directorio_configuracion, tuple(tipos), base_url)
+    inicio = time.perf_counter()
+
+    with open(ruta_manifiesto, 'a', encoding='utf-8') as manifiesto:
+        def registrar(registro):
+            # Una línea por trabajo, escrita al terminarlo: es el punto de reanudación
+            manifiesto.write(json.dumps(registro, ensure_ascii=False) + '\n')
+            manifiesto.flush()
+            if registro['estado'] == 'ok':
+                resumen['correctos'] += 1
+            else:
+                resumen['errores'] += 1
+                resumen['fallidos'].append(registro)
+            if al_terminar is not None:
+                al_terminar(registro)
+
+        try:
+            if workers == 1:
+                # Un solo proceso: sin pool ni serialización
+                _iniciar_proceso(*argumentos_proceso)
+                for ruta, relativa in pendientes:
+                    registrar(procesar_trabajo(ruta, relativa, directorio_salida))
+            else:
+                if tipos:
+                    # Los workers creados con fork heredan la aplicación ya importada
+                    cargar_aplicacion()
+                with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_proceso,
+                                         initargs=argumentos_proceso) as pool:
+                    restantes = iter(pendientes)
+                    en_curso = set()
+                    try:
+                        while True:
+                            for ruta, relativa in restantes:
+                                en_curso.add(pool.submit(procesar_trabajo, ruta, relativa, directorio_salida))
+                                if len(en_curso) >= workers * TRABAJOS_POR_WORKER:
+                                    break
+                            if not en_curso:
+                                break
+                            terminados, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+                            for futuro in terminados:
+                                registrar(futuro.result())
+                    except BaseException:
+                        # Interrupción: no se empiezan más trabajos; lo terminado ya está registrado
+                        pool.shutdown(wait=True, cancel_futures=True)
+                        raise
+        finally:
+            manifiesto.flush()
+            os.fsync(manifiesto.fileno())
+            resumen['segundos'] = time.perf_counter() - inicio
+    return resumen
+
+def imprimir_resumen(resumen, max_errores=20):
+    procesados = resumen['correctos'] + resumen['errores']
+    ritmo = procesados / resumen['segundos'] if resumen['segundos'] else 0.0
+    print(f"\nProcesados: {procesados} de {resumen['pendientes']} pendientes "
+          f"({resumen['correctos']} correctos, {resumen['errores']} con error); "
+          f"omitidos por estar ya terminados: {resumen['omitidos']}")
+    print(f"Tiempo: {resumen['segundos']:.1f} s, {ritmo:.1f} trabajos/s")
+    for titulo, fallidos in (("Trabajos con error", resumen['fallidos']),
+                             ("Trabajos con error en una corrida anterior (use --reintentar-errores)",
+                              resumen['fallidos_antes'])):
+        if not fallidos:
+            continue
+        print(f"\n{titulo}:")
+        for registro in fallidos[:max_errores]:
+            print(f"  {registro['trabajo']}: {registro.get('error')}")
+        if len(fallidos) > max_errores:
+            print(f"  ... y {len(fallidos) - max_errores} más (ver {NOMBRE_MANIFIESTO})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcula y genera los reportes de un directorio de trabajos.")
+    parser.add_argument('entrada', help="Directorio con los trabajos (.json con el payload de /calcular)")
+    parser.add_argument('salida', help="Directorio de resultados, reportes y manifiesto")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos (uno por núcleo)")
+    parser.add_argument('--reportes', default=','.join(TIPOS_REPORTE),
+                        help=f"Reportes a generar: {', '.join(TIPOS_REPORTE)}")
+    parser.add_argument('--sin-pdf', action='store_true', help="Sólo calcular, sin generar reportes")
+    parser.add_argument('--config', default=DIRECTORIO_CONFIGURACION,
+                        help="Directorio con patrones.json, site_config.json y emts.json")
+    parser.add_argument('--base-url', default='http://localhost', help="base_url de la plantilla de los reportes")
+    parser.add_argument('--reintentar-errores', action='store_true',
+                        help="Volver a procesar los trabajos que terminaron con error")
+    args = parser.parse_args(argv)
+
+    tipos = [] if args.sin_pdf else [tipo.strip() for tipo in args.reportes.split(',') if tipo.strip()]
+    desconocidos = set(tipos) - set(TIPOS_REPORTE)
+    if desconocidos:
+        parser.error(f"Reportes desconocidos: {', '.join(sorted(desconocidos))}")
+    if not os.path.isdir(args.entrada):
+        parser.error(f"No existe el directorio de entrada: {args.entrada}")
+    try:
+        # Se comprueba antes de lanzar los procesos, que la cargan cada uno
+        cargar_configuracion(args.config)
+    except ValueError as e:
+        parser.error(str(e))
+
+    terminados = [0]
+
+    def progreso(registro):
+        terminados[0] += 1
+        if registro['estado'] != 'ok':
+            print(f"ERROR {registro['trabajo']}: {registro.get('error')}", flush=True)
+        elif terminados[0] % 100 == 0:
+            print(f"{terminados[0]} trabajos terminados", flush=True)
+
+    resumen = None
+    try:
+        resumen = ejecutar(args.entrada, args.salida, tipos, args.workers, args.config, args.base_url,
+                           args.reintentar_errores, al_terminar=progreso)
+    except KeyboardInterrupt:
+        print("\nInterrumpido: vuelva a ejecutar el mismo comando para continuar.", file=sys.stderr)
+        return 130
+    except BrokenProcessPool:
+        print("\nUn proceso terminó de forma inesperada: vuelva a ejecutar el mismo comando para continuar.",
+              file=sys.stderr)
+        return 1
+    imprimir_resumen(resumen)
+    return 1 if resumen['errores'] or resumen['fallidos_antes'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Generación de los PDF de reportes con WeasyPrint.
+
+WeasyPrint (junto con Pango y Cairo) se importa en el primer uso: cargarlo cuesta
+segundos y no todos los procesos llegan a generar un PDF.
+"""
+import mimetypes
+import os
+import threading
+from urllib.parse import urlsplit, unquote
+
+import metricas
+from estaticos import NOMBRE_DIST
+
+_HTML = None
+_carga_lock = threading.RLock()
+
+DIRECTORIO_ESTATICOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+def cargar_weasyprint():
+    """Importa WeasyPrint una sola vez y devuelve su clase HTML."""
+    global _HTML
+    if _HTML is None:
+        with _carga_lock:
+            if _HTML is None:
+                from weasyprint import HTML
+                _HTML = HTML
+    return _HTML
+
+def _crear_url_fetcher(obtener_recurso):
+    """
+    Crea el url_fetcher de WeasyPrint que delega en `obtener_recurso(url, descargar)`.
+    WeasyPrint 66+ espera una instancia de URLFetcher; las versiones anteriores, una
+    función que devuelve un diccionario.
+    """
+    try:
+        from weasyprint.urls import URLFetcher, URLFetcherResponse
+    except ImportError:
+        from weasyprint import default_url_fetcher
+
+        def descargar(url):
+            resultado = default_url_fetcher(url)
+            contenido = resultado['file_obj'].read() if 'file_obj' in resultado else resultado['string']
+            return contenido, resultado.get('mime_type')
+
+        def url_fetcher(url):
+            contenido, mime_type = obtener_recurso(url, descargar)
+            return {'string': contenido, 'mime_type': mime_type, 'redirected_url': url}
+        return url_fetcher
+
+    class _URLFetcherConCache(URLFetcher):
+        def fetch(self, url, headers=None):
+            def descargar(url):
+                respuesta = URLFetcher.fetch(self, url, headers)
+                try:
+                    return respuesta.read(), respuesta.content_type
+                finally:
+                    respuesta.close()
+            contenido, mime_type = obtener_recurso(url, descargar)
+            return URLFetcherResponse(url, contenido, {'Content-Type': mime_type or 'application/octet-stream'})
+
+    return _URLFetcherConCache()
+
+class RenderizadorPDF:
+    """
+    Renderizador reutilizable, uno por proceso. Conserva la configuración de fuentes y
+    los recursos estáticos ya leídos (logo, fuentes, hojas de estilo enlazadas). Los
+    <style> de la plantilla se quedan en el documento: pasarlos como `stylesheets` los
+    convertiría en hojas de usuario, con menos prioridad que las del autor.
+
+    Las URL cuya ruta empieza por /static/ (o /assets/, los recursos con huella) se leen
+    directamente de `directorio_estaticos` en lugar de pedirse por HTTP al propio servidor,
+    y se guardan en memoria hasta `max_bytes_recursos` mientras no cambie la fecha de
+    modificación del archivo. Las demás URL (externas o del HTML del cliente) se
+    descargan en cada render, sin guardarse.
+    """
+
+    def __init__(self, directorio_estaticos=DIRECTORIO_ESTATICOS, max_bytes_recursos=16 * 1024 * 1024):
+        from weasyprint.text.fonts import FontConfiguration
+
+        self._HTML = cargar_weasyprint()
+        self.directorio_estaticos = directorio_estaticos
+        self.max_bytes_recursos = max_bytes_recursos
+        self.font_config = FontConfiguration()
+        self.url_fetcher = _crear_url_fetcher(self._recurso)
+        self._recursos = {}       # ruta local -> (st_mtime_ns, (bytes, mime_type))
+        self._bytes_recursos = 0
+        self._lock = threading.Lock()
+
+    def _ruta_estatica(self, url):
+        """Ruta local del archivo de una URL /static/ o /assets/, o None."""
+        ruta = unquote(urlsplit(url).path)
+        if ruta.startswith('/static/'):
+            base, ruta = self.directorio_estaticos, ruta[len('/static/'):]
+        elif ruta.startswith('/assets/'):
+            # Recursos con huella de asset_url (estaticos.py)
+            base, ruta = os.path.join(self.directorio_estaticos, NOMBRE_DIST), ruta[len('/assets/'):]
+        else:
+            return None
+        base = os.path.realpath(base)
+        ruta_local = os.path.realpath(os.path.join(base, ruta))
+        if not ruta_local.startswith(base + os.sep) or not os.path.isfile(ruta_local):
+            return None
+        return ruta_local
+
+    def _recurso(self, url, descargar):
+        """Devuelve (contenido, mime_type) desde la caché, la carpeta static o `descargar`."""
+        ruta = self._ruta_estatica(url)
+        if ruta is None:
+            return descargar(url)
+        try:
+            modificado = os.stat(ruta).st_mtime_ns
+        except OSError:
+            return descargar(url)
+        guardado = self._recursos.get(ruta)
+        if guardado is not None and guardado[0] == modificado:
+            return guardado[1]
+        # Nuevo o redesplegado: se vuelve a leer
+        with open(ruta, 'rb') as f:
+            recurso = f.read(), mimetypes.guess_type(ruta)[0]
+        with self._lock:
+            anterior = self._recursos.pop(ruta, None)
+            if anterior is not None:
+                self._bytes_recursos -= len(anterior[1][0])
+            if self._bytes_recursos + len(recurso[0]) <= self.max_bytes_recursos:
+                self._recursos[ruta] = (modificado, recurso)
+                self._bytes_recursos += len(recurso[0])
+        return recurso
+
+    def documento(self, rendered_html):
+        """Maqueta el HTML y devuelve el documento de WeasyPrint."""
+        with metricas.etapa('pdf_maquetacion'):
+            return self._HTML(string=rendered_html, url_fetcher=self.url_fetcher).render(
+                font_config=self.font_config
+            )
+
+    def renderizar(self, rendered_html):
+        """Devuelve los bytes del PDF de un reporte."""
+        documento = self.documento(rendered_html)
+        with metricas.etapa('pdf_escritura'):
+            return documento.write_pdf()
+
+_renderizador = None
+
+def obtener_renderizador():
+    """Renderizador compartido del proceso (se crea en el primer uso)."""
+    global _renderizador
+    if _renderizador is None:
+        with _carga_lock:
+            if _renderizador is None:
+                _renderizador = RenderizadorPDF()
+    return _renderizador
+
+def renderizar_pdf(rendered_html):
+    """Convierte el HTML ya renderizado de un reporte en los bytes del PDF."""
+    metricas.PDF_EN_CURSO.sumar()
+    try:
+        return obtener_renderizador().renderizar(rendered_html)
+    finally:
+        metricas.PDF_EN_CURSO.restar()
+
+def combinar_pdf(rendered_htmls, destino):
+    """
+    Genera un único PDF con las páginas de varios reportes, en orden, y lo escribe
+    en `destino` (ruta o archivo abierto en modo binario).
+    WeasyPrint necesita la maquetación de todas las páginas para escribir el PDF final.
+    """
+    renderizador = obtener_renderizador()
+    metricas.PDF_EN_CURSO.sumar()
+    try:
+        documentos = [renderizador.documento(rendered_html) for rendered_html in rendered_htmls]
+        paginas = [pagina for documento in documentos for pagina in documento.pages]
+        with metricas.etapa('pdf_escritura'):
+            documentos[0].copy(paginas).write_pdf(destino)
+    finally:
+        metricas.PDF_EN_CURSO.restar()
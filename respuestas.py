@@ -0,0 +1,194 @@
+"""
+Serialización y envío de las respuestas JSON: codificador rápido (orjson si está
+instalado), compresión gzip/brotli según Accept-Encoding y una caché de respuestas de
+/calcular ya codificadas.
+
+Un resultado de varios aforos es una lista grande de floats; con orjson se codifica
+varias veces más rápido que con el módulo json, y comprimido ocupa una fracción. La
+caché guarda el cuerpo codificado y sus versiones comprimidas, así que repetir el mismo
+payload (la vista previa y la exportación recalculan lo mismo) no vuelve a calcular,
+codificar ni comprimir nada.
+"""
+import gzip
+import hashlib
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from estado import EstadoMemoria
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Tipos que vale la pena comprimir (los PDF y las imágenes ya vienen comprimidos)
+TIPOS_COMPRIMIBLES = frozenset({
+    'application/json', 'application/javascript', 'text/html', 'text/plain', 'text/css', 'text/csv',
+})
+
+# Niveles pensados para comprimir en la petición: casi toda la reducción por una
+# fracción del tiempo de los niveles máximos
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 4
+
+if orjson is not None:
+    # Claves ordenadas, como el proveedor de Flask; las fechas pasan a `default` para
+    # conservar el formato de Flask
+    _OPCIONES_ORJSON = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                        | orjson.OPT_PASSTHROUGH_DATETIME)
+
+def codificar_json(valor, default=DefaultJSONProvider.default):
+    """
+    JSON compacto en UTF-8 (bytes). Con orjson, NaN e infinitos se escriben como null;
+    lo que orjson no sabe codificar (enteros de más de 64 bits, por ejemplo) pasa por
+    el módulo json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(valor, default=default, option=_OPCIONES_ORJSON)
+        except TypeError:
+            pass
+    return json.dumps(valor, default=default, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+def huella_json(valor):
+    """
+    Hash del JSON canónico (claves ordenadas) de `valor`, rápido con orjson. Sirve de
+    clave de caché de respuestas; no coincide con almacen_calculos.identificador_calculo.
+    """
+    return hashlib.blake2b(codificar_json(valor), digest_size=16).hexdigest()
+
+class ProveedorJSON(DefaultJSONProvider):
+    """Proveedor JSON de Flask (jsonify, request.get_json) que usa orjson si está instalado."""
+
+    def dumps(self, obj, **kwargs):
+        # Con indentación (modo depuración) u otras opciones, el módulo json
+        if orjson is None or set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return codificar_json(obj, self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # NaN, enteros de más de 64 bits...: el módulo json decide si es válido
+            return super().loads(s)
+
+def elegir_codificacion(accept_encodings):
+    """'br', 'gzip' o None según el Accept-Encoding de la petición (request.accept_encodings)."""
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+def comprimir(cuerpo, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(cuerpo, quality=CALIDAD_BROTLI)
+    return gzip.compress(cuerpo, compresslevel=NIVEL_GZIP, mtime=0)
+
+def comprimir_respuesta(response, accept_encodings, min_bytes):
+    """
+    Comprime en su lugar una respuesta completa de un tipo comprimible y de al menos
+    `min_bytes`, si el cliente lo acepta. No toca las respuestas transmitidas, los
+    archivos servidos directamente ni las que ya traen Content-Encoding.
+    """
+    if (min_bytes <= 0 or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in TIPOS_COMPRIMIBLES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < min_bytes:
+        return response
+    codificacion = elegir_codificacion(accept_encodings)
+    if codificacion is None:
+        return response
+    cuerpo = response.get_data()
+    comprimido = comprimir(cuerpo, codificacion)
+    if len(comprimido) < len(cuerpo):
+        response.set_data(comprimido)
+        response.headers['Content-Encoding'] = codificacion
+    return response
+
+class RespuestaCodificada:
+    """
+    Una respuesta JSON ya codificada: el cuerpo, su ETag (hash del cuerpo, igual en
+    todos los workers) y las versiones comprimidas, que se generan al pedirlas.
+    `datos` es lo que se quiera conservar junto a la respuesta (serializable en JSON).
+    """
+
+    __slots__ = ('cuerpo', 'etag', 'datos', '_comprimidos')
+
+    def __init__(self, valor, datos=None, cuerpo=None):
+        self.datos = datos
+        self.cuerpo = codificar_json(valor) if cuerpo is None else cuerpo
+        self.etag = hashlib.blake2b(self.cuerpo, digest_size=16).hexdigest()
+        self._comprimidos = {}
+
+    def version(self, codificacion):
+        """Cuerpo con `codificacion` ('br', 'gzip' o None)."""
+        if codificacion is None:
+            return self.cuerpo
+        comprimido = self._comprimidos.get(codificacion)
+        if comprimido is None:
+            # Dos hilos pueden comprimir a la vez la misma versión: el resultado es el mismo
+            comprimido = self._comprimidos[codificacion] = comprimir(self.cuerpo, codificacion)
+        return comprimido
+
+    def tamano(self):
+        return len(self.cuerpo) + sum(len(comprimido) for comprimido in self._comprimidos.values())
+
+    def a_bytes(self):
+        """Encabezado JSON (datos y longitudes) en una línea, seguido del cuerpo y sus versiones."""
+        versiones = dict(self._comprimidos)
+        encabezado = {'datos': self.datos, 'longitudes': [len(self.cuerpo)] + [len(v) for v in versiones.values()],
+                      'codificaciones': list(versiones)}
+        return b'\n'.join([json.dumps(encabezado).encode('utf-8'), self.cuerpo, *versiones.values()])
+
+    @classmethod
+    def desde_bytes(cls, contenido):
+        linea, _, resto = contenido.partition(b'\n')
+        encabezado = json.loads(linea)
+        partes = []
+        inicio = 0
+        for longitud in encabezado['longitudes']:
+            partes.append(resto[inicio:inicio + longitud])
+            inicio += longitud + 1
+        respuesta = cls(None, encabezado['datos'], cuerpo=partes[0])
+        respuesta._comprimidos = dict(zip(encabezado['codificaciones'], partes[1:]))
+        return respuesta
+
+class CacheRespuestas:
+    """
+    Respuestas codificadas por clave (LRU) en el espacio 'respuestas' del backend de
+    estado (estado.py), con un límite de bytes del cuerpo y sus versiones comprimidas
+    (0 la desactiva). Con el backend en archivos, una instancia sirve lo que calculó otra.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, estado=None):
+        self.max_bytes = max_bytes
+        self._espacio = (estado or EstadoMemoria()).espacio(
+            'respuestas', codificar=RespuestaCodificada.a_bytes, decodificar=RespuestaCodificada.desde_bytes,
+            max_bytes=max_bytes, tamano=RespuestaCodificada.tamano,
+        )
+
+    def obtener(self, clave):
+        return self._espacio.obtener(clave)
+
+    def guardar(self, clave, respuesta):
+        """Guarda (o vuelve a guardar, si se agregó otra versión comprimida) una respuesta."""
+        self._espacio.guardar(clave, respuesta)
+
+    def bytes_ocupados(self):
+        return self._espacio.estadisticas()['bytes']
+
+    def estadisticas(self):
+        return self._espacio.estadisticas()
@@ -0,0 +1,79 @@
+"""
+Servidor de producción: gunicorn con la aplicación precargada.
+
+El proceso principal importa app.py, carga la configuración, scipy, WeasyPrint y las
+fuentes (app.precalentar) y después crea los workers con fork, que comparten esa
+memoria por copy-on-write en lugar de cargarla cada uno. Cada worker hace además un
+cálculo y un render de prueba antes de aceptar peticiones.
+
+Uso:
+  python estaticos.py              (en cada despliegue: recursos con huella y precomprimidos)
+  python servidor.py
+  gunicorn -c servidor.py          (lo mismo desde la línea de comandos de gunicorn)
+
+Variables de entorno:
+  CALCULADORA_BIND        dirección de escucha (0.0.0.0:8000)
+  CALCULADORA_WORKERS     procesos (uno por núcleo)
+  CALCULADORA_THREADS     hilos por proceso (4)
+  CALCULADORA_TIMEOUT_S   segundos antes de reiniciar un worker bloqueado (120)
+  CALCULADORA_ESTADO      'archivos' para compartir entre workers e instancias los cálculos,
+                          las respuestas y los PDF asíncronos (por omisión, 'memoria')
+"""
+import gc
+import os
+import sys
+import time
+
+wsgi_app = 'app:app'
+bind = os.environ.get('CALCULADORA_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('CALCULADORA_WORKERS', 0)) or os.cpu_count() or 1
+threads = int(os.environ.get('CALCULADORA_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('CALCULADORA_TIMEOUT_S', 120))
+preload_app = True
+
+# Lo fija el proceso principal; los workers lo heredan con el fork
+_pdf_disponible = False
+
+def when_ready(server):
+    # Proceso principal, con la aplicación ya importada y antes de crear los workers
+    global _pdf_disponible
+    import app
+    inicio = time.perf_counter()
+    try:
+        app.crear_app(configurar_logs=False, precalentar_dependencias=True)
+        _pdf_disponible = True
+    except Exception as e:
+        # Sin WeasyPrint la aplicación sirve los cálculos; los PDF fallarán en su endpoint
+        motivo = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+        server.log.warning(f"Precalentamiento incompleto: {motivo}")
+    # Los objetos cargados hasta aquí no vuelven a recorrerse en el recolector de basura,
+    # que de otro modo escribiría en sus páginas y rompería el copy-on-write
+    gc.freeze()
+    server.log.info(f"Aplicación precargada en {time.perf_counter() - inicio:.2f} s")
+
+def post_fork(server, worker):
+    import app
+    app.configurar_logging()
+
+def post_worker_init(worker):
+    # Se ejecuta en el worker antes de aceptar conexiones
+    import app
+    inicio = time.perf_counter()
+    try:
+        listo = app.precalentar_calculo(renderizar_pdf=_pdf_disponible)
+    except Exception as e:
+        worker.log.warning(f"Worker {worker.pid}: el cálculo de precalentamiento falló: {e}")
+        return
+    if not listo:
+        worker.log.warning(f"Worker {worker.pid}: configuración incompleta, se omite el cálculo de precalentamiento")
+        return
+    worker.log.info(f"Worker {worker.pid} precalentado en {time.perf_counter() - inicio:.2f} s")
+
+if __name__ == '__main__':
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:
+        sys.exit("servidor.py necesita gunicorn (pip install gunicorn); en Windows use waitress o app.py.")
+    sys.argv = [sys.argv[0], '-c', os.path.abspath(__file__)] + sys.argv[1:]
+    sys.exit(run())
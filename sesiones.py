@@ -0,0 +1,261 @@
+"""
+Sesiones de recálculo incremental para la edición en vivo del formulario.
+
+La sesión guarda el payload, su modelo validado (modelo.PeticionCalculo, cuyos arreglos
+se editan en su lugar) y, por aforo, sus condiciones ambientales promedio y su
+resultado. Un cambio (una masa, una lectura ambiental, un valor nominal o una entrada
+general) recalcula sólo los aforos afectados y la respuesta trae sólo lo que cambió.
+Cada aforo pasa por el mismo motor vectorizado que /calcular, cuyas operaciones son
+independientes entre aforos, así que el resultado es idéntico al del cálculo completo.
+
+Las sesiones viven en la memoria del proceso, como los cálculos recientes: con varios
+workers, las peticiones de una sesión deben llegar al mismo proceso.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import calculadora
+import modelo
+from modelo import CAMPOS_AMBIENTALES
+
+# Campos de un aforo que se pueden cambiar
+CAMPOS_AFORO = ('mediciones_masa', 'mediciones_ambientales', 'valor_nominal')
+
+def _valor_numerico(cambio):
+    valor = cambio.get('valor')
+    if not modelo.es_numero(valor):
+        raise ValueError(f"'valor' debe ser un número: {valor!r}")
+    return valor
+
+def _indice(cambio, mediciones):
+    indice = cambio.get('indice')
+    if isinstance(indice, bool) or not isinstance(indice, int) or not 0 <= indice < len(mediciones):
+        raise ValueError(f"'indice' debe estar entre 0 y {len(mediciones) - 1}: {indice!r}")
+    return indice
+
+class SesionCalculo:
+    """Estado de un cálculo que se edita en vivo. Sus métodos no son reentrantes: usar `lock`."""
+
+    def __init__(self, data, configuracion):
+        self.data = copy.deepcopy(data)
+        self.version = 0
+        self.lock = threading.Lock()
+        self.ultimo_uso = time.monotonic()
+        self.peticion = modelo.validar_peticion(self.data)
+        self.claves = modelo.claves_aforos(self.data)
+        self._fijar_entradas(self.data['entradas_generales'], self.peticion.entradas_generales)
+
+        num_aforos = len(self.claves)
+        self._promedios_brutos = [None] * num_aforos
+        self._condiciones = [None] * num_aforos
+        self._resultados = [None] * num_aforos
+        self._calcular_aforos(range(num_aforos), configuracion)
+        self._condiciones_finales = calculadora.promediar_condiciones_finales(self._condiciones)
+        self._textos = self._generar_textos(configuracion)
+
+    def _fijar_entradas(self, datos, entradas_generales):
+        """
+        Reemplaza las entradas generales por `datos` y su modelo ya validado
+        (modelo.EntradasGenerales), con una semilla fija para Monte Carlo.
+        """
+        # Una semilla fija para que Monte Carlo no cambie en cada edición
+        opciones = calculadora.leer_opciones_montecarlo(entradas_generales)
+        if opciones:
+            entradas_generales.montecarlo = opciones
+            datos['montecarlo'] = {'muestras': opciones['num_muestras'], 'semilla': opciones['semilla']}
+        self.data['entradas_generales'] = datos
+        self.peticion.entradas_generales = entradas_generales
+
+    def _calcular_aforos(self, indices, configuracion):
+        peticion = self.peticion
+        constantes = peticion.constantes
+        entradas_generales = peticion.entradas_generales
+        valores_nominales = peticion.valores_nominales
+        emt_comun = calculadora.buscar_emt_comun(valores_nominales, entradas_generales, configuracion)
+        opciones_montecarlo = calculadora.leer_opciones_montecarlo(entradas_generales)
+
+        for i in indices:
+            if self._promedios_brutos[i] is None:
+                promedio = calculadora.promediar_condiciones_brutas([peticion.ambientales[i]])[0]
+                self._promedios_brutos[i] = tuple(promedio.tolist())
+            resultado = calculadora.calcular_aforos_desde_promedios(
+                [peticion.masas[i]], [self._promedios_brutos[i]], [valores_nominales[i]], constantes,
+                entradas_generales.div_min_valor, valores_nominales[-1],
+                factores=calculadora.factores_memorizados(self._promedios_brutos[i], constantes),
+            )
+            if opciones_montecarlo:
+                resultado['montecarlo'] = calculadora.calcular_montecarlo(resultado, constantes, **opciones_montecarlo)
+            self._resultados[i] = calculadora.resultado_aforo(resultado, 0, valores_nominales[i], emt_comun)
+            self._condiciones[i] = resultado['promedios_ambientales'][0]
+
+        # El EMT es común a todos los aforos: si cambió el nominal máximo, cambia en todos
+        # (se reemplaza el diccionario: los anteriores se comparan para saber qué cambió)
+        for k, resultado in enumerate(self._resultados):
+            if resultado is not None and resultado['emt'] != emt_comun:
+                self._resultados[k] = {**resultado, 'emt': emt_comun}
+
+    def _generar_textos(self, configuracion):
+        return calculadora.generar_textos_reporte(
+            self.peticion.entradas_generales.datos, self._resultados,
+            configuracion.get('especificaciones_patrones', {}), configuracion.get('site_config', {})
+        )
+
+    def _validar(self, cambio, entradas):
+        """
+        Valida un cambio sobre `entradas`, las entradas generales que dejan los cambios
+        anteriores del mismo lote. Devuelve (posición del aforo o None, función que
+        aplica el cambio, entradas generales tras el cambio) sin modificar nada.
+        """
+        if not isinstance(cambio, dict):
+            raise ValueError("Cada cambio debe ser un objeto.")
+        campo = cambio.get('campo')
+        if campo == 'entradas_generales':
+            clave = cambio.get('clave')
+            if not isinstance(clave, str) or not clave:
+                raise ValueError("Falta 'clave' de la entrada general.")
+            # Se valida el resultado de todo el lote hasta aquí, no sólo esta entrada
+            nuevas = {**entradas, clave: cambio.get('valor')}
+            errores = []
+            entradas_generales = modelo.EntradasGenerales.desde_json(nuevas, errores)
+            modelo.validar_montecarlo(entradas_generales, len(self.claves), errores)
+            if errores:
+                raise modelo.ErrorValidacion(errores)
+            return None, lambda: self._fijar_entradas(nuevas, entradas_generales), nuevas
+
+        if campo not in CAMPOS_AFORO:
+            raise ValueError(f"'campo' debe ser 'entradas_generales' o uno de: {', '.join(CAMPOS_AFORO)}.")
+        numero = cambio.get('aforo')
+        if isinstance(numero, bool) or not isinstance(numero, int) or not 1 <= numero <= len(self.claves):
+            raise ValueError(f"'aforo' debe estar entre 1 y {len(self.claves)}: {numero!r}")
+        i = numero - 1
+        aforo = self.data[self.claves[i]]
+        valor = _valor_numerico(cambio)
+
+        # Se cambian a la vez el payload (para el calculo_id) y el modelo que usa el motor
+        if campo == 'valor_nominal':
+            def aplicar():
+                aforo['valor_nominal'] = valor
+                self.peticion.valores_nominales[i] = valor
+            return i, aplicar, entradas
+        if campo == 'mediciones_masa':
+            indice = _indice(cambio, aforo['mediciones_masa'])
+
+            def aplicar():
+                aforo['mediciones_masa'][indice] = valor
+                self.peticion.masas[i][indice] = valor
+            return i, aplicar, entradas
+
+        indice = _indice(cambio, aforo['mediciones_ambientales'])
+        magnitud = cambio.get('magnitud')
+        if magnitud not in CAMPOS_AMBIENTALES:
+            raise ValueError(f"'magnitud' debe ser una de: {', '.join(CAMPOS_AMBIENTALES)}.")
+
+        def aplicar():
+            aforo['mediciones_ambientales'][indice][magnitud] = valor
+            self.peticion.ambientales[i][indice, CAMPOS_AMBIENTALES.index(magnitud)] = valor
+            self._promedios_brutos[i] = None
+        return i, aplicar, entradas
+
+    def aplicar(self, cambios, configuracion):
+        """
+        Aplica una lista de cambios y recalcula lo necesario. Si algún cambio no es
+        válido, lanza ValueError sin aplicar ninguno. Devuelve la nueva versión, los
+        aforos cuyo resultado cambió ({"2": {...}}) y, si cambiaron, las condiciones
+        finales y los textos del reporte.
+        """
+        validados = []
+        entradas = self.data['entradas_generales']
+        for cambio in cambios:
+            posicion, aplicar, entradas = self._validar(cambio, entradas)
+            validados.append((posicion, aplicar))
+        anteriores = list(self._resultados)
+        afectados = set()
+        todos = textos = False
+        for cambio, (posicion, aplicar) in zip(cambios, validados):
+            aplicar()
+            if posicion is None:
+                todos = textos = True
+                continue
+            afectados.add(posicion)
+            if cambio['campo'] == 'valor_nominal':
+                textos = True
+                # El nominal del último aforo es el divisor del error porcentual de todos
+                if posicion == len(self.claves) - 1:
+                    todos = True
+
+        self._calcular_aforos(range(len(self.claves)) if todos else sorted(afectados), configuracion)
+        self.version += 1
+        self.ultimo_uso = time.monotonic()
+
+        respuesta = {
+            'version': self.version,
+            'aforos': {
+                str(i + 1): resultado
+                for i, (resultado, anterior) in enumerate(zip(self._resultados, anteriores))
+                if resultado != anterior
+            },
+        }
+        condiciones_finales = calculadora.promediar_condiciones_finales(self._condiciones)
+        if condiciones_finales != self._condiciones_finales:
+            self._condiciones_finales = respuesta['condiciones_finales'] = condiciones_finales
+        if textos:
+            textos_reporte = self._generar_textos(configuracion)
+            if textos_reporte != self._textos:
+                self._textos = respuesta['textos_reporte'] = textos_reporte
+        return respuesta
+
+    def resultados(self):
+        """Resultados completos, con la misma estructura que /calcular."""
+        return {
+            'aforos': list(self._resultados),
+            'textos_reporte': self._textos,
+            'condiciones_finales': self._condiciones_finales,
+        }
+
+class AlmacenSesiones:
+    """
+    Sesiones activas (LRU). Una sesión sin uso durante `expiracion_s` segundos se
+    descarta; con más de `max_sesiones`, se descarta la usada hace más tiempo.
+    """
+
+    def __init__(self, max_sesiones=200, expiracion_s=3600):
+        self.max_sesiones = max_sesiones
+        self.expiracion_s = expiracion_s
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purgar(self, ahora):
+        while self._sesiones:
+            sesion_id, sesion = next(iter(self._sesiones.items()))
+            if ahora - sesion.ultimo_uso <= self.expiracion_s and len(self._sesiones) <= self.max_sesiones:
+                break
+            del self._sesiones[sesion_id]
+
+    def crear(self, data, configuracion):
+        """Calcula el payload completo y devuelve (sesion_id, sesion)."""
+        sesion = SesionCalculo(data, configuracion)
+        sesion_id = uuid.uuid4().hex
+        with self._lock:
+            self._sesiones[sesion_id] = sesion
+            self._purgar(time.monotonic())
+        return sesion_id, sesion
+
+    def obtener(self, sesion_id):
+        with self._lock:
+            self._purgar(time.monotonic())
+            sesion = self._sesiones.get(sesion_id)
+            if sesion is not None:
+                self._sesiones.move_to_end(sesion_id)
+                sesion.ultimo_uso = time.monotonic()
+            return sesion
+
+    def eliminar(self, sesion_id):
+        with self._lock:
+            return self._sesiones.pop(sesion_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sesiones)
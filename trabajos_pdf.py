@@ -0,0 +1,204 @@
+"""
+Cola de trabajos en segundo plano para generar PDF sin bloquear las peticiones.
+
+Los trabajos se ejecutan en un pool de procesos acotado y su estado vive en memoria
+del proceso: no se necesita un broker externo. Con un backend de estado compartido
+(estado.py) el estado de cada trabajo se publica además allí, y cualquier instancia
+puede responder GET /exportar-pdf/<id> (estado y descarga) de un trabajo encolado en otra.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import reportes
+from calculadora import contexto_procesos
+
+class ColaLlenaError(Exception):
+    """Se alcanzó el máximo de trabajos pendientes."""
+
+ERROR_PROCESO_CAIDO = "El proceso que generaba el PDF terminó inesperadamente; intente de nuevo."
+
+def _codificar_trabajo(trabajo):
+    # Encabezado JSON en una línea y, detrás, el PDF tal cual
+    encabezado = {k: v for k, v in trabajo.items() if k != 'pdf'}
+    return json.dumps(encabezado).encode('utf-8') + b'\n' + (trabajo['pdf'] or b'')
+
+def _decodificar_trabajo(contenido):
+    linea, _, pdf = contenido.partition(b'\n')
+    trabajo = json.loads(linea)
+    trabajo['pdf'] = pdf if trabajo['estado'] == 'terminado' else None
+    return trabajo
+
+class ColaTrabajosPDF:
+    """
+    Ejecuta `reportes.renderizar_pdf` en procesos separados y conserva el resultado
+    de cada trabajo hasta que expira.
+
+    - max_workers: renders simultáneos (procesos del pool).
+    - max_pendientes: trabajos sin terminar admitidos antes de rechazar nuevos.
+    - expiracion_s: segundos que se conserva un trabajo terminado.
+    - max_bytes: total de bytes de PDF terminados que se conservan; al superarlo se
+      descartan antes de expirar los trabajos terminados más antiguos.
+    - cache: CachePDF opcional; un acierto termina el trabajo sin renderizar.
+    - estado: backend de estado opcional; si es compartido, los trabajos se publican
+      en su espacio 'trabajos_pdf'. Los renders y `max_pendientes` son de cada instancia.
+    """
+
+    def __init__(self, max_workers=2, max_pendientes=20, expiracion_s=600, cache=None, estado=None,
+                 max_bytes=64 * 1024 * 1024):
+        self.max_workers = max_workers
+        self.cache = cache
+        self.max_pendientes = max_pendientes
+        self.expiracion_s = expiracion_s
+        self.max_bytes = max_bytes
+        self._pool = None
+        self._trabajos = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._publicados = None
+        if estado is not None and estado.compartido:
+            self._publicados = estado.espacio(
+                'trabajos_pdf', codificar=_codificar_trabajo, decodificar=_decodificar_trabajo,
+                expiracion_s=expiracion_s,
+            )
+
+    def _publicar(self, trabajo):
+        if self._publicados is not None:
+            self._publicados.guardar(trabajo['id'], {k: v for k, v in trabajo.items() if k != 'futuro'})
+
+    def _obtener_pool(self):
+        # El pool se crea en el primer trabajo para no lanzar procesos en cada arranque
+        # (dentro de una petición: sin fork, ver calculadora.contexto_procesos).
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=contexto_procesos())
+        return self._pool
+
+    def _enviar_render(self, rendered_html):
+        # Si un proceso murió (memoria, fallo de Pango) el pool queda roto: se reemplaza
+        # y se reintenta una vez, como el pool del lote en calculadora.procesar_lote_iter
+        try:
+            return self._obtener_pool().submit(reportes.renderizar_pdf, rendered_html)
+        except BrokenProcessPool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            return self._obtener_pool().submit(reportes.renderizar_pdf, rendered_html)
+
+    def _purgar_expirados(self, ahora):
+        expirados = [
+            id_trabajo for id_trabajo, trabajo in self._trabajos.items()
+            if trabajo['terminado'] is not None and ahora - trabajo['terminado'] > self.expiracion_s
+        ]
+        # Por encima de max_bytes se descartan también los terminados más antiguos
+        # (salvo el último, aunque supere el límite por sí solo)
+        exceso = self._bytes - self.max_bytes
+        if exceso > 0:
+            terminados = sorted(
+                (trabajo for id_trabajo, trabajo in self._trabajos.items()
+                 if trabajo['pdf'] is not None and id_trabajo not in expirados),
+                key=lambda trabajo: trabajo['terminado'],
+            )
+            for trabajo in terminados[:-1]:
+                if exceso <= 0:
+                    break
+                expirados.append(trabajo['id'])
+                exceso -= len(trabajo['pdf'])
+        for id_trabajo in expirados:
+            self._bytes -= len(self._trabajos.pop(id_trabajo)['pdf'] or b'')
+
+    def pendientes(self):
+        """Número de trabajos en cola o en proceso."""
+        with self._lock:
+            return sum(1 for trabajo in self._trabajos.values() if trabajo['terminado'] is None)
+
+    def enviar(self, rendered_html, file_name, clave=None):
+        """
+        Encola el render de un reporte y devuelve el id del trabajo.
+        `clave` es la clave de caché del reporte, si se usa caché.
+        Lanza ColaLlenaError si ya hay `max_pendientes` trabajos sin terminar.
+        """
+        pdf_en_cache = self.cache.obtener(clave) if self.cache is not None and clave else None
+
+        with self._lock:
+            ahora = time.time()
+            self._purgar_expirados(ahora)
+            pendientes = sum(1 for trabajo in self._trabajos.values() if trabajo['terminado'] is None)
+            if pendientes >= self.max_pendientes and pdf_en_cache is None:
+                raise ColaLlenaError(f"Hay {pendientes} PDF en cola; intente de nuevo en unos segundos.")
+
+            id_trabajo = uuid.uuid4().hex
+            trabajo = {
+                'id': id_trabajo,
+                'estado': 'pendiente',
+                'file_name': file_name,
+                'clave': clave,
+                'creado': ahora,
+                'terminado': None,
+                'pdf': None,
+                'error': None,
+            }
+            if pdf_en_cache is not None:
+                trabajo.update(estado='terminado', pdf=pdf_en_cache, terminado=ahora)
+                self._trabajos[id_trabajo] = trabajo
+                self._bytes += len(pdf_en_cache)
+                self._purgar_expirados(ahora)
+            else:
+                # Se registra después de encolarlo: si el envío falla no queda un pendiente huérfano
+                futuro = trabajo['futuro'] = self._enviar_render(rendered_html)
+                self._trabajos[id_trabajo] = trabajo
+
+        self._publicar(trabajo)
+        if pdf_en_cache is not None:
+            return id_trabajo
+        futuro.add_done_callback(lambda f: self._finalizar(id_trabajo, f))
+        return id_trabajo
+
+    def _finalizar(self, id_trabajo, futuro):
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None:
+                return
+            try:
+                trabajo['pdf'] = futuro.result()
+                trabajo['estado'] = 'terminado'
+                self._bytes += len(trabajo['pdf'])
+            except BrokenProcessPool:
+                trabajo['error'] = ERROR_PROCESO_CAIDO
+                trabajo['estado'] = 'error'
+            except Exception as e:
+                trabajo['error'] = str(e) or type(e).__name__
+                trabajo['estado'] = 'error'
+            trabajo['terminado'] = time.time()
+            trabajo.pop('futuro', None)
+            pdf, clave = trabajo['pdf'], trabajo['clave']
+            self._purgar_expirados(trabajo['terminado'])
+        self._publicar(trabajo)
+        if pdf is not None and clave and self.cache is not None:
+            self.cache.guardar(clave, pdf)
+
+    def consultar(self, id_trabajo):
+        """
+        Devuelve una copia del estado del trabajo ('pendiente', 'procesando',
+        'terminado' o 'error'), o None si no existe o ya expiró.
+        """
+        with self._lock:
+            self._purgar_expirados(time.time())
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is not None:
+                estado = dict(trabajo)
+        if trabajo is None:
+            # Encolado en otra instancia: su estado publicado ('pendiente' hasta que termina)
+            return self._publicados.obtener(id_trabajo) if self._publicados is not None else None
+        futuro = estado.pop('futuro', None)
+        if estado['estado'] == 'pendiente' and futuro is not None and futuro.running():
+            estado['estado'] = 'procesando'
+        return estado
+
+    def cerrar(self):
+        """Detiene el pool de procesos (los trabajos pendientes se cancelan)."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None